@@ -5,6 +5,7 @@ import getpass  # For secure password input
 import os
 import re  
 from datetime import datetime  
+from user_model import normalize_username, with_username_lower
 
 # Load environment variables from .env file
 load_dotenv()
@@ -62,7 +63,7 @@ def add_user():
         return
 
     # Check if the username already exists
-    if users_collection.find_one({'username': username}):
+    if users_collection.find_one({'username_lower': normalize_username(username)}):
         print(f"The username '{username}' is already taken.")
         return
 
@@ -110,7 +111,7 @@ def add_user():
 
     # Insert the user into the collection
     try:
-        users_collection.insert_one(user)
+        users_collection.insert_one(with_username_lower(user))
         print(f"User '{email}' added successfully as a '{user_type}'!")
     except Exception as e:
         print("An error occurred while adding the user:", e)
@@ -0,0 +1,240 @@
+# addresses.py
+# Local copy of the OSM addresses in our service region. houses-in-area and
+# /api/houses answer from the `addresses` collection (2dsphere index on loc)
+# instead of querying the public Overpass API on every request.
+#
+#   python addresses.py import region.osm.pbf    # Geofabrik-style extract (needs `pip install osmium`)
+#   python addresses.py import dump.json         # Overpass JSON ("out center tags")
+#
+# Imports upsert by OSM id, so re-running with a newer extract refreshes the
+# data in place. Overpass stays available as an optional, tile-cached refresh
+# source (overpass_tiles.py), off unless OVERPASS_REFRESH=true.
+import json
+import sys
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from db import get_collection
+from geometry import clip_items, dedup_items, ring_bbox
+
+IMPORT_BATCH_SIZE = 1000
+EARTH_RADIUS_MILES = 3958.8
+# Polygon lookups read the ring's bbox from the index, then clip exactly in
+# geometry.py. The pad covers geodesic vs. lat/lon-straight box edges.
+BBOX_PAD = 0.0001
+MAX_CANDIDATES = 20000
+
+# Fields returned to the apps (houses-in-area items).
+ITEM_FIELDS = {"address": 1, "city": 1, "state": 1, "zip": 1, "loc.coordinates": 1}
+
+
+# -------------------------------
+# OSM -> address documents
+# -------------------------------
+def address_from_tags(osm_id, tags, lon, lat, source):
+    """An `addresses` document for an OSM object with addr:* tags, or None."""
+    number = tags.get("addr:housenumber")
+    if not number or lon is None or lat is None:
+        return None
+    street = tags.get("addr:street") or tags.get("addr:road")
+    unit = tags.get("addr:unit")
+
+    line = " ".join(filter(None, [number, street]))
+    if unit:
+        line += f", Unit {unit}"
+
+    return {
+        "_id": osm_id,
+        "address": line,
+        "city": tags.get("addr:city") or tags.get("addr:town") or tags.get("addr:village") or "",
+        "state": tags.get("addr:state") or "",
+        "zip": tags.get("addr:postcode") or "",
+        "building": tags.get("building") or "",
+        "loc": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+        "source": source,
+    }
+
+
+def _from_overpass_element(el, source="overpass"):
+    if el.get("type") == "node":
+        lat, lon = el.get("lat"), el.get("lon")
+    else:
+        # way/relation: 'out center' gives us a center point
+        center = el.get("center") or {}
+        lat, lon = center.get("lat"), center.get("lon")
+    return address_from_tags(f"{el.get('type')}/{el.get('id')}", el.get("tags", {}), lon, lat, source)
+
+
+def upsert_addresses(docs):
+    """Insert or refresh address documents by OSM id. Returns the number written."""
+    if not docs:
+        return 0
+    now = datetime.utcnow()
+    ops = []
+    for doc in docs:
+        fields = {k: v for k, v in doc.items() if k != "_id"}
+        fields["updated_at"] = now
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}, upsert=True))
+    result = get_collection("addresses").bulk_write(ops, ordered=False)
+    return result.upserted_count + result.modified_count
+
+
+# -------------------------------
+# Offline import
+# -------------------------------
+def _iter_overpass_dump(path):
+    with open(path, "r", encoding="utf-8") as fh:
+        data = json.load(fh)
+    for el in data.get("elements", []):
+        doc = _from_overpass_element(el, source="osm_import")
+        if doc:
+            yield doc
+
+
+class _Batcher:
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.batch = []
+        self.seen = 0
+        self.written = 0
+
+    def add(self, doc):
+        if not doc:
+            return
+        self.batch.append(doc)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+            print(f"[ADDRESSES] {self.seen} read, {self.written} written")
+
+    def flush(self):
+        self.written += upsert_addresses(self.batch)
+        self.seen += len(self.batch)
+        self.batch = []
+
+
+def _import_pbf(path, batcher):
+    try:
+        import osmium
+    except ImportError:
+        raise SystemExit("Importing .pbf extracts needs pyosmium: pip install osmium")
+
+    class AddressHandler(osmium.SimpleHandler):
+        def node(self, n):
+            if "addr:housenumber" in n.tags:
+                batcher.add(address_from_tags(
+                    f"node/{n.id}", dict(n.tags), n.location.lon, n.location.lat, "osm_import"
+                ))
+
+        def way(self, w):
+            if "addr:housenumber" not in w.tags:
+                return
+            points = [(nd.lon, nd.lat) for nd in w.nodes if nd.location.valid()]
+            if not points:
+                return
+            lon = sum(p[0] for p in points) / len(points)
+            lat = sum(p[1] for p in points) / len(points)
+            batcher.add(address_from_tags(f"way/{w.id}", dict(w.tags), lon, lat, "osm_import"))
+
+    # Node locations are needed to place addressed buildings (ways).
+    AddressHandler().apply_file(path, locations=True)
+
+
+def import_file(path, batch_size=IMPORT_BATCH_SIZE):
+    """Load an OSM extract (.pbf) or Overpass JSON dump into `addresses`."""
+    batcher = _Batcher(batch_size)
+    if path.endswith(".pbf"):
+        _import_pbf(path, batcher)
+    else:
+        for doc in _iter_overpass_dump(path):
+            batcher.add(doc)
+    batcher.flush()
+    print(f"[ADDRESSES] done: {batcher.seen} read, {batcher.written} written")
+    return batcher.written
+
+
+# -------------------------------
+# Queries
+# -------------------------------
+def _to_item(doc):
+    lon, lat = doc["loc"]["coordinates"]
+    return {
+        "id": doc["_id"],
+        "address": doc.get("address", ""),
+        "city": doc.get("city", ""),
+        "state": doc.get("state", ""),
+        "zip": doc.get("zip", ""),
+        "lat": lat,
+        "lon": lon,
+    }
+
+
+def _find_items(geo_filter, limit):
+    cursor = get_collection("addresses").find({"loc": {"$geoWithin": geo_filter}}, ITEM_FIELDS)
+    if limit:
+        cursor = cursor.limit(limit)
+    return [_to_item(doc) for doc in cursor]
+
+
+def addresses_in_bbox(bbox, limit=MAX_CANDIDATES):
+    """Addresses inside [minLon, minLat, maxLon, maxLat] (padded by BBOX_PAD)."""
+    w, s, e, n = bbox[0] - BBOX_PAD, bbox[1] - BBOX_PAD, bbox[2] + BBOX_PAD, bbox[3] + BBOX_PAD
+    box = [[w, s], [e, s], [e, n], [w, n], [w, s]]
+    return _find_items({"$geometry": {"type": "Polygon", "coordinates": [box]}}, limit)
+
+
+def addresses_in_polygon(ring_lonlat, limit=None):
+    """
+    Distinct addresses inside a closed [[lon, lat], ...] ring, in
+    houses-in-area item shape.
+    """
+    candidates = addresses_in_bbox(ring_bbox(ring_lonlat))
+    items = dedup_items(clip_items(candidates, ring_lonlat))
+    return items[:limit] if limit else items
+
+
+def addresses_in_circle(center_lonlat, radius_miles, limit=None):
+    """Distinct addresses within radius_miles of [lon, lat]."""
+    lon, lat = center_lonlat
+    items = dedup_items(_find_items(
+        {"$centerSphere": [[float(lon), float(lat)], radius_miles / EARTH_RADIUS_MILES]},
+        MAX_CANDIDATES
+    ))
+    return items[:limit] if limit else items
+
+
+def buildings_in_circle(center_lonlat, radius_miles, building="residential", limit=None):
+    """
+    OSM buildings (ways/relations) tagged building=<building> within
+    radius_miles of [lon, lat], as {lat, lon, id} with the numeric OSM id.
+    Only addressed buildings are in the index, so unaddressed ones are missing.
+    """
+    lon, lat = center_lonlat
+    cursor = get_collection("addresses").find(
+        {
+            "loc": {"$geoWithin": {"$centerSphere": [[float(lon), float(lat)], radius_miles / EARTH_RADIUS_MILES]}},
+            "building": building,
+        },
+        {"loc.coordinates": 1}
+    ).limit(MAX_CANDIDATES)
+    houses = []
+    for doc in cursor:
+        osm_type, _, osm_id = doc["_id"].partition("/")
+        if osm_type not in ("way", "relation"):
+            continue
+        house_lon, house_lat = doc["loc"]["coordinates"]
+        houses.append({"lat": house_lat, "lon": house_lon, "id": int(osm_id)})
+        if limit and len(houses) >= limit:
+            break
+    return houses
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    if len(sys.argv) == 3 and sys.argv[1] == "import":
+        import_file(sys.argv[2])
+    else:
+        print("usage: python addresses.py import <extract.osm.pbf | overpass.json>")
+        sys.exit(2)
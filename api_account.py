@@ -3,12 +3,19 @@ from flask import Blueprint, request, jsonify, current_app
 from bson.objectid import ObjectId, InvalidId
 import jwt
 from extensions import csrf  
+from identity_cache import get_identity, invalidate_user
+from customer_search import refresh_search_fields
+from passwords import hash_password
 
 # Create a new blueprint for account settings API endpoints
 api_account_bp = Blueprint('api_account', __name__, url_prefix='/api/account')
 
 
-def get_user_from_token(token):
+def get_user_from_token(token, full=True):
+    """
+    The user a JWT belongs to. full=False returns the cached identity
+    (identity_cache) instead of the whole document.
+    """
     users_collection = current_app.config.get('USERS_COLLECTION')
     try:
         secret_key = current_app.config.get('JWT_SECRET', 'JWT_SECRET')
@@ -23,6 +30,9 @@ def get_user_from_token(token):
             current_app.logger.warning("[Account] Token missing 'sub'")
             return None
 
+        if not full:
+            return get_identity(user_id)
+
         user = users_collection.find_one({"_id": ObjectId(user_id)})
         print("User found in DB:", user)
         current_app.logger.info(f"[Account] User lookup result: {user}")
@@ -103,7 +113,7 @@ def update_account_settings():
     token = auth_header.replace("Bearer ", "").strip()
     current_app.logger.debug(f"[Account][PUT] Extracted token: {token}")
 
-    user = get_user_from_token(token)
+    user = get_user_from_token(token, full=False)
     if not user:
         current_app.logger.error("[Account][PUT] Invalid token or user not found")
         return jsonify({"error": "Invalid token or user not found."}), 404
@@ -134,6 +144,8 @@ def update_account_settings():
     users_collection = current_app.config.get('USERS_COLLECTION')
     try:
         result = users_collection.update_one({"_id": user['_id']}, {"$set": update_fields})
+        refresh_search_fields(users_collection, user['_id'])
+        invalidate_user(user['_id'])
         current_app.logger.info(f"[Account][PUT] Update result: matched={result.matched_count}, modified={result.modified_count}")
         if result.modified_count >= 1:
             return jsonify({"message": "Account settings updated successfully."}), 200
@@ -195,9 +207,6 @@ from flask import Blueprint, request, jsonify, current_app
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-bcrypt = Bcrypt()
-
 
 @csrf.exempt
 @api_account_bp.route("/reset-password/confirm", methods=["POST"])
@@ -245,7 +254,7 @@ def reset_password_confirm():
         return jsonify({"error": "Invalid or expired token"}), 400
 
     # Hash the new password
-    hashed_password = bcrypt.generate_password_hash(new_password).decode('utf-8')
+    hashed_password = hash_password(new_password)
 
     # Update the user's password and remove the reset token
     users_collection.update_one(
@@ -1,9 +1,10 @@
 #api_auth.py
 
 from flask import Blueprint, request, jsonify, current_app
-from flask_bcrypt import check_password_hash
 from bson.objectid import ObjectId
 from extensions import csrf  
+from user_model import normalize_username
+from passwords import verify_password
 from datetime import datetime, timedelta
 import jwt
 
@@ -44,12 +45,18 @@ def api_login():
         current_app.logger.error("Login failed: Missing username or password in payload.")
         return jsonify({"error": "Username and password required."}), 400
 
-    username = data['username'].strip().lower()
+    raw_username = (data['username'] or "").strip()
+    username = normalize_username(raw_username)
     password = data['password']
     current_app.logger.info(f"Login attempt for username: {username}")
 
+    # Exact match on the normalized key: one seek on the unique username_lower index.
     users_collection = current_app.config.get('USERS_COLLECTION')
-    user = users_collection.find_one({"username": {"$regex": f"^{username}$", "$options": "i"}})
+    user = users_collection.find_one({"username_lower": username})
+    if not user and raw_username:
+        # Users migrate_usernames.py couldn't key (case clashes) or hasn't
+        # reached yet still log in with their exact username (username_1 index).
+        user = users_collection.find_one({"username": raw_username})
     
     if not user:
         current_app.logger.error(f"Login failed: No user found with username {username}.")
@@ -61,7 +68,7 @@ def api_login():
         return jsonify({"error": "User record is incomplete."}), 500
 
     # Verify the password
-    if not check_password_hash(user.get('password', ''), password):
+    if not verify_password(users_collection, user, password):
         current_app.logger.error(f"Login failed: Invalid password for username {username}.")
         return jsonify({"error": "Invalid password."}), 401
 
@@ -11,8 +11,14 @@ import requests
 from jwt import ExpiredSignatureError, InvalidTokenError
 from postmark_client import is_valid_email  # already imported above
 import os
+import hashlib
+import hmac
+import secrets
 from datetime import datetime
 import pytz
+from pagination import keyset_page, encode_cursor, InvalidCursor
+from projections import projection
+from identity_cache import get_identity
 
 
 api_sales_bp = Blueprint('api_sales', __name__, url_prefix='/api')
@@ -71,7 +77,7 @@ def fetch_orders():
         current_app.logger.error("[Orders] USERS_COLLECTION not configured in app config")
         return jsonify({"error": "Server misconfiguration: missing users collection."}), 500
 
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    user = get_identity(user_id)
     current_app.logger.info(f"[Orders] User lookup result: {user}")
 
     if not user:
@@ -85,19 +91,38 @@ def fetch_orders():
         return jsonify({"error": "Orders collection not configured."}), 500
 
     # Step 5: Pagination
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 20))
-    skip = (page - 1) * per_page
-    current_app.logger.info(f"[Orders] Pagination: page={page}, per_page={per_page}, skip={skip}")
+    # New clients page with ?cursor=<next_cursor>. ?page=N is still honoured
+    # for app versions that predate cursors.
+    per_page = min(int(request.args.get('per_page', 20)), 100)
+    cursor = request.args.get('cursor')
+    legacy_page = request.args.get('page', type=int)
+    current_app.logger.info(f"[Orders] Pagination: cursor={bool(cursor)}, page={legacy_page}, per_page={per_page}")
 
     # Step 6: Query by salesperson
     query = {"salesperson": user_id}
     current_app.logger.info(f"[Orders] MongoDB query: {query}")
 
-    total_orders = orders_collection.count_documents(query)
-    current_app.logger.info(f"[Orders] Total matching orders: {total_orders}")
-
-    orders_cursor = orders_collection.find(query).skip(skip).limit(per_page)
+    total_orders = None
+    if legacy_page and not cursor:
+        total_orders = orders_collection.count_documents(query)
+        orders_cursor = list(
+            orders_collection.find(query, projection("order_api"))
+            .sort([("creation_date", -1), ("_id", -1)])
+            .skip((legacy_page - 1) * per_page)
+            .limit(per_page)
+        )
+        next_cursor = None
+        if len(orders_cursor) == per_page:
+            last = orders_cursor[-1]
+            next_cursor = encode_cursor("creation_date", last.get("creation_date"), last["_id"])
+    else:
+        try:
+            result = keyset_page(orders_collection, query, "creation_date", limit=per_page, after=cursor,
+                                 projection=projection("order_api"))
+        except InvalidCursor:
+            return jsonify({"error": "Invalid cursor"}), 400
+        orders_cursor = result["items"]
+        next_cursor = result["next"]
 
     # Step 7: Process orders
     orders = []
@@ -111,12 +136,14 @@ def fetch_orders():
 
     current_app.logger.info(f"[Orders] Returning {len(orders)} orders for user {user_id}")
 
-    return jsonify({
+    response = {
         "orders": orders,
-        "page": page,
         "per_page": per_page,
-        "total_orders": total_orders
-    }), 200
+        "next_cursor": next_cursor,
+    }
+    if total_orders is not None:
+        response.update({"page": legacy_page, "total_orders": total_orders})
+    return jsonify(response), 200
 
 
 
@@ -148,7 +175,13 @@ def get_services():
 
 
 
-from notis import notify_admins_new_order, notify_salesperson_new_order_push
+from order_setup import submit_order_setup
+from webhooks import store_event, submit_event
+from stats import record_order_created, record_order_deleted, record_user_created
+from order_model import normalize_order
+from pymongo.errors import DuplicateKeyError
+from user_model import with_username_lower, username_in_use
+from passwords import hash_password, PasswordHashingBusy
 
 @api_sales_bp.route('/guest_order', methods=['POST'])
 def create_order():
@@ -176,10 +209,19 @@ def create_order():
     # Travel fee logic
     order_data["travel_fee"] = 25.0 if final_price_for_fee < 90 else 0.0
 
+    # Canonical date types (service_date / creation_date as UTC datetimes)
+    try:
+        order_data = normalize_order(order_data)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+
     # Setup state
     order_data["setup_status"] = "creating"   # creating | ready | failed
     order_data["setup_error"] = None
     order_data["updated_date"] = datetime.utcnow()
+    # Only the caller gets the token; the order keeps its hash.
+    status_token = secrets.token_urlsafe(24)
+    order_data["status_token_hash"] = _status_token_hash(status_token)
 
     # ---------- INSERT ORDER ----------
     try:
@@ -187,175 +229,72 @@ def create_order():
         order_id = str(insert_result.inserted_id)
     except Exception:
         return jsonify({"error": "Failed to create order in database."}), 500
+    record_order_created(is_guest=True)
 
-    def fail_and_return(message: str, details: str):
-        # avoid dumping huge/secret details back to client
-        safe_details = (details or "")[:500]
-
-        try:
-            orders_collection.update_one(
-                {"_id": ObjectId(order_id)},
-                {"$set": {
-                    "setup_status": "failed",
-                    "setup_error": f"{message}: {safe_details}",
-                    "updated_date": datetime.utcnow()
-                }}
-            )
-        except Exception:
-            pass
-
-        return jsonify({
-            "message": "Order created, but setup failed.",
-            "order_id": order_id,
-            "setup_status": "failed",
-            "error": message
-        }), 201
-
-    # ---------- STRIPE + EMAIL ----------
-    try:
-        if "final_price" not in order_data:
-            raise ValueError("Missing final_price")
-
-        final_price = float(order_data["final_price"])
-        downpayment_amount = int(final_price * 100 * 0.40)
-        remaining_amount = int(final_price * 100 * 0.60)
+    # ---------- STRIPE + EMAIL (order_setup worker) ----------
+    submit_order_setup(order_id)
 
-        stripe.api_key = current_app.config["STRIPE_SECRET_KEY"]
+    return jsonify({
+        "message": "Order created; setup in progress.",
+        "order_id": order_id,
+        "setup_status": "creating",
+        "status_token": status_token,
+        "status_url": f"/api/guest_order/{order_id}/status?token={status_token}"
+    }), 202
 
-        downpayment_intent = stripe.PaymentIntent.create(
-            amount=downpayment_amount,
-            currency="usd",
-            payment_method_types=["card"],
-            metadata={"order_id": order_id, "payment_type": "downpayment"}
-        )
 
-        remaining_intent = stripe.PaymentIntent.create(
-            amount=remaining_amount,
-            currency="usd",
-            payment_method_types=["card"],
-            metadata={"order_id": order_id, "payment_type": "remaining_balance"},
-            capture_method="manual"
-        )
+# Seconds a client should wait before polling a "creating" order again.
+SETUP_POLL_AFTER = 1
 
-        success_url = current_app.config.get(
-            "CHECKOUT_SUCCESS_URL",
-            "https://www.cfautocare.biz/payment_success?session_id={CHECKOUT_SESSION_ID}"
-        )
-        cancel_url = current_app.config.get(
-            "CHECKOUT_CANCEL_URL",
-            "https://www.cfautocare.biz/payment_cancel"
-        )
 
-        downpayment_checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            line_items=[{
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {"name": f"Down Payment for Order #{order_id}"},
-                    "unit_amount": downpayment_amount,
-                },
-                "quantity": 1,
-            }],
-            customer_email=order_data.get("guest_email"),
-            success_url=success_url,
-            cancel_url=cancel_url,
-            payment_intent_data={"metadata": {"order_id": order_id, "payment_type": "downpayment"}},
-            mode="payment"
-        )
+def _status_token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
-        remaining_checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            line_items=[{
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {"name": f"Remaining Balance for Order #{order_id}"},
-                    "unit_amount": remaining_amount,
-                },
-                "quantity": 1,
-            }],
-            customer_email=order_data.get("guest_email"),
-            success_url=success_url,
-            cancel_url=cancel_url,
-            payment_intent_data={"metadata": {"order_id": order_id, "payment_type": "remaining_balance"}},
-            mode="payment"
-        )
 
-        # Save Stripe metadata first
-        orders_collection.update_one(
-            {"_id": ObjectId(order_id)},
-            {"$set": {
-                "payment_intent_downpayment": downpayment_intent.id,
-                "client_secret_downpayment": downpayment_intent.client_secret,
-                "payment_intent_remaining_balance": remaining_intent.id,
-                "client_secret_remaining_balance": remaining_intent.client_secret,
-                "downpayment_checkout_url": downpayment_checkout_session.url,
-                "remaining_balance_checkout_url": remaining_checkout_session.url,
-                "payment_status": order_data.get("payment_status", "Pending"),
-                "has_downpayment_collected": "no",
-                "updated_date": datetime.utcnow()
-            }}
-        )
-
-        # Send customer payment links
-        result = send_payment_links(order_id)
-        try:
-            status_code = result[1]
-        except Exception:
-            status_code = 500
-
-        if status_code != 200:
-            try:
-                orders_collection.update_one(
-                    {"_id": ObjectId(order_id)},
-                    {"$set": {
-                        "setup_status": "failed",
-                        "setup_error": f"Failed to send payment links: {str(result)[:500]}",
-                        "updated_date": datetime.utcnow()
-                    }}
-                )
-            except Exception:
-                pass
-
-            return jsonify({
-                "message": "Order created, Stripe ready, but email failed.",
-                "order_id": order_id,
-                "setup_status": "failed",
-                "downpayment_checkout_url": downpayment_checkout_session.url,
-                "remaining_balance_checkout_url": remaining_checkout_session.url
-            }), 201
-
-        # Mark ready only after email succeeds
-        orders_collection.update_one(
-            {"_id": ObjectId(order_id)},
-            {"$set": {
-                "setup_status": "ready",
-                "setup_error": None,
-                "updated_date": datetime.utcnow()
-            }}
-        )
+@api_sales_bp.route('/guest_order/<order_id>/status', methods=['GET'])
+def guest_order_status(order_id):
+    """
+    Setup progress for an order created through /guest_order. Needs the
+    status_token from the 202 (?token= or X-Order-Token), since the answer
+    carries the checkout URLs. Answers at once; while the order is still
+    "creating" a Retry-After header says when to ask again.
+    """
+    orders_collection = current_app.config.get('ORDERS_COLLECTION')
+    if orders_collection is None:
+        return jsonify({"error": "Orders collection not configured."}), 500
 
-        # Fire-and-forget notifications (now that it's truly ready)
-        try:
-            print("[DEBUG] calling notify_admins_new_order", order_id)
-            notify_admins_new_order(order_id)
-        except Exception:
-            current_app.logger.error("notify_admins_new_order failed", exc_info=True)
+    try:
+        oid = ObjectId(order_id)
+    except Exception:
+        return jsonify({"error": "Invalid order ID"}), 400
 
-        try:
-            notify_salesperson_new_order_push(order_id)
-        except Exception:
-            current_app.logger.error("notify_salesperson_new_order_push failed", exc_info=True)
+    token = request.args.get("token") or request.headers.get("X-Order-Token") or ""
 
-        return jsonify({
-            "message": "Order created successfully.",
-            "order_id": order_id,
-            "setup_status": "ready",
-            "downpayment_checkout_url": downpayment_checkout_session.url,
-            "remaining_balance_checkout_url": remaining_checkout_session.url
-        }), 201
+    projection = {
+        "setup_status": 1,
+        "setup_error": 1,
+        "status_token_hash": 1,
+        "downpayment_checkout_url": 1,
+        "remaining_balance_checkout_url": 1
+    }
+    order = orders_collection.find_one({"_id": oid}, projection)
+    # Same answer for a missing order and a wrong token.
+    if not order or not token or not hmac.compare_digest(
+        order.get("status_token_hash") or "", _status_token_hash(token)
+    ):
+        return jsonify({"error": "Order not found"}), 404
 
-    except Exception as e:
-        return fail_and_return("Setup failed", str(e))
+    setup_status = order.get("setup_status", "ready")
+    response = jsonify({
+        "order_id": order_id,
+        "setup_status": setup_status,
+        "setup_error": order.get("setup_error"),
+        "downpayment_checkout_url": order.get("downpayment_checkout_url"),
+        "remaining_balance_checkout_url": order.get("remaining_balance_checkout_url")
+    })
+    if setup_status == "creating":
+        response.headers["Retry-After"] = str(SETUP_POLL_AFTER)
+    return response, 200
 
 
 
@@ -373,8 +312,7 @@ def update_order(order_id):
         return jsonify({"error": "Invalid or expired token"}), 401
 
     # Optionally, verify the user exists (like in fetch_orders)
-    users_collection = current_app.config['USERS_COLLECTION']
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    user = get_identity(user_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
 
@@ -394,6 +332,12 @@ def update_order(order_id):
     # Set updated timestamp if needed:
     update_data["updated_date"] = datetime.utcnow()
 
+    # Keep date fields typed (order_model)
+    try:
+        update_data = normalize_order(update_data)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+
     # Update the order (using $set for a partial update)
     result = orders_collection.update_one(
         {"_id": ObjectId(order_id), "salesperson": user_id},  # Ensure salesperson owns the order
@@ -425,9 +369,8 @@ def delete_order(order_id):
     current_app.logger.info(f"JWT decoded successfully. User ID: {user_id}")
 
     # Verify the user exists
-    users_collection = current_app.config['USERS_COLLECTION']
     try:
-        user_obj = users_collection.find_one({"_id": ObjectId(user_id)})
+        user_obj = get_identity(user_id)
     except Exception as e:
         current_app.logger.error(f"Error fetching user: {e}")
         return jsonify({"error": "Error fetching user"}), 500
@@ -475,6 +418,7 @@ def delete_order(order_id):
     if result.deleted_count == 0:
         current_app.logger.error("Order not found or unauthorized deletion attempt.")
         return jsonify({"error": "Order not found or unauthorized"}), 404
+    record_order_deleted(order_doc)
 
     current_app.logger.info(f"Order {order_id} deleted successfully by user {user_id}.")
     return jsonify({"message": "Order deleted successfully!"}), 200
@@ -551,90 +495,88 @@ def create_payment_intent():
 
 @api_sales_bp.route('/webhook', methods=['POST'])
 def stripe_webhook():
-    current_app.logger.info("Entered stripe_webhook endpoint")
-    
+    """
+    Verify and store the event, then answer Stripe right away. The order
+    updates and notifications run in handle_stripe_event (webhooks.py).
+    """
     payload = request.data
-    current_app.logger.info(f"Payload received: {payload[:100]}...")  # Log first 100 chars for brevity
-    
     sig_header = request.headers.get('Stripe-Signature')
-    current_app.logger.info(f"Stripe-Signature header: {sig_header}")
-    
     endpoint_secret = current_app.config.get('STRIPE_WEBHOOK_SECRET')
-    current_app.logger.info(f"Endpoint secret loaded from config")
-    
-    try:
-        event = stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
-        current_app.logger.info("Stripe event constructed successfully")
-        
-        # Check for successful payment intent event
-        if event['type'] == 'payment_intent.succeeded':
-            current_app.logger.info("Event type is payment_intent.succeeded")
-            intent = event['data']['object']
-            current_app.logger.info(f"PaymentIntent succeeded: {intent['id']}")
-            
-            order_id = intent.get('metadata', {}).get('order_id')
-            current_app.logger.info(f"Order ID from PaymentIntent metadata: {order_id}")
-            if not order_id:
-                current_app.logger.error(f"Order ID not found in payment intent: {intent['id']}")
-                return '', 400
-
-            orders_collection = current_app.config.get('ORDERS_COLLECTION')
-            if orders_collection is None:
-                current_app.logger.error("ORDERS_COLLECTION is not configured.")
-                return '', 500
-            current_app.logger.info("ORDERS_COLLECTION loaded successfully")
-            
-            order = orders_collection.find_one({"_id": ObjectId(order_id)})
-            if order is None:
-                current_app.logger.error(f"Order not found: {order_id}")
-                return '', 400
-            current_app.logger.info(f"Order retrieved: {order_id}")
-            
-            payment_type = intent.get('metadata', {}).get('payment_type')
-            current_app.logger.info(f"Payment type from metadata: {payment_type}")
-            if payment_type == 'downpayment':
-                current_app.logger.info("Processing downpayment update")
-                orders_collection.update_one(
-                    {"_id": ObjectId(order_id)},
-                    {"$set": {"has_downpayment_collected": "yes", "payment_status": "downpaymentcollected"}}
-                )
-                current_app.logger.info("Order updated with downpayment status")
-                
-                from notis import notify_techs_new_order
-                current_app.logger.info("Calling notify_techs_new_order")
-                notify_techs_new_order(order)
-                current_app.logger.info("notify_techs_new_order completed")
-                
-                from notis import send_downpayment_thankyou_email
-                current_app.logger.info("Calling send_downpayment_thankyou_email")
-                send_downpayment_thankyou_email(order)
-                current_app.logger.info("send_downpayment_thankyou_email completed")
-                
-            elif payment_type == 'remaining_balance':
-                current_app.logger.info("Processing remaining_balance update")
-                orders_collection.update_one(
-                    {"_id": ObjectId(order_id)},
-                    {"$set": {"payment_status": "completed"}}
-                )
-                current_app.logger.info("Order updated with remaining_balance status")
-                
-                from notis import send_remaining_payment_thankyou_email
-                current_app.logger.info("Calling send_remaining_payment_thankyou_email")
-                send_remaining_payment_thankyou_email(order)
-                current_app.logger.info("send_remaining_payment_thankyou_email completed")
-            else:
-                current_app.logger.warning(f"Unhandled payment type: {payment_type}")
-            
-            current_app.logger.info("Returning 200 response from webhook")
-            return '', 200
-        else:
-            current_app.logger.info(f"Ignoring event type: {event['type']}")
-            return '', 200
 
+    try:
+        stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
     except Exception as e:
-        current_app.logger.error(f"Error processing webhook: {e}")
+        current_app.logger.error(f"Error verifying webhook: {e}")
         return '', 400
 
+    try:
+        event_id = store_event(payload, source="api_sales")
+    except Exception as e:
+        current_app.logger.error(f"Error storing webhook event: {e}")
+        return '', 500
+
+    if event_id is None:
+        current_app.logger.info("Duplicate webhook delivery ignored")
+    else:
+        submit_event(current_app._get_current_object(), event_id)
+    return '', 200
+
+
+def handle_stripe_event(event):
+    """
+    Apply a stored Stripe event. Raises so webhooks.py can retry; every step
+    is safe to repeat, so a retry redoes only what didn't finish: the payment
+    flags are plain $sets, the tech notification is recorded in
+    techs_notified_at, and the thank-you emails go through the outbox under
+    a per-order idempotency key.
+    """
+    if event['type'] != 'payment_intent.succeeded':
+        current_app.logger.info(f"Ignoring event type: {event['type']}")
+        return
+
+    intent = event['data']['object']
+    current_app.logger.info(f"PaymentIntent succeeded: {intent['id']}")
+
+    order_id = intent.get('metadata', {}).get('order_id')
+    if not order_id:
+        current_app.logger.error(f"Order ID not found in payment intent: {intent['id']}")
+        return
+
+    orders_collection = current_app.config.get('ORDERS_COLLECTION')
+    order = orders_collection.find_one({"_id": ObjectId(order_id)})
+    if order is None:
+        current_app.logger.error(f"Order not found: {order_id}")
+        return
+
+    payment_type = intent.get('metadata', {}).get('payment_type')
+    current_app.logger.info(f"Payment type from metadata: {payment_type}")
+    if payment_type == 'downpayment':
+        orders_collection.update_one(
+            {"_id": ObjectId(order_id), "has_downpayment_collected": {"$ne": "yes"}},
+            {"$set": {"has_downpayment_collected": "yes", "payment_status": "downpaymentcollected"}}
+        )
+
+        from notis import notify_techs_new_order, send_downpayment_thankyou_email
+        if order.get("techs_notified_at"):
+            current_app.logger.info(f"Techs already notified for {order_id}")
+        else:
+            notify_techs_new_order(order)
+            orders_collection.update_one(
+                {"_id": ObjectId(order_id)}, {"$set": {"techs_notified_at": datetime.utcnow()}}
+            )
+        send_downpayment_thankyou_email(order)
+
+    elif payment_type == 'remaining_balance':
+        orders_collection.update_one(
+            {"_id": ObjectId(order_id), "payment_status": {"$ne": "completed"}},
+            {"$set": {"payment_status": "completed"}}
+        )
+
+        from notis import send_remaining_payment_thankyou_email
+        send_remaining_payment_thankyou_email(order)
+    else:
+        current_app.logger.warning(f"Unhandled payment type: {payment_type}")
+
 
 
 
@@ -755,7 +697,7 @@ def fetch_compensated_orders():
         # This query returns all orders where the 'salesperson' field matches the provided salesperson_id.
         # You can further filter based on compensation status if needed.
         query = {"salesperson": salesperson_id}
-        orders_cursor = orders_collection.find(query)
+        orders_cursor = orders_collection.find(query, projection("order_api"))
         orders = []
 
         for order in orders_cursor:
@@ -810,41 +752,20 @@ def get_order_remaining_time(order_id):
         if 'service_date' not in order:
             return jsonify({"error": "Service date not found"}), 400
 
-        if isinstance(order['service_date'], str):
-            try:
-                order['service_date'] = datetime.fromisoformat(order['service_date'])
-            except ValueError:
-                return jsonify({"error": "Invalid service date format"}), 400
-
-        # Print the service date for debugging
-        print("Service Date:", order['service_date'])
-
-        # If available, do the same for the creation_date
-        if 'creation_date' in order:
-            if isinstance(order['creation_date'], str):
-                try:
-                    order['creation_date'] = datetime.fromisoformat(order['creation_date'])
-                except ValueError:
-                    print(f"Invalid creation date format for order {order['_id']}")
-            print("Creation Date:", order.get('creation_date'))
-        else:
-            print(f"Creation Date not found for order {order['_id']}")
+        if not isinstance(order['service_date'], datetime):
+            return jsonify({"error": "Invalid service date format"}), 400
+
+        # Stored as naive UTC (order_model)
+        scheduled_time = order['service_date'].replace(tzinfo=pytz.UTC)
 
         # Calculate the remaining time until the service
-        remaining_time = calculate_remaining_time(order['service_date'])
+        remaining_time = calculate_remaining_time(scheduled_time)
         if "error" in remaining_time:
             return jsonify(remaining_time), 400
 
         # Use the current time in UTC
         current_time_utc = datetime.utcnow().replace(tzinfo=pytz.UTC)
 
-        # Ensure the service date is in UTC
-        scheduled_time = order['service_date']
-        if scheduled_time.tzinfo is None:
-            scheduled_time = scheduled_time.replace(tzinfo=pytz.UTC)
-        else:
-            scheduled_time = scheduled_time.astimezone(pytz.UTC)
-
         # Return the remaining time along with the current and scheduled times in UTC
         response = {
             "remaining_time": remaining_time,
@@ -1013,10 +934,8 @@ def get_device_token_for_user(user_id):
 import os
 import base64
 import traceback
-import tempfile
-from apns2.client import APNsClient
-from apns2.payload import Payload
 from flask import current_app
+from push import push_service, build_payload, SALES_TOPIC, SALES_CERT_ENV
 
 
 def send_notification_to_salesman(salesman_id, order_id, device_token, custom_message=None):
@@ -1026,43 +945,10 @@ def send_notification_to_salesman(salesman_id, order_id, device_token, custom_me
     message = custom_message or f"The Tech for {order_id} is on the way."
     current_app.logger.info(f"Preparing to send notification to salesman {salesman_id}: {message}")
 
-    # Retrieve the certificate from the environment variable.
-    cert_b64 = os.environ.get("APNS_CERT_B64_SALESMAN")
-    if not cert_b64:
-        current_app.logger.error("APNS certificate for salesman not configured in environment variable!")
-        return {"status": "error", "detail": "Salesman certificate not set"}
-
     try:
-        current_app.logger.info("Decoding APNs certificate from base64.")
-        cert_content = base64.b64decode(cert_b64)
-        current_app.logger.info("Writing APNs certificate to a temporary file.")
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pem") as temp_cert:
-            temp_cert.write(cert_content)
-            temp_cert_path = temp_cert.name
-        current_app.logger.info(f"APNs certificate written to temporary file: {temp_cert_path}")
-
-        # Construct the APNs payload.
-        current_app.logger.info("Constructing APNs payload...")
-        payload = Payload(alert={"title": "Order Update", "body": message}, sound="default", badge=1)
-        current_app.logger.info(f"Payload constructed: alert={payload.alert}, sound={payload.sound}, badge={payload.badge}")
-
-        # Specify the topic (bundle identifier) for your sales app.
-        topic = "com.Centralfloridaautocare.cfacios"  # Update this if your sales app's bundle identifier is different.
-        current_app.logger.info(f"Using topic: {topic}")
-
-        # Create the APNs client.
-        current_app.logger.info("Creating APNs client...")
-        client = APNsClient(temp_cert_path, use_sandbox=False, use_alternative_port=False)
-        current_app.logger.info("APNs client created successfully.")
-
-        # Send the notification.
-        current_app.logger.info("Sending push notification to device...")
-        response = client.send_notification(device_token, payload, topic=topic)
+        payload = build_payload("Order Update", message)
+        response = push_service.send(device_token, payload, topic=SALES_TOPIC, cert_env=SALES_CERT_ENV)
         current_app.logger.info(f"Push notification response: {response}")
-
-        # Clean up the temporary certificate file.
-        os.remove(temp_cert_path)
-        current_app.logger.info("Temporary certificate file removed.")
         return {"status": "sent", "detail": str(response)}
     except Exception as e:
         current_app.logger.error("Error sending push notification to salesman:")
@@ -1085,7 +971,6 @@ def send_notification_to_salesman(salesman_id, order_id, device_token, custom_me
 #Registration
 from flask import request, jsonify, current_app
 from datetime import datetime
-from extensions import bcrypt
 import re
 
 def is_valid_email(email):
@@ -1195,9 +1080,17 @@ def register_user():
     if existing_in_users or existing_in_approval:
         current_app.logger.error(f"Registration failed: Email {email} already exists.")
         return jsonify({"error": f"An account with email '{email}' already exists (or is pending approval)."}), 409
+    if username_in_use(username, db.users, users_to_approve_collection):
+        current_app.logger.error(f"Registration failed: Username {username} already exists.")
+        return jsonify({
+            "error": "username_in_use",
+            "message": f"An account with username '{username}' already exists (or is pending approval)."
+        }), 409
 
     try:
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        hashed_password = hash_password(password)
+    except PasswordHashingBusy:
+        raise  # 503 via error_handlers
     except Exception as e:
         current_app.logger.error(f"Error hashing password: {e}")
         return jsonify({"error": "Internal error while processing password."}), 500
@@ -1238,7 +1131,7 @@ def register_user():
 
     try:
         # Insert the pending user document.
-        result = users_to_approve_collection.insert_one(user_to_approve)
+        result = users_to_approve_collection.insert_one(with_username_lower(user_to_approve))
         current_app.logger.info(f"User registered successfully with _id: {result.inserted_id}")
         
         # Also store the device token in the separate device_tokens collection if provided.
@@ -1263,7 +1156,9 @@ def register_user():
 
 
 from flask import Flask, request, jsonify
-import requests
+from addresses import buildings_in_circle
+
+METERS_PER_MILE = 1609.344
 
 
 @api_sales_bp.route("/houses", methods=["GET"])
@@ -1272,60 +1167,9 @@ def get_houses():
     lon = float(request.args.get("lon"))
     radius = int(request.args.get("radius", 500))  # default 500m
 
-    # Overpass QL query for residential buildings within radius
-    query = f"""
-    [out:json];
-    (
-      way["building"="residential"](around:{radius},{lat},{lon});
-      relation["building"="residential"](around:{radius},{lat},{lon});
-    );
-    out center;
-    """
-
-    response = requests.post("https://overpass-api.de/api/interpreter", data={"data": query})
-    data = response.json()
-
-    houses = []
-    for element in data["elements"]:
-        if "center" in element:
-            houses.append({
-                "lat": element["center"]["lat"],
-                "lon": element["center"]["lon"],
-                "id": element["id"]
-            })
-
-    return jsonify(houses)
-
-
-
-@api_sales_bp.route("/api/houses-in-area", methods=["POST"])
-def houses_in_area():
-    data = request.get_json()
-    query = {}
-
-    if data.get("circle"):
-        lon, lat = data["circle"]["center"]
-        radius_miles = data["circle"]["radius"]
-        query = {
-            "location": {
-                "$geoWithin": {
-                    "$centerSphere": [[lon, lat], radius_miles / 3963.2]
-                }
-            }
-        }
-
-    elif data.get("polygon"):
-        query = {
-            "location": {
-                "$geoWithin": {
-                    "$polygon": data["polygon"]
-                }
-            }
-        }
-
-    houses = list(db.houses.find(query))
-    for h in houses:
-        h["_id"] = str(h["_id"])
+    # Residential buildings from the local address index (addresses.py), in
+    # the shape the old Overpass version returned: [{lat, lon, id}].
+    houses = buildings_in_circle([lon, lat], radius / METERS_PER_MILE, limit=2000)
     return jsonify(houses)
 
 
@@ -1591,14 +1435,21 @@ def register_sales_user():
         current_app.logger.error(f"[SALES REGISTER] {msg}")
         return jsonify({"ok": False, "error": "email_in_use", "message": msg}), 409
 
+    if username_in_use(username or email, users_collection, users_to_approve):
+        msg = f"Username '{username or email}' already exists (or is pending approval)."
+        current_app.logger.error(f"[SALES REGISTER] {msg}")
+        return jsonify({"ok": False, "error": "username_in_use", "message": msg}), 409
+
     # ---- hash password ----
     current_app.logger.info("[SALES REGISTER] Starting password hashing...")
     try:
-        hashed_pw = bcrypt.generate_password_hash(password).decode("utf-8")
+        hashed_pw = hash_password(password)
         current_app.logger.info(
             "[SALES REGISTER] Password hashing successful. "
             f"Hashed password length={len(hashed_pw)}"
         )
+    except PasswordHashingBusy:
+        raise  # 503 via error_handlers
     except Exception as e:
         current_app.logger.error(f"[SALES REGISTER] Error hashing password: {e}", exc_info=True)
         return jsonify({"error": "Internal error while processing password."}), 500
@@ -1622,12 +1473,23 @@ def register_sales_user():
 
     try:
         current_app.logger.info("[SALES REGISTER] Attempting to insert user_doc into users_collection...")
+        user_doc = with_username_lower(user_doc)
         res = users_collection.insert_one(user_doc)
         user_doc["_id"] = res.inserted_id
+        record_user_created("sales")
         current_app.logger.info(
             f"[SALES REGISTER] Inserted sales user successfully. _id={user_doc['_id']}, "
             f"inserted_id_type={type(user_doc['_id'])}"
         )
+    except DuplicateKeyError as e:
+        # Lost a race with another registration for the same email/username.
+        current_app.logger.error(f"[SALES REGISTER] Duplicate user: {e}")
+        field = "email" if "email" in (e.details or {}).get("keyPattern", {}) else "username"
+        return jsonify({
+            "ok": False,
+            "error": f"{field}_in_use",
+            "message": f"{field.capitalize()} already exists."
+        }), 409
     except Exception as e:
         current_app.logger.error(f"[SALES REGISTER] Insert failed: {e}", exc_info=True)
         return jsonify({"error": "Database insertion failed"}), 500
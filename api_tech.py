@@ -1,17 +1,18 @@
 from flask import Blueprint, request, jsonify, current_app
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
 import jwt
 import math
-from apns2.client import APNsClient
-from apns2.payload import Payload
-import tempfile
 import pytz
 import base64
 import os
 
-
+from reminders import schedule_order_reminders
+from push import push_service, build_payload, TECH_TOPIC, TECH_CERT_ENV
+from projections import projection
+from user_model import with_username_lower, username_in_use
+from passwords import hash_password
 
 
 api_tech_bp = Blueprint('api_tech', __name__, url_prefix='/api/tech')
@@ -29,24 +30,15 @@ def fetch_orders_with_downpayment():
                     {"orderhasbeenscheduled": {"$exists": False}},
                     {"orderhasbeenscheduled": False}
                 ]
-            })        
+            }, projection("order_api"))
         orders = []
 
         # Iterate through the orders and collect them
         for order in orders_cursor:
             order['_id'] = str(order['_id'])  # Convert ObjectId to string
 
-            # Check if 'service_date' is a string, and if so, convert it to a datetime object
-            if isinstance(order['service_date'], str):
-                try:
-                    # Try parsing the string to datetime
-                    order['service_date'] = datetime.fromisoformat(order['service_date'])
-                except ValueError:
-                    # If the string format is invalid, leave it as is (or handle as needed)
-                    current_app.logger.error(f"Invalid date format for order ID {order['_id']}")
-
-            # Convert datetime to ISO format if it's a datetime object
-            if isinstance(order['service_date'], datetime):
+            # service_date is always a datetime (order_model); send it as ISO
+            if isinstance(order.get('service_date'), datetime):
                 order['service_date'] = order['service_date'].isoformat()
 
             orders.append(order)
@@ -100,6 +92,11 @@ def update_order(order_id):
             {"_id": ObjectId(order_id)},
             {"$set": update_fields}
         )
+
+        try:
+            schedule_order_reminders(ObjectId(order_id))
+        except Exception as e:
+            current_app.logger.error(f"Error scheduling reminders for order {order_id}: {str(e)}")
         
         if result.modified_count > 0:
             # After successful update, check if the order has a guest email
@@ -228,7 +225,7 @@ def fetch_scheduled_orders():
 
         # Query for orders where the technician field matches the given technician_id.
         # This does not filter out orders based on any scheduling flag.
-        orders_cursor = orders_collection.find({"technician": technician_id})
+        orders_cursor = orders_collection.find({"technician": technician_id}, projection("order_api"))
         orders = []
         for order in orders_cursor:
             order['_id'] = str(order['_id'])
@@ -285,41 +282,20 @@ def get_order_remaining_time(order_id):
         if 'service_date' not in order:
             return jsonify({"error": "Service date not found"}), 400
 
-        if isinstance(order['service_date'], str):
-            try:
-                order['service_date'] = datetime.fromisoformat(order['service_date'])
-            except ValueError:
-                return jsonify({"error": "Invalid service date format"}), 400
-
-        # Print the service date for debugging
-        print("Service Date:", order['service_date'])
-
-        # If available, do the same for the creation_date
-        if 'creation_date' in order:
-            if isinstance(order['creation_date'], str):
-                try:
-                    order['creation_date'] = datetime.fromisoformat(order['creation_date'])
-                except ValueError:
-                    print(f"Invalid creation date format for order {order['_id']}")
-            print("Creation Date:", order.get('creation_date'))
-        else:
-            print(f"Creation Date not found for order {order['_id']}")
+        if not isinstance(order['service_date'], datetime):
+            return jsonify({"error": "Invalid service date format"}), 400
+
+        # Stored as naive UTC (order_model)
+        scheduled_time = order['service_date'].replace(tzinfo=pytz.UTC)
 
         # Calculate the remaining time until the service
-        remaining_time = calculate_remaining_time(order['service_date'])
+        remaining_time = calculate_remaining_time(scheduled_time)
         if "error" in remaining_time:
             return jsonify(remaining_time), 400
 
         # Use the current time in UTC
         current_time_utc = datetime.utcnow().replace(tzinfo=pytz.UTC)
 
-        # Ensure the service date is in UTC
-        scheduled_time = order['service_date']
-        if scheduled_time.tzinfo is None:
-            scheduled_time = scheduled_time.replace(tzinfo=pytz.UTC)
-        else:
-            scheduled_time = scheduled_time.astimezone(pytz.UTC)
-
         # Return the remaining time along with the current and scheduled times in UTC
         response = {
             "remaining_time": remaining_time,
@@ -579,31 +555,10 @@ def send_notification_to_tech(tech_id, order_id, threshold, device_token, custom
         
     current_app.logger.info(f"Preparing to send notification to technician {tech_id}: {message}")
 
-    # Retrieve the base64-encoded certificate from the environment.
-    cert_b64 = os.environ.get("APNS_CERT_B64")
-    if not cert_b64:
-        current_app.logger.error("APNS certificate not configured in environment variable!")
-        return {"status": "error", "detail": "Certificate not set"}
-
     try:
-        # Decode and write the certificate to a temporary file.
-        cert_content = base64.b64decode(cert_b64)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pem") as temp_cert:
-            temp_cert.write(cert_content)
-            temp_cert_path = temp_cert.name
-
-        current_app.logger.info(f"Using APNS certificate at temporary file: {temp_cert_path}")
-
-        # Create the APNs payload.
-        payload = Payload(alert={"title": "Order Reminder", "body": message}, sound="default", badge=1)
-        
-        # Create an APNs client. In production, set use_sandbox=False.
-        client = APNsClient(temp_cert_path, use_sandbox=False, use_alternative_port=False)
-        response = client.send_notification(device_token, payload, topic="biz.cfautocare.cfactech")
+        payload = build_payload("Order Reminder", message)
+        response = push_service.send(device_token, payload, topic=TECH_TOPIC, cert_env=TECH_CERT_ENV)
         current_app.logger.info(f"Push notification response: {response}")
-
-        # Clean up the temporary certificate file.
-        os.remove(temp_cert_path)
         return {"status": "sent", "detail": str(response)}
     except Exception as e:
         current_app.logger.error(f"Error sending push notification: {str(e)}")
@@ -618,138 +573,6 @@ from datetime import datetime
 import pytz
 
 
-def notify_techs_for_upcoming_orders():
-    current_app.logger.info("notify_techs_for_upcoming_orders triggered")
-    try:
-        # Connect to your orders collection.
-        orders_collection = current_app.config.get('MONGO_CLIENT').orders
-        if orders_collection is None:
-            current_app.logger.error("Orders collection not found in MONGO_CLIENT configuration!")
-            return
-
-        current_app.logger.info("Connected to the orders collection successfully.")
-
-        # Set the current time to UTC.
-        current_time = datetime.utcnow().replace(tzinfo=pytz.UTC)
-        current_app.logger.info(f"Current UTC time set to: {current_time}")
-
-        query = {"status": "ordered"}
-        current_app.logger.info(f"Executing query: {query}")
-
-        try:
-            matching_count = orders_collection.count_documents(query)
-            current_app.logger.info(
-                f"Found {matching_count} orders scheduled in the future with status not 'completed'."
-            )
-        except Exception as count_error:
-            current_app.logger.error(f"Error counting documents with query {query}: {str(count_error)}")
-            return
-
-        try:
-            orders_cursor = orders_collection.find(query)
-        except Exception as find_error:
-            current_app.logger.error(f"Error executing find with query {query}: {str(find_error)}")
-            return
-
-        # Define the thresholds in hours.
-        thresholds = [12, 6, 2, 1]
-
-        for order in orders_cursor:
-            try:
-                # 1. Retrieve the order ID.
-                order_id = str(order.get("_id", "unknown"))
-                current_app.logger.info(f"Found order with _id: {order_id}")
-
-                # 2. Convert the service_date to a datetime object.
-                service_date = order.get('service_date')
-                if not service_date:
-                    current_app.logger.error(f"Order {order_id} is missing the 'service_date' field.")
-                    continue
-
-                if isinstance(service_date, str):
-                    try:
-                        service_date = datetime.fromisoformat(service_date)
-                    except Exception as conv_err:
-                        current_app.logger.error(
-                            f"Error converting service_date for order {order_id}: {str(conv_err)}"
-                        )
-                        continue
-
-                if service_date.tzinfo is None:
-                    service_date = service_date.replace(tzinfo=pytz.UTC)
-                else:
-                    service_date = service_date.astimezone(pytz.UTC)
-                current_app.logger.info(f"Order {order_id} service_date converted to UTC: {service_date}")
-
-                # 3. Retrieve already-notified thresholds.
-                notified_thresholds = order.get("notified_thresholds", [])
-                current_app.logger.info(f"Order {order_id} already notified thresholds: {notified_thresholds}")
-
-                # 4. Calculate hours remaining.
-                time_diff = service_date - current_time
-                hours_remaining = time_diff.total_seconds() / 3600
-                current_app.logger.info(
-                    f"Order {order_id} is scheduled for {service_date}. Hours remaining: {hours_remaining:.2f}"
-                )
-
-                # 5. Retrieve technician information.
-                tech_id = order.get("technician")
-                if not tech_id:
-                    current_app.logger.error(f"Order {order_id} is missing the 'technician' field.")
-                    continue
-                current_app.logger.info(f"Order {order_id} is associated with technician ID: {tech_id}")
-
-                # 6. Check each threshold.
-                for threshold in thresholds:
-                    if hours_remaining <= threshold and threshold not in notified_thresholds:
-                        if threshold == 1:
-                            # Use a custom message when the order is 1 hour away.
-                            custom_message = "Update your order status and let the client know you're on the way!"
-                        else:
-                            custom_message = None  # Use the default message
-
-                        current_app.logger.info(
-                            f"Order {order_id} is within {threshold} hours. Sending push notification to technician {tech_id}."
-                        )
-                        
-                        # Retrieve the technician's device token.
-                        current_app.logger.info(f"Fetching device token for technician {tech_id}.")
-                        device_token = get_device_token_for_tech(tech_id)
-                        current_app.logger.info(f"Device token for technician {tech_id} is: {device_token}")
-                        if not device_token:
-                            current_app.logger.error("Device token not found, cannot send notification.")
-                            continue  # Skip to next threshold or order
-                        
-                        push_response = send_notification_to_tech(
-                            tech_id, 
-                            order_id, 
-                            threshold, 
-                            device_token,
-                            custom_message=custom_message
-                        )
-                        current_app.logger.info(f"Notification push response for order {order_id}: {push_response}")
-                        
-                        if push_response.get("status") == "sent":
-                            try:
-                                orders_collection.update_one(
-                                    {"_id": order["_id"]},
-                                    {"$push": {"notified_thresholds": threshold}}
-                                )
-                            except Exception as update_err:
-                                current_app.logger.error(
-                                    f"Error updating order {order_id} with notified threshold {threshold}: {str(update_err)}"
-                                )
-                        else:
-                            current_app.logger.error(
-                                f"Notification for threshold {threshold} failed for order {order_id}, will retry later."
-                            )
-            except Exception as order_error:
-                current_app.logger.error(f"Error processing order: {str(order_error)}")
-    except Exception as e:
-        current_app.logger.error(f"Error in notify_techs_for_upcoming_orders: {str(e)}")
-
-
-
 def fetch_upcoming_orders():
     # Get current UTC time
     current_time = datetime.utcnow().replace(tzinfo=pytz.utc)
@@ -773,15 +596,14 @@ from apscheduler.schedulers.background import BackgroundScheduler
 
 
 def start_scheduler(app):
+    from jobs import register_jobs
+
+    from reminders import start_dispatcher
+
     scheduler = BackgroundScheduler()
-    
-    # For testing: run every 3 minutes.
-    scheduler.add_job(
-        func=lambda: app.app_context().push() or notify_techs_for_upcoming_orders(),
-        trigger="interval",
-        minutes=30  # Change this to minutes=60 (or another interval) in production.
-    )
-    
+    register_jobs(scheduler, app)  # Each job takes a Mongo lease before running
+    start_dispatcher(app)  # Tech reminders fire from a precomputed timeline
+
     app.logger.info("Scheduler call started")  # Log a simple fixed message
     
     scheduler.start()
@@ -796,7 +618,6 @@ def start_scheduler(app):
 from postmark_client import is_valid_email
 
 
-from extensions import bcrypt
 import logging
 
 
@@ -851,8 +672,16 @@ def register_tech_user():
             "message": "Email already exists or is pending approval."
         }), 409
 
+    if username_in_use(username or email, users, users_to_approve):
+        logger.warning("⚠️ Username already exists or pending approval.")
+        return jsonify({
+            "ok": False,
+            "error": "username_in_use",
+            "message": "Username already exists or is pending approval."
+        }), 409
+
     logger.info("Generating password hash")
-    hashed_pw = bcrypt.generate_password_hash(password).decode("utf-8")
+    hashed_pw = hash_password(password)
 
     tech_doc = {
         "email": email,
@@ -867,7 +696,7 @@ def register_tech_user():
     }
 
     logger.info("Inserting into users_to_approve collection")
-    users_to_approve.insert_one(tech_doc)
+    users_to_approve.insert_one(with_username_lower(tech_doc))
 
     logger.info("✅ Tech registration submitted successfully")
 
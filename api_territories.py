@@ -3,40 +3,19 @@ from flask import Blueprint, request, jsonify
 from flask import current_app as app
 from datetime import datetime
 import os
-from math import inf
 import jwt
 from extensions import csrf
-from pymongo import MongoClient
 from bson import ObjectId
 from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from geometry import ring_bbox, dedup_items, coord_keys
 
 api_territories_bp = Blueprint("api_territories", __name__)
 
 # -------------------------------
-# DB helper (uses MONGODB_URI)
+# DB helper (shared pool from db.py)
 # -------------------------------
-_client = None  # reuse a single client across requests
-
-def get_db():
-    global _client
-    uri = os.environ.get("MONGODB_URI")
-    db_name = os.environ.get("MONGODB_DB")  # set this OR include /cfacdb in the URI
-
-    if not uri:
-        raise RuntimeError("MONGODB_URI not set")
-
-    if _client is None:
-        # Reuse a single client across requests
-        _client = MongoClient(uri, tls=True, tlsAllowInvalidCertificates=False)
-
-    if not db_name:
-        # If you prefer pulling from the URI's path, parse it here.
-        # from urllib.parse import urlparse
-        # parsed = urlparse(uri)
-        # db_name = parsed.path.lstrip('/') or None
-        raise RuntimeError("MONGODB_DB not set and URI has no default database name")
-
-    return _client[db_name]
+from db import get_db
 
 # -------------------------------
 # Auth helper (uses JWT_SECRET)
@@ -97,16 +76,8 @@ def ensure_closed_ring(ring):
     return ring
 
 def calc_bbox(ring):
-    print("\n[GEOMETRY] Calculating bounding box...")
-    minLon, minLat, maxLon, maxLat = inf, inf, -inf, -inf
-    for i, (lon, lat) in enumerate(ring):
-        minLon = min(minLon, lon)
-        minLat = min(minLat, lat)
-        maxLon = max(maxLon, lon)
-        maxLat = max(maxLat, lat)
-        print(f"[GEOMETRY] Point {i}: ({lon}, {lat}) -> BBox so far: [{minLon}, {minLat}, {maxLon}, {maxLat}]")
-    bbox = [minLon, minLat, maxLon, maxLat]
-    print(f"[GEOMETRY] Final Bounding Box: {bbox}")
+    bbox = ring_bbox(ring)
+    print(f"[GEOMETRY] Bounding box: {bbox}")
     return bbox
 
 def calc_centroid(ring):
@@ -220,26 +191,8 @@ def list_territories():
     return jsonify(items), 200
 
 # -------------------------------
-# Houses: indexing & persistence
+# Houses: persistence (indexes are in indexes.py)
 # -------------------------------
-def _ensure_houses_indexes(db):
-    """
-    Create the geospatial and de-dup indexes for houses.
-    Idempotent: safe to call on each request.
-    """
-    try:
-        # Geo index for spatial queries
-        db.houses.create_index([("loc", "2dsphere")])
-        # Uniqueness per territory by address+zip
-        db.houses.create_index(
-            [("territory_id", 1), ("address", 1), ("zip", 1)],
-            unique=True,
-            name="uniq_per_territory_addr_zip"
-        )
-        print("[HOUSES] Indexes ensured (2dsphere + unique key).")
-    except Exception as e:
-        print(f"[HOUSES WARN] Ensuring indexes failed: {e}")
-
 def _normalize_house_for_db(h, user_id, territory_id):
     """
     Convert an item from Overpass into our Mongo shape for `houses`.
@@ -261,105 +214,134 @@ def _normalize_house_for_db(h, user_id, territory_id):
 
 
 
+HOUSES_SAMPLE_SIZE = 20
+
+
+def _house_sample_entry(house_id, doc):
+    lon, lat = doc["loc"]["coordinates"]
+    return {
+        "house_id": house_id,
+        "address": doc.get("address", ""),
+        "city": doc.get("city", ""),
+        "state": doc.get("state", ""),
+        "zip": doc.get("zip", ""),
+        "lon": lon,
+        "lat": lat,
+        "response": doc.get("response", "awaiting response"),
+    }
+
+
 def _persist_houses_to_territory(db, user_id, territory_id, items):
     """
     Upsert houses under `houses` collection and update a summary onto the territory.
     Also:
       - attaches house_id (string) to each item in `items`
       - stores house_id in territories.houses_sample
-    """
-    _ensure_houses_indexes(db)
 
+    Incremental: new house ids come from the bulk-write result, houses_count
+    is $inc'd by the number inserted, and houses_sample only grows while it
+    has fewer than HOUSES_SAMPLE_SIZE entries. Existing houses are looked up
+    by their (address, zip) keys only, never by rescanning the territory.
+
+    houses_sample is never rebuilt from `houses`, so its `response` values
+    are only current because /api/track-responses updates the matching
+    sample entry in place (houses_sample.$.response) along with the house.
+    """
     terr_oid = ObjectId(territory_id)
 
     # Verify the territory belongs to the user
-    terr = db.territories.find_one({"_id": terr_oid, "user_id": user_id})
+    terr = db.territories.find_one(
+        {"_id": terr_oid, "user_id": user_id},
+        {"houses_count": 1, "houses_sample": 1}
+    )
     if not terr:
         raise ValueError("territory_not_found_or_forbidden")
 
     # -------------------- bulk upserts --------------------
-    ops = []
-    for h in items:
-        doc = _normalize_house_for_db(h, user_id, territory_id)
-        filt = {
-            "territory_id": doc["territory_id"],
-            "address": doc["address"],
-            "zip": doc["zip"],
-        }
-        ops.append(UpdateOne(filt, {"$setOnInsert": doc}, upsert=True))
+    docs = [_normalize_house_for_db(h, user_id, territory_id) for h in dedup_items(items)]
+    ops = [
+        UpdateOne(
+            {"territory_id": doc["territory_id"], "address": doc["address"], "zip": doc["zip"]},
+            {"$setOnInsert": doc},
+            upsert=True
+        )
+        for doc in docs
+    ]
 
     result_summary = {"upserted": 0, "total_for_territory": 0, "sample": []}
+    upserted_ids = {}
     if ops:
         try:
             result = db.houses.bulk_write(ops, ordered=False)
-            result_summary["upserted"] = int(getattr(result, "upserted_count", 0) or 0)
-            print(f"[HOUSES] bulk upsert complete. upserted={result_summary['upserted']}")
-        except Exception as e:
-            # DuplicateKeyError is fine due to unique index; bulk_write may raise only if fatal
+            upserted_ids = result.upserted_ids or {}
+        except BulkWriteError as e:
+            # Duplicate keys from a concurrent save are fine; keep what was inserted.
+            upserted_ids = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
             print(f"[HOUSES] bulk upsert encountered error: {e}")
+        result_summary["upserted"] = len(upserted_ids)
+        print(f"[HOUSES] bulk upsert complete. upserted={result_summary['upserted']}")
 
     # -------------------- attach house_id to items --------------------
-    # Build a lookup from (lat,lon) -> house_id for all houses in this territory
-    id_lookup = {}
-    all_cursor = db.houses.find(
-        {"territory_id": terr_oid},
-        {"_id": 1, "loc.coordinates": 1}
-    )
-
-    for d in all_cursor:
-        coords = d.get("loc", {}).get("coordinates", [None, None])
-        if coords and coords[0] is not None and coords[1] is not None:
-            lon, lat = coords
-            key = (round(float(lat), 6), round(float(lon), 6))
-            id_lookup[key] = str(d["_id"])
+    # New houses: ids straight from the bulk result. Already-saved ones: one
+    # indexed $in on (territory_id, address, zip) for just those keys.
+    ids_by_key = {
+        (docs[i]["address"], docs[i]["zip"]): str(_id) for i, _id in upserted_ids.items()
+    }
+    existing = [doc for i, doc in enumerate(docs) if i not in upserted_ids]
+    if existing:
+        for d in db.houses.find(
+            {"territory_id": terr_oid, "address": {"$in": list({doc["address"] for doc in existing})}},
+            {"_id": 1, "address": 1, "zip": 1}
+        ):
+            ids_by_key.setdefault((d.get("address", ""), d.get("zip", "")), str(d["_id"]))
+
+    # Items dropped as coordinate duplicates take the id of the house they duplicate.
+    coord_ids = {}
+    if docs:
+        lons = [doc["loc"]["coordinates"][0] for doc in docs]
+        lats = [doc["loc"]["coordinates"][1] for doc in docs]
+        for doc, key in zip(docs, coord_keys(lons, lats).tolist()):
+            house_id = ids_by_key.get((doc["address"], doc["zip"]))
+            if house_id:
+                coord_ids.setdefault(key, house_id)
 
     # Mutate `items` in-place to include house_id
     for h in items:
-        try:
-            lat = float(h.get("lat"))
-            lon = float(h.get("lon"))
-        except (TypeError, ValueError):
-            continue
-        key = (round(lat, 6), round(lon, 6))
-        house_id = id_lookup.get(key)
+        house_id = ids_by_key.get((h.get("address") or "", h.get("zip") or ""))
+        if not house_id:
+            try:
+                key = coord_keys([float(h.get("lon"))], [float(h.get("lat"))]).tolist()[0]
+            except (TypeError, ValueError):
+                continue
+            house_id = coord_ids.get(key)
         if house_id:
             h["house_id"] = house_id
 
-    # -------------------- recompute summary for this territory --------------------
-    total = db.houses.count_documents({"territory_id": terr_oid})
-
-    sample_cursor = db.houses.find(
-        {"territory_id": terr_oid},
-        {"_id": 1, "address": 1, "city": 1, "state": 1, "zip": 1, "loc.coordinates": 1}
-    ).limit(20)
-
-    sample = []
-    for d in sample_cursor:
-        coords = d.get("loc", {}).get("coordinates", [None, None])
-        lon = coords[0] if len(coords) > 0 else None
-        lat = coords[1] if len(coords) > 1 else None
-
-        sample.append({
-            "house_id": str(d["_id"]),          # 🔹 add house_id here
-            "address": d.get("address", ""),
-            "city": d.get("city", ""),
-            "state": d.get("state", ""),
-            "zip": d.get("zip", ""),
-            "lon": lon,
-            "lat": lat,
-            "response": d.get("response", "awaiting response"), 
-        })
-
-    db.territories.update_one(
-        {"_id": terr_oid},
-        {
-            "$set": {
-                "houses_count": total,
-                "houses_sample": sample,           # lightweight preview for UI, now with house_id
-                "houses_last_refreshed_at": datetime.utcnow()
-            }
-        }
-    )
+    # -------------------- update summary for this territory --------------------
+    total = terr.get("houses_count")
+    if total is None:
+        # Territory saved before houses_count was kept incrementally: count once.
+        total = db.houses.count_documents({"territory_id": terr_oid})
+        count_update = {"$set": {"houses_count": total}}
+    else:
+        total += result_summary["upserted"]
+        count_update = {"$inc": {"houses_count": result_summary["upserted"]}}
+
+    sample = list(terr.get("houses_sample") or [])
+    room = HOUSES_SAMPLE_SIZE - len(sample)
+    new_entries = [
+        _house_sample_entry(str(upserted_ids[i]), docs[i])
+        for i in sorted(upserted_ids)[:max(room, 0)]
+    ]
+    sample.extend(new_entries)
+
+    update = {"$set": {"houses_last_refreshed_at": datetime.utcnow()}}
+    for op, fields in count_update.items():
+        update.setdefault(op, {}).update(fields)
+    if new_entries:
+        # Lightweight preview for UI (with house_id); only touched when it changes.
+        update["$push"] = {"houses_sample": {"$each": new_entries, "$slice": HOUSES_SAMPLE_SIZE}}
+    db.territories.update_one({"_id": terr_oid}, update)
 
     result_summary["total_for_territory"] = total
     result_summary["sample"] = sample
@@ -369,103 +351,22 @@ def _persist_houses_to_territory(db, user_id, territory_id, items):
 
 
 # -------------------------------
-# OSM / Overpass helper
+# Address lookups (local `addresses` collection, see addresses.py)
 # -------------------------------
 import requests
-from time import sleep
-
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"  # public endpoint; consider hosting your own later
+from addresses import addresses_in_polygon, addresses_in_circle
+from overpass_tiles import OVERPASS_REFRESH, AreaTooLarge, refresh_tiles_live, circle_bbox_ring
 
-def _ring_lonlat_to_overpass_poly(ring_lonlat):
-    """
-    Overpass 'poly' expects: 'lat lon lat lon ...' (note: LAT first).
-    We accept [[lon,lat], ...] (your client format), ensure closed ring,
-    then return the single string.
-    """
-    if not ring_lonlat or len(ring_lonlat) < 3:
-        return None
-    if ring_lonlat[0] != ring_lonlat[-1]:
-        ring_lonlat = ring_lonlat + [ring_lonlat[0]]
-    parts = []
-    for lon, lat in ring_lonlat:
-        parts.append(f"{float(lat):.7f} {float(lon):.7f}")
-    return " ".join(parts)
-
-def _fetch_osm_addresses_in_polygon(ring_lonlat, timeout_s=25):
-    """
-    Query Overpass for any node/way/relation that has address tags within the polygon.
-    We return a list of dicts: { address, city, state, zip, lat, lon } best-effort.
-    """
-    poly = _ring_lonlat_to_overpass_poly(ring_lonlat)
-    if not poly:
-        raise ValueError("Invalid ring_lonlat for Overpass")
-
-    # Overpass QL: select anything with addr:* tags inside the polygon
-    # 'out center' gives us coordinates for ways/relations (nodes already have lat/lon)
-    ql = f"""
-    [out:json][timeout:{timeout_s}];
-    (
-      node["addr:housenumber"](poly:"{poly}");
-      way["addr:housenumber"](poly:"{poly}");
-      relation["addr:housenumber"](poly:"{poly}");
-    );
-    out center tags;
-    """
-    headers = {
-        # Be polite (Overpass requires a descriptive UA). You can add your email.
-        "User-Agent": "CFAC/1.0 (houses-in-area) contact: support@cfautocare.biz"
-    }
+def _refresh_tiles(ring, force=False):
+    """Best-effort Overpass refresh; the local index answers either way."""
+    try:
+        total, fetched, left = refresh_tiles_live(ring, force=force)
+        print(f"[HOUSES] Overpass refresh: {fetched}/{total} tile(s) fetched, {left} left stale")
+    except AreaTooLarge as e:
+        print(f"[HOUSES] Overpass refresh skipped ({e}), serving the local index")
+    except requests.RequestException as e:
+        print(f"[HOUSES] Overpass refresh failed, serving the local index: {e}")
 
-    # Simple retry for 429/5xx
-    for attempt in range(3):
-        r = requests.post(OVERPASS_URL, data={"data": ql}, headers=headers, timeout=timeout_s + 5)
-        if r.status_code == 429 or r.status_code >= 500:
-            sleep(1 + attempt * 2)
-            continue
-        r.raise_for_status()
-        break
-
-    data = r.json()
-    elements = data.get("elements", [])
-
-    out = []
-    for el in elements:
-        tags = el.get("tags", {})
-        # Coordinates
-        if el.get("type") == "node":
-            lat = el.get("lat")
-            lon = el.get("lon")
-        else:
-            # way/relation: prefer 'center' (provided by 'out center')
-            c = el.get("center") or {}
-            lat = c.get("lat")
-            lon = c.get("lon")
-
-        if lat is None or lon is None:
-            continue
-
-        # Build a nice address line (best-effort from common OSM tags)
-        number = tags.get("addr:housenumber")
-        street = tags.get("addr:street") or tags.get("addr:road")
-        unit   = tags.get("addr:unit")
-        city   = tags.get("addr:city") or tags.get("addr:town") or tags.get("addr:village") or ""
-        state  = tags.get("addr:state") or ""
-        zipc   = tags.get("addr:postcode") or ""
-
-        line = " ".join(filter(None, [number, street]))
-        if unit:
-            line += f", Unit {unit}"
-
-        out.append({
-            "address": line,
-            "city": city,
-            "state": state,
-            "zip": zipc,
-            "lat": float(lat),
-            "lon": float(lon),
-        })
-
-    return out
 
 # -------------------------------
 # Route: Fetch houses in area (with optional persistence)
@@ -489,37 +390,21 @@ def houses_in_area():
 
     try:
         if polygon:
-            ring = [list(map(float, pt)) for pt in polygon]
-            items = _fetch_osm_addresses_in_polygon(ring)
+            ring = ensure_closed_ring([list(map(float, pt)) for pt in polygon])
+            if not ring:
+                return jsonify({"error": "polygon must have >= 3 vertices"}), 400
+            # Optional live refresh: pull missing/stale tiles from Overpass first.
+            if OVERPASS_REFRESH:
+                _refresh_tiles(ring, force=bool(body.get("refresh")))
+            items = addresses_in_polygon(ring, limit=limit)
         else:
-            # Optional: circle path via Overpass by approximating a polygon
-            center = circle["center"]  # [lon,lat]
+            center = [float(c) for c in circle["center"]]  # [lon,lat]
             radius_mi = float(circle["radius"])
+            if OVERPASS_REFRESH:
+                _refresh_tiles(circle_bbox_ring(center, radius_mi), force=bool(body.get("refresh")))
+            items = addresses_in_circle(center, radius_mi, limit=limit)
 
-            import math
-            def circle_to_ring(lon, lat, radius_miles, steps=36):
-                R = 3959.0  # miles
-                ang = radius_miles / R
-                ring = []
-                lat0 = math.radians(lat)
-                lon0 = math.radians(lon)
-                for k in range(steps):
-                    bearing = 2*math.pi*k/steps
-                    lat1 = math.asin(math.sin(lat0)*math.cos(ang) +
-                                     math.cos(lat0)*math.sin(ang)*math.cos(bearing))
-                    lon1 = lon0 + math.atan2(math.sin(bearing)*math.sin(ang)*math.cos(lat0),
-                                             math.cos(ang)-math.sin(lat0)*math.sin(lat1))
-                    ring.append([math.degrees(lon1), math.degrees(lat1)])
-                return ring
-
-            ring = circle_to_ring(center[0], center[1], radius_mi, steps=36)
-            items = _fetch_osm_addresses_in_polygon(ring)
-
-        # Trim if needed
-        if len(items) > limit:
-            items = items[:limit]
-
-        print(f"[HOUSES] Returning {len(items)} item(s) from OSM")
+        print(f"[HOUSES] Returning {len(items)} item(s) from the address index")
         for i, h in enumerate(items[:5], 1):
             print(f"[HOUSES] #{i}: {h.get('address','')} {h.get('city','')} {h.get('state','')} {h.get('zip','')} @ ({h.get('lat'):.5f}, {h.get('lon'):.5f})")
 
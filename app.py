@@ -5,22 +5,20 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from collections import MutableMapping
-from apscheduler.schedulers.background import BackgroundScheduler
-from api_tech import start_scheduler  
 import decimal
 import logging
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from config import Config
 from postmark_client import postmark_client, is_valid_email
 from flask_analytics import Analytics
 
 
 # Import extensions
-from extensions import bcrypt, login_manager, csrf, create_unique_indexes
+from extensions import bcrypt, login_manager, csrf
 from db import init_db
+from lifecycle import init_worker, register_lazy_init
 from utility import register_filters
 
 # API imports
@@ -47,6 +45,8 @@ from utils.visitor_log import init_visitor_logging          # ← add this
 def create_app():
     app = Flask(__name__)
     app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+    # Connections / scheduler are opened per worker, after fork (lifecycle.py)
+    register_lazy_init(app)
     init_visitor_logging(app)
 
     # Basic config
@@ -82,17 +82,8 @@ def create_app():
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
 
-    # MongoDB
-    mongodb_uri = app.config['MONGODB_URI']
-    client = MongoClient(mongodb_uri, tls=True, tlsAllowInvalidCertificates=True)
-    db = client["cfacdb"]
-    app.config["MONGO_CLIENT"] = db  
+    # MongoDB (one shared pool, see db.py)
     # Collections (used throughout routes + notis.py)
-    app.config["USERS_COLLECTION"] = db.users
-    app.config["ORDERS_COLLECTION"] = db.orders
-    app.config["SERVICES_COLLECTION"] = db.services
-    app.config["DEVICE_TOKENS_COLLECTION"] = db.device_tokens
-
     init_db(app)
 
     # Register Blueprints
@@ -121,15 +112,14 @@ def create_app():
     csrf.exempt(contract_bp)
 
     with app.app_context():
-        create_unique_indexes()
         register_filters()
 
     return app
 
 if __name__ == '__main__':
     app = create_app()
-    start_scheduler(app)  # Start the scheduler
+    init_worker(app)  # Opens connections and starts the scheduler
     app.run(debug=True)
 else:
+    # Under gunicorn the worker is initialized in post_fork (gunicorn.conf.py)
     app = create_app()
-    start_scheduler(app)  # Optionally start scheduler even in production
@@ -1,16 +1,25 @@
 # blueprints/admin.py
 
-from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app
+from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app, jsonify
 from flask_login import login_required, current_user
 from bson.objectid import ObjectId
 from datetime import datetime
 import math
-from zoneinfo import ZoneInfo
 import logging
-from app import bcrypt
 
 # Import your custom decorator for admin access
 from decorators import admin_required
+from pagination import keyset_page, estimated_total, InvalidCursor
+from projections import projection, find_view
+from identity_cache import invalidate_user
+import customer_search
+from pymongo.errors import DuplicateKeyError
+from user_model import normalize_username, with_username_lower, username_in_use
+from passwords import hash_password
+from stats import (
+    get_dashboard_stats, record_order_created, record_order_deleted,
+    record_user_created, record_user_deleted
+)
 
 # Import your forms
 from forms import DeleteOrderForm, EditOrderForm, UpdateCompensationStatusForm, AddCustomerForm
@@ -20,12 +29,99 @@ admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
 
 
+def _enrich_orders(orders, users_collection, services_collection):
+    """
+    Fill in salesperson/customer/tech names and service details for a page
+    of orders using one batched $in query per lookup, not one per row.
+    """
+    user_ids = set()
+    emails = set()
+    service_codes = set()
+    for order in orders:
+        if order.get('is_guest', False):
+            salesperson_id = order.get('salesperson')
+            if salesperson_id and ObjectId.is_valid(salesperson_id):
+                user_ids.add(ObjectId(salesperson_id))
+        else:
+            email = order.get('guest_email') or order.get('user')
+            if email:
+                emails.add(email)
+        technician = order.get('technician')
+        if technician and ObjectId.is_valid(technician):
+            user_ids.add(ObjectId(technician))
+        service_codes.update(order.get('selectedServices', []))
+
+    users_by_id = {}
+    if user_ids:
+        for user in users_collection.find(
+            {'_id': {'$in': list(user_ids)}},
+            {'full_name': 1, 'name': 1, 'user_type': 1}
+        ):
+            users_by_id[user['_id']] = user
+
+    known_emails = set()
+    if emails:
+        known_emails = {
+            user['email'] for user in users_collection.find({'email': {'$in': list(emails)}}, {'email': 1})
+        }
+
+    services_by_code = {}
+    if service_codes:
+        for service in services_collection.find({'service_code': {'$in': list(service_codes)}}):
+            services_by_code.setdefault(service.get('service_code'), []).append(service)
+
+    for order in orders:
+        is_guest = order.get('is_guest', False)
+        order['order_type'] = 'Guest Order' if is_guest else 'Customer Order'
+
+        # Handle Payment Status
+        order['payment_status'] = order.get('payment_status', 'Unpaid')
+
+        if is_guest:
+            # For guest orders, show the salesperson
+            salesperson_id = order.get('salesperson')
+            if salesperson_id:
+                salesperson = (
+                    users_by_id.get(ObjectId(salesperson_id)) if ObjectId.is_valid(salesperson_id) else None
+                )
+                if salesperson and salesperson.get('user_type') == 'sales':
+                    order['salesperson_name'] = salesperson.get('full_name', 'Unknown')
+                else:
+                    order['salesperson_name'] = 'Unknown'
+            else:
+                order['salesperson_name'] = 'Not Assigned'
+        else:
+            # For customer orders, use guest_email (or user) field as needed
+            email = order.get('guest_email') or order.get('user')
+            order['user_email'] = email if email in known_emails else 'Unknown'
+
+        # Service details instead of product details
+        order['service_details'] = [
+            service
+            for code in dict.fromkeys(order.get('selectedServices', []))
+            for service in services_by_code.get(code, [])
+        ]
+
+        # Optionally, set a total field from your service data (if applicable)
+        order['total'] = order.get('final_price') or order.get('services_total')
+
+        # Technician Details if Scheduled
+        technician = order.get('technician')
+        if technician and ObjectId.is_valid(technician):
+            tech = users_by_id.get(ObjectId(technician))
+            order['tech_name'] = tech.get('name', 'Unknown Tech') if tech else 'Unknown Tech'
+        else:
+            order['tech_name'] = 'Not Scheduled Yet'
+    return orders
+
+
 @admin_bp.route('/main')
 @login_required
 @admin_required
 def admin_main():
     """
     Main admin dashboard route adapted for orders that use services.
+    Costs a fixed number of queries whatever the page size.
     """
     try:
         # Access collections via current_app.config
@@ -37,124 +133,46 @@ def admin_main():
         # 1. Fetch All Estimate Requests
         estimates = list(estimaterequests_collection.find())
 
-        # 2. Pagination Parameters
-        page = request.args.get('page', 1, type=int)
+        # 2. Pagination Parameters (keyset cursors)
+        after = request.args.get('after')
+        before = request.args.get('before')
         per_page = 20
 
+        # 3. Counters (orders + users by type), kept up to date in stats.py
+        stats = get_dashboard_stats()
+        total_orders = stats.get('orders_total', 0)
+        guest_orders = stats.get('orders_guest', 0)
+        user_counts = stats.get('users', {})
 
-        # 3. Fetch Total Number of Orders
-        total_orders = orders_collection.count_documents({})
-
-
-    # 2. Guest Orders: orders where the field "is_guest" is True
-        guest_orders = orders_collection.count_documents({'is_guest': True})
-        
-        # 3. Checkout Orders (customer orders): you can compute this as all orders minus guest orders
+        # Checkout Orders (customer orders): all orders minus guest orders
         checkout_orders = total_orders - guest_orders
 
         # Calculate percentages (guarding against division by zero)
         guest_percentage = (guest_orders / total_orders * 100) if total_orders > 0 else 0
         checkout_percentage = (checkout_orders / total_orders * 100) if total_orders > 0 else 0
 
-        # Total pages for pagination
-        total_pages = (total_orders + per_page - 1) // per_page
-
-
-        total_pages = (total_orders + per_page - 1) // per_page
-
         # 4. Fetch Orders for the Current Page
-        orders_cursor = orders_collection.find().sort('creation_date', -1).skip((page - 1) * per_page).limit(per_page)
-        orders = list(orders_cursor)
-
-        # 5. Enrich Orders with Additional Details
-        for order in orders:
-            is_guest = order.get('is_guest', False)
-            order['order_type'] = 'Guest Order' if is_guest else 'Customer Order'
-
-            # 5.1 Handle Payment Status
-            order['payment_status'] = order.get('payment_status', 'Unpaid')
-
-            if is_guest:
-                # For guest orders, fetch salesperson details
-                salesperson_id = order.get('salesperson')
-                if salesperson_id:
-                    try:
-                        salesperson_obj_id = ObjectId(salesperson_id)
-                        salesperson = users_collection.find_one({'_id': salesperson_obj_id, 'user_type': 'sales'})
-                        order['salesperson_name'] = (
-                            salesperson.get('full_name', 'Unknown') if salesperson else 'Unknown'
-                        )
-                    except Exception:
-                        order['salesperson_name'] = 'Unknown'
-                else:
-                    order['salesperson_name'] = 'Not Assigned'
-            else:
-                # For customer orders, use guest_email (or user) field as needed
-                email = order.get('guest_email') or order.get('user')
-                if email:
-                    user = users_collection.find_one({'email': email})
-                    order['user_email'] = user.get('email', 'Unknown') if user else 'Unknown'
-                else:
-                    order['user_email'] = 'Unknown'
-
-            # 5.2 Convert Date Fields (now expecting ISO-8601 format)
-            for date_field in [ 'service_date', 'creation_date']:
-                date_value = order.get(date_field)
-                if isinstance(date_value, str):
-                        try:
-                            # Parse the date string, ensuring that UTC times are correctly recognized.
-                            if date_value.endswith('Z'):
-                                dt = datetime.fromisoformat(date_value.replace("Z", "+00:00"))
-                            else:
-                                dt = datetime.fromisoformat(date_value)
-                            # Convert to Eastern Time (handles both EST and EDT automatically)
-                            dt_est = dt.astimezone(ZoneInfo("America/New_York"))
-                            order[date_field] = dt_est
-                        except ValueError:
-                            current_app.logger.error(
-                                f"Invalid {date_field} format for order {order.get('_id')}: {date_value}"
-                            )
-                            order[date_field] = None
-
-
-            # 5.3 Get Service Details instead of product details
-            service_codes = order.get('selectedServices', [])
-            if service_codes:
-                # Assuming each service document has a 'service_code' field to match against
-                services = list(services_collection.find({'service_code': {'$in': service_codes}}))
-                order['service_details'] = services
-            else:
-                order['service_details'] = []
-
-            # Optionally, set a total field from your service data (if applicable)
-            order['total'] = order.get('final_price') or order.get('services_total')
-
-            # 5.4 Fetch Technician Details if Scheduled
-            technician = order.get('technician')
-            if technician and ObjectId.is_valid(technician):
-                tech = users_collection.find_one({'_id': ObjectId(technician)})
-                order['tech_name'] = tech.get('name', 'Unknown Tech') if tech else 'Unknown Tech'
-            else:
-                order['tech_name'] = 'Not Scheduled Yet'
+        try:
+            result = keyset_page(orders_collection, {}, 'creation_date', limit=per_page,
+                                 after=after, before=before, projection=projection('admin_order_row'))
+        except InvalidCursor:
+            return redirect(url_for('admin.admin_main'))
 
-   # *** New code: Count users by type ***
-        tech_count = users_collection.count_documents({'user_type': 'tech'})
-        customer_count = users_collection.count_documents({'user_type': 'customer'})
-        admin_count = users_collection.count_documents({'user_type': 'admin'})
-        sales_count = users_collection.count_documents({'user_type': 'sales'})
+        # 5. Enrich Orders with Additional Details (batched lookups)
+        orders = _enrich_orders(result['items'], users_collection, services_collection)
 
         # 6. Pass Variables to the Template
         return render_template(
             'admin/main.html',
             requests=estimates,
             orders=orders,
-            page=page,
             per_page=per_page,
-            total_pages=total_pages,
-            tech_count=tech_count,
-            customer_count=customer_count,
-            admin_count=admin_count,
-            sales_count=sales_count,
+            next_cursor=result['next'],
+            prev_cursor=result['prev'],
+            tech_count=user_counts.get('tech', 0),
+            customer_count=user_counts.get('customer', 0),
+            admin_count=user_counts.get('admin', 0),
+            sales_count=user_counts.get('sales', 0),
             total_orders=total_orders,
             guest_orders=guest_orders,
             checkout_orders=checkout_orders,
@@ -250,18 +268,6 @@ def view_order(order_id):
             order['technician_name'] = 'Not Scheduled'
             order['technician_email'] = ''
 
-        for date_field in ['creation_date', 'service_date']:
-            if isinstance(order.get(date_field), str):
-                try:
-                    if order[date_field].endswith('Z'):
-                        order[date_field] = datetime.fromisoformat(order[date_field].replace("Z", "+00:00"))
-                    else:
-                        order[date_field] = datetime.fromisoformat(order[date_field])
-                except ValueError:
-                    current_app.logger.error(
-                        f"Invalid {date_field} format for order {order.get('_id')}: {order.get(date_field)}"
-                    )
-                    order[date_field] = None
 
 
         return render_template('admin/view_order.html', order=order, delete_form=delete_form)
@@ -364,8 +370,9 @@ def delete_order(order_id):
             current_app.logger.warning(f"Delete attempt with invalid order ID: {order_id}")
             return redirect(url_for('admin.admin_main'))
 
-        result = orders_collection.delete_one({'_id': order_obj_id})
-        if result.deleted_count == 1:
+        deleted = orders_collection.find_one_and_delete({'_id': order_obj_id}, projection={'is_guest': 1})
+        if deleted:
+            record_order_deleted(deleted)
             flash('Order deleted successfully.', 'success')
             current_app.logger.info(f"Order {order_id} deleted successfully.")
         else:
@@ -391,7 +398,10 @@ def delete_user(user_id):
         flash('You cannot delete your own account.', 'danger')
         return redirect(url_for('admin.manage_users'))
 
-    users_collection.delete_one({'_id': ObjectId(user_id)})
+    deleted = users_collection.find_one_and_delete({'_id': ObjectId(user_id)}, projection={'user_type': 1})
+    if deleted:
+        record_user_deleted(deleted)
+        invalidate_user(user_id)
     flash('User deleted successfully.', 'success')
     return redirect(url_for('admin.manage_users'))
 
@@ -407,7 +417,8 @@ def manage_users():
         users_collection = current_app.config['USERS_COLLECTION']
         delete_form = DeleteOrderForm()
 
-        page = request.args.get('page', 1, type=int)
+        after = request.args.get('after')
+        before = request.args.get('before')
         per_page = 20
         search_query = request.args.get('search', '').strip()
         user_type = request.args.get('user_type', '')
@@ -434,24 +445,30 @@ def manage_users():
 
         sort_direction = 1 if sort_order == 'asc' else -1
         if sort_by == 'creation_date':
-            sort_field = 'creation_date'
+            # Users carry creation_date, created_at or neither, as strings or
+            # datetimes; the ObjectId's timestamp is the one reliable order.
+            sort_field = '_id'
         else:
             sort_field = 'email'
 
-        total_users = users_collection.count_documents(query)
-        total_pages = (total_users + per_page - 1) // per_page
+        # Exact totals only matter on the unfiltered list, where metadata is enough.
+        total_users = estimated_total(users_collection, query)
 
-        users = list(users_collection.find(query)
-                     .sort(sort_field, sort_direction)
-                     .skip((page - 1) * per_page)
-                     .limit(per_page))
+        try:
+            result = keyset_page(users_collection, query, sort_field, sort_direction,
+                                 limit=per_page, after=after, before=before)
+        except InvalidCursor:
+            return redirect(url_for('admin.manage_users', search=search_query, user_type=user_type,
+                                    sort_by=sort_by, sort_order=sort_order))
+        users = result['items']
 
         return render_template(
             'admin/manage_users.html',
             users=users,
-            page=page,
             per_page=per_page,
-            total_pages=total_pages,
+            total_users=total_users,
+            next_cursor=result['next'],
+            prev_cursor=result['prev'],
             delete_form=delete_form,
             search_query=search_query,
             user_type=user_type,
@@ -510,15 +527,13 @@ def compensation_page():
         orders_collection = current_app.config['ORDERS_COLLECTION']
         users_collection = current_app.config['USERS_COLLECTION']
 
-        page = request.args.get('page', 1, type=int)
         per_page = 20
-        total_orders = orders_collection.count_documents({})
-        total_pages = (total_orders + per_page - 1) // per_page
-
-        orders_cursor = orders_collection.find().sort('service_date', -1)\
-                                             .skip((page - 1) * per_page)\
-                                             .limit(per_page)
-        orders = list(orders_cursor)
+        try:
+            result = keyset_page(orders_collection, {}, 'service_date', limit=per_page,
+                                 after=request.args.get('after'), before=request.args.get('before'))
+        except InvalidCursor:
+            return redirect(url_for('admin.compensation_page'))
+        orders = result['items']
 
         for order in orders:
             # Ensure _id is a string for URL purposes
@@ -540,24 +555,6 @@ def compensation_page():
             else:
                 order['salesperson_name'] = 'Not Assigned'
 
-       # Convert service_date to a datetime object.
-            service_date = order.get('service_date')
-            if isinstance(service_date, str):
-                try:
-                    if 'T' in service_date:
-                        # Handle ISO 8601 format.
-                        if service_date.endswith('Z'):
-                            order['service_date'] = datetime.strptime(service_date, '%Y-%m-%dT%H:%M:%SZ')
-                        else:
-                            order['service_date'] = datetime.fromisoformat(service_date)
-                    else:
-                        # Fallback to the simpler date format.
-                        order['service_date'] = datetime.strptime(service_date, '%Y-%m-%d')
-                except ValueError:
-                    current_app.logger.error(
-                        f"Invalid service_date format for order ID {order.get('_id')}: {service_date}"
-                    )
-                    order['service_date'] = None
 
         # Optionally, if you still need the update forms (for example, if you want to retain update functionality)
         forms = {order['_id']: UpdateCompensationStatusForm(prefix=order['_id']) for order in orders}
@@ -565,9 +562,9 @@ def compensation_page():
         return render_template(
             'admin/compensation.html',
             orders=orders,
-            page=page,
             per_page=per_page,
-            total_pages=total_pages,
+            next_cursor=result['next'],
+            prev_cursor=result['prev'],
             forms=forms  # Remove this if your new template no longer uses the forms.
         )
     except Exception as e:
@@ -644,12 +641,10 @@ def view_pending_users():
 
 import os
 import base64
-import tempfile
 import traceback
-from apns2.client import APNsClient
-from apns2.payload import Payload
 from flask import current_app
 from api_sales import get_device_token_for_user
+from push import push_service, build_payload, SALES_TOPIC, SALES_CERT_ENV
 
 
 def send_notification_to_user(user_id, custom_message=None):
@@ -663,34 +658,10 @@ def send_notification_to_user(user_id, custom_message=None):
         current_app.logger.warning(f"No device token found for user {user_id}.")
         return {"status": "error", "detail": "No device token found for user."}
 
-    # Use a certificate for user notifications; you can reuse the same certificate if it applies.
-    cert_b64 = os.environ.get("APNS_CERT_B64_SALESMAN")  # or use APNS_CERT_B64_SALESMAN if shared
-    if not cert_b64:
-        current_app.logger.error("APNS certificate for users not configured in environment variable!")
-        return {"status": "error", "detail": "APNS certificate not set for users."}
-    
     try:
-        current_app.logger.info("Decoding APNs certificate for user notifications.")
-        cert_content = base64.b64decode(cert_b64)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pem") as temp_cert:
-            temp_cert.write(cert_content)
-            temp_cert_path = temp_cert.name
-        current_app.logger.info(f"APNs certificate written to temporary file: {temp_cert_path}")
-
-        # Build the payload. Customize the alert title and body as needed.
-        payload = Payload(alert={"title": "Application Approved", "body": custom_message or "Congratulations! Your application has been approved."}, sound="default", badge=1)
-        
-        # Specify the topic (your app's bundle identifier)
-        topic = "com.Centralfloridaautocare.cfacios"  # Update this if your sales app's bundle identifier is different.
-        current_app.logger.info(f"Using APNs topic: {topic}")
-
-        # Create the APNs client
-        client = APNsClient(temp_cert_path, use_sandbox=False, use_alternative_port=False)
-        response = client.send_notification(token, payload, topic=topic)
+        payload = build_payload("Application Approved", custom_message or "Congratulations! Your application has been approved.")
+        response = push_service.send(token, payload, topic=SALES_TOPIC, cert_env=SALES_CERT_ENV)
         current_app.logger.info(f"User notification response: {response}")
-
-        # Clean up the temporary certificate file
-        os.remove(temp_cert_path)
         return {"status": "sent", "detail": str(response)}
     except Exception as e:
         current_app.logger.error("Error sending push notification to user:")
@@ -707,10 +678,7 @@ from notis import send_postmark_email
 from bson import ObjectId
 import os
 import base64
-import tempfile
 import traceback
-from apns2.client import APNsClient
-from apns2.payload import Payload
 from flask import current_app
 from datetime import datetime
 
@@ -772,14 +740,27 @@ def approve_user(user_id):
 
         # Remove the pending _id and add an approval timestamp.
         pending_user.pop("_id", None)
+        pending_user = with_username_lower(pending_user)
         pending_user["approved_at"] = datetime.utcnow()
 
+        if username_in_use(pending_user.get("username"), main_users_collection):
+            flash(f"Username '{pending_user.get('username')}' is already taken by an approved user.", "danger")
+            return redirect(url_for("admin.manage_users"))
+
         # Insert the approved user into the main users collection.
-        insert_result = main_users_collection.insert_one(pending_user)
+        try:
+            insert_result = main_users_collection.insert_one(pending_user)
+        except DuplicateKeyError as e:
+            current_app.logger.warning(f"Approving {user_id} hit a duplicate user: {e}")
+            flash("An approved user with this email or username already exists.", "danger")
+            return redirect(url_for("admin.manage_users"))
         if not insert_result.inserted_id:
             flash("Failed to insert user into main collection.", "danger")
             return redirect(url_for("admin.manage_users"))
 
+        record_user_created(pending_user.get("user_type"))
+        invalidate_user(insert_result.inserted_id)
+
         # Use the newly inserted user id for further notifications.
         new_user_id = str(insert_result.inserted_id)
         current_app.logger.info(f"User approved with new user id: {new_user_id}")
@@ -841,61 +822,10 @@ def send_notification_to_approved_user(new_user_id, custom_message, device_token
         current_app.logger.error(f"Invalid device token provided for user {new_user_id}: {device_token}")
         return {"status": "error", "detail": "Invalid device token."}
     
-    cert_b64 = os.environ.get("APNS_CERT_B64_SALESMAN")
-    if not cert_b64:
-        current_app.logger.error("APNS certificate for users not configured in environment variable!")
-        return {"status": "error", "detail": "APNS certificate not set for users."}
-    
     try:
-        current_app.logger.info("Decoding APNs certificate for approved user notifications.")
-        cert_content = base64.b64decode(cert_b64)
-        current_app.logger.debug("APNs certificate decoded successfully.")
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pem") as temp_cert:
-            temp_cert.write(cert_content)
-            temp_cert_path = temp_cert.name
-        current_app.logger.info(f"APNs certificate written to temporary file: {temp_cert_path}")
-        
-        # Check that the temporary certificate file exists and log its size
-        if os.path.exists(temp_cert_path):
-            file_size = os.path.getsize(temp_cert_path)
-            current_app.logger.info(f"Temporary certificate file exists at {temp_cert_path} (size: {file_size} bytes)")
-        else:
-            current_app.logger.error(f"Temporary certificate file does not exist at {temp_cert_path}")
-        
-        # Build the payload and topic
-        current_app.logger.info("Building APNs payload...")
-        payload = Payload(
-            alert={"title": "Account Approved", "body": custom_message},
-            sound="default",
-            badge=1
-        )
-        current_app.logger.debug(f"Payload constructed: alert={payload.alert}, sound={payload.sound}, badge={payload.badge}")
-        
-        topic = "com.Centralfloridaautocare.cfacios"  # Replace with your app's bundle identifier if needed
-        current_app.logger.info(f"Using APNs topic: {topic}")
-        
-        # Create the APNs client with additional logging and error capture
-        current_app.logger.info("Creating APNs client...")
-        try:
-            client = APNsClient(temp_cert_path, use_sandbox=False, use_alternative_port=False)
-            current_app.logger.info("APNs client created successfully.")
-        except Exception as client_error:
-            current_app.logger.error("Failed to create APNs client.")
-            current_app.logger.error(traceback.format_exc())
-            # Clean up the temporary file before re-raising the error.
-            os.remove(temp_cert_path)
-            raise client_error
-        
-        # Send the notification.
-        current_app.logger.info("Sending push notification...")
-        response = client.send_notification(device_token, payload, topic=topic)
+        payload = build_payload("Account Approved", custom_message)
+        response = push_service.send(device_token, payload, topic=SALES_TOPIC, cert_env=SALES_CERT_ENV)
         current_app.logger.info(f"Approved user notification response: {response}")
-        
-        # Clean up the temporary certificate file.
-        os.remove(temp_cert_path)
-        current_app.logger.info(f"Temporary certificate file removed: {temp_cert_path}")
-        
         return {"status": "sent", "detail": str(response)}
     except Exception as e:
         current_app.logger.error("Error sending push notification to approved user:")
@@ -1021,17 +951,17 @@ def add_user():
         if email and users_collection.find_one({"email": email}):
             flash("Email already exists.", "danger")
             return redirect(url_for("admin.add_user"))
-        if username and users_collection.find_one({"username": username}):
+        if username and users_collection.find_one({"username_lower": normalize_username(username)}):
             flash("Username already exists.", "danger")
             return redirect(url_for("admin.add_user"))
 
         # Generate dummy password
         import secrets
         dummy_password = secrets.token_urlsafe(8)
-        hashed_password = bcrypt.generate_password_hash(dummy_password).decode("utf-8")
+        hashed_password = hash_password(dummy_password)
 
         # Insert user
-        users_collection.insert_one({
+        users_collection.insert_one(with_username_lower({
             "email": email,
             "phone": phone,
             "username": username,
@@ -1039,7 +969,8 @@ def add_user():
             "password": hashed_password,
             "user_type": form.user_type.data,
             "creation_date": datetime.utcnow()
-        })
+        }))
+        record_user_created(form.user_type.data)
 
         # Send credentials
         send_credentials(user_email=email, user_phone=phone, password=dummy_password)
@@ -1090,7 +1021,7 @@ def add_customer():
 
         # Generate password for future login
         temp_password = secrets.token_urlsafe(10)
-        hashed_password = bcrypt.generate_password_hash(temp_password).decode("utf-8")
+        hashed_password = hash_password(temp_password)
 
         # Process the first vehicle
         vehicle_label = request.form.get("vehicle_label")
@@ -1119,9 +1050,11 @@ def add_customer():
                 "country": form.country.data.strip()
             }
         }
+        customer_doc.update(customer_search.search_fields(customer_doc))
 
         # Insert customer into the database
         users_collection.insert_one(customer_doc)
+        record_user_created("customer")
 
         # Optional: send credentials via email/phone
         send_credentials(user_email=email, user_phone=phone, password=temp_password)
@@ -1204,6 +1137,7 @@ from bson import ObjectId
 from notis import send_payment_links, notify_admins_new_order, notify_salesperson_new_order_push
 
 import stripe
+from stripe_setup import create_checkout_objects
 
 
 @admin_bp.route('/manual_payment_success')
@@ -1241,7 +1175,8 @@ def create_order_page():
             final_price_float = services_total = fee = travel_fee = 0
 
         # Fetch customer
-        customer = users_col.find_one({"_id": ObjectId(form["customer_id"])})
+        customer_id = form.get("customer_id", "")
+        customer = users_col.find_one({"_id": ObjectId(customer_id)}) if ObjectId.is_valid(customer_id) else None
         if not customer:
             flash("Customer not found!", "danger")
             return redirect(url_for("admin.create_order_page"))
@@ -1251,7 +1186,7 @@ def create_order_page():
 
         # Build order document
         order_data = {
-            "customer_id": ObjectId(form["customer_id"]),
+            "customer_id": customer["_id"],
             "vehicle_size": form.get("vehicle_label"),
             "selectedServices": selected_services,
             "status": "ordered",
@@ -1291,6 +1226,7 @@ def create_order_page():
         # -------------------------------
         insert_result = orders_col.insert_one(order_data)
         order_id = str(insert_result.inserted_id)
+        record_order_created(is_guest=False)
 
         # -------------------------------
         # STRIPE PAYMENT INTENTS
@@ -1301,71 +1237,22 @@ def create_order_page():
         try:
             stripe.api_key = current_app.config["STRIPE_SECRET_KEY"]
 
-            downpayment_amount = int(final_price_float * 100 * 0.40)  # 40% down
-            remaining_amount = int(final_price_float * 100 * 0.60)    # 60% remaining
-
-            downpayment_intent = stripe.PaymentIntent.create(
-                amount=downpayment_amount,
-                currency="usd",
-                payment_method_types=["card"],
-                metadata={"order_id": order_id, "payment_type": "downpayment"}
-            )
-            remaining_intent = stripe.PaymentIntent.create(
-                amount=remaining_amount,
-                currency="usd",
-                payment_method_types=["card"],
-                metadata={"order_id": order_id, "payment_type": "remaining_balance"},
-                capture_method="manual"
-            )
-
             success_url = url_for('admin.manual_payment_success', _external=True) + f"?order_id={order_id}"
             cancel_url = url_for('core.home', _external=True)
-            downpayment_checkout_session = stripe.checkout.Session.create(
-                payment_method_types=["card"],
-                line_items=[{
-                    "price_data": {
-                        "currency": "usd",
-                        "product_data": {"name": f"Down Payment for Order #{order_id}"},
-                        "unit_amount": downpayment_amount,
-                    },
-                    "quantity": 1,
-                }],
-                customer_email=customer_email,
-                mode="payment",
-                metadata={"order_id": order_id},
-                success_url=success_url,
-                cancel_url=cancel_url
-            )
 
-            remaining_checkout_session = stripe.checkout.Session.create(
-                payment_method_types=["card"],
-                line_items=[{
-                    "price_data": {
-                        "currency": "usd",
-                        "product_data": {"name": f"Remaining Balance for Order #{order_id}"},
-                        "unit_amount": remaining_amount,
-                    },
-                    "quantity": 1,
-                }],
-                customer_email=customer_email,
-                mode="payment",
-                metadata={"order_id": order_id},
-                success_url=success_url,
-                cancel_url=cancel_url
+            # 40% down / 60% remaining, all four Stripe calls in parallel
+            stripe_fields = create_checkout_objects(
+                order_id, final_price_float, customer_email, success_url, cancel_url,
+                downpayment_session_extra={"metadata": {"order_id": order_id}},
+                remaining_session_extra={"metadata": {"order_id": order_id}}
             )
-
+            stripe_fields.update({
+                "setup_status": "ready",
+                "updated_date": datetime.utcnow()
+            })
             orders_col.update_one(
                 {"_id": ObjectId(order_id)},
-                {"$set": {
-                    "payment_intent_downpayment": downpayment_intent.id,
-                    "client_secret_downpayment": downpayment_intent.client_secret,
-                    "payment_intent_remaining_balance": remaining_intent.id,
-                    "client_secret_remaining_balance": remaining_intent.client_secret,
-                    "downpayment_checkout_url": downpayment_checkout_session.url,
-                    "remaining_balance_checkout_url": remaining_checkout_session.url,
-                    "setup_status": "ready",
-                    "updated_date": datetime.utcnow()
-                }}
+                {"$set": stripe_fields}
             )
 
             # -------------------------------
@@ -1388,44 +1275,65 @@ def create_order_page():
             return redirect(url_for("admin.create_order_page"))
 
     # -------------------------------
-    # GET: FETCH CUSTOMERS
+    # GET: customers are picked through the typeahead (admin.search_customers)
     # -------------------------------
-    customers = []
-    for user in users_col.find({"user_type": "customer"}):
-        user_copy = user.copy()
-        user_copy["id"] = str(user_copy["_id"])
-        user_copy["display_name"] = user_copy.get("full_name") or user_copy.get("email") or "Unknown"
-
-        # Attach address for frontend if needed
-        user_copy["street_address"] = user_copy.get("street_address", "")
-        user_copy["city"] = user_copy.get("city", "")
-        user_copy["zip_code"] = user_copy.get("zip_code", "")
-        user_copy["unit_apt"] = user_copy.get("unit_apt", "")
-
-        # Vehicles
-        for v in user_copy.get("vehicles", []):
-            v["vehicle_size"] = v.get("vehicle_size", "")
-            v["label"] = v.get("label", "Unnamed Vehicle")
-
-        customers.append(user_copy)
 
     # -------------------------------
     # FETCH SERVICES
     # -------------------------------
     services = []
-    for service in services_col.find({}):
+    for service in find_view(services_col, {}, "create_order_service"):
         s = service.copy()
         s["_id"] = str(s["_id"])
         services.append(s)
 
     return render_template(
         "admin/create_order.html",
-        customers=customers,
         services=services,
         extra_services=[]
     )
 
 
+def _customer_option(user):
+    """JSON shape of one typeahead result (what the create-order form needs)."""
+    address = user.get("address") or {}
+    return {
+        "id": str(user["_id"]),
+        "display_name": user.get("full_name") or user.get("name") or user.get("email") or "Unknown",
+        "email": user.get("email") or "",
+        "phone": user.get("phone") or user.get("phone_number") or "",
+        "street_address": address.get("street_address") or user.get("street_address", ""),
+        "city": address.get("city") or user.get("city", ""),
+        "zip_code": address.get("zip_code") or user.get("zip_code", ""),
+        "unit_apt": address.get("unit_apt") or user.get("unit_apt", ""),
+        "vehicles": [
+            {"label": v.get("label", "Unnamed Vehicle"), "vehicle_size": v.get("vehicle_size", "")}
+            for v in user.get("vehicles", [])
+        ],
+    }
+
+
+@admin_bp.route('/customers/search')
+@login_required
+@admin_required
+def search_customers():
+    """Typeahead for the create-order form: ?q=<name/email/phone prefix>&cursor=<next>."""
+    users_col = current_app.config["USERS_COLLECTION"]
+    try:
+        page = customer_search.search_customers(
+            users_col,
+            request.args.get("q", ""),
+            after=request.args.get("cursor") or None,
+            projection=projection("create_order_customer"),
+        )
+    except InvalidCursor:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return jsonify({
+        "customers": [_customer_option(user) for user in page["items"]],
+        "next_cursor": page["next"],
+    })
+
+
 
 from extensions import csrf  
 @admin_bp.route('/customers/<customer_id>/update', methods=['POST'])
@@ -1481,9 +1389,20 @@ def update_customer(customer_id):
         {"_id": ObjectId(customer_id), "user_type": "customer"},
         {"$set": update_data}
     )
+    # From the stored document: the form doesn't carry name/phone_number.
+    customer_search.refresh_search_fields(users, ObjectId(customer_id))
+    invalidate_user(customer_id)
 
     flash("Customer updated successfully", "success")
     return redirect(url_for("admin.view_customer", customer_id=customer_id))
 
 
 
+
+
+@admin_bp.route('/db_pool_stats')
+@login_required
+@admin_required
+def db_pool_stats():
+    from db import pool_stats
+    return jsonify(pool_stats())
@@ -238,28 +238,35 @@ def collect_payment(order_id):
 
 
 
-from flask import request, current_app
-from bson.objectid import ObjectId
-import stripe
 from notis import notify_techs_new_order  # your push/email notifier
-
-STRIPE_WEBHOOK_SECRET = current_app.config.get('STRIPE_WEBHOOK_SECRET')
+from webhooks import store_event, submit_event
 
 @collecting_bp.route('/stripe_webhook', methods=['POST'])
 def stripe_webhook():
     """
-    Stripe webhook to handle payment events and notify techs on successful payments.
+    Stripe webhook: verify, store the event and return 200.
+    handle_stripe_event applies it in the background.
     """
     payload = request.data
     sig_header = request.headers.get('Stripe-Signature')
 
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, STRIPE_WEBHOOK_SECRET)
+        stripe.Webhook.construct_event(payload, sig_header, STRIPE_WEBHOOK_SECRET)
     except ValueError:
         return 'Invalid payload', 400
     except stripe.error.SignatureVerificationError:
         return 'Invalid signature', 400
 
+    event_id = store_event(payload, source="payments")
+    if event_id:
+        submit_event(current_app._get_current_object(), event_id)
+    return '', 200
+
+
+def handle_stripe_event(event):
+    """
+    Apply a stored payment event and notify techs on successful payments.
+    """
     orders_collection = current_app.config['ORDERS_COLLECTION']
     event_type = event.get('type', '')
 
@@ -271,9 +278,9 @@ def stripe_webhook():
         order_id = payment_intent['metadata'].get('order_id')
 
         if order_id:
-            # 1️⃣ Update payment status
-            orders_collection.update_one(
-                {'_id': ObjectId(order_id)},
+            # 1️⃣ Update payment status (only the first delivery gets through)
+            result = orders_collection.update_one(
+                {'_id': ObjectId(order_id), 'payment_status': {'$ne': 'Paid'}},
                 {'$set': {
                     'payment_status': 'Paid',
                     'stripe_payment_intent_id': payment_intent['id']
@@ -285,7 +292,7 @@ def stripe_webhook():
 
             # 2️⃣ Fetch the full order
             order = orders_collection.find_one({'_id': ObjectId(order_id)})
-            if order:
+            if order and result.modified_count:
                 try:
                     # 3️⃣ Notify techs via push/email
                     notify_techs_new_order(order)
@@ -314,8 +321,6 @@ def stripe_webhook():
 
     # Add any other event types as needed
 
-    return '', 200
-
 
 
 @collecting_bp.route('/create_payment_intent', methods=['POST'])
@@ -11,6 +11,11 @@ import stripe
 from forms import EmployeeLoginForm, UpdateAccountForm, GuestOrderForm
 from extensions import User 
 from utility import register_filters
+from stats import record_order_created
+from order_model import normalize_order
+from identity_cache import invalidate_user
+from customer_search import refresh_search_fields
+from passwords import verify_password
 
 
 
@@ -175,6 +180,8 @@ def account_settings():
                     {'_id': ObjectId(user_id)},
                     {'$set': update_fields}
                 )
+                refresh_search_fields(users_collection, ObjectId(user_id))
+                invalidate_user(user_id)
                 flash('Account settings updated successfully.', 'success')
                 return redirect(url_for('core.account_settings'))
             except Exception as e:
@@ -216,8 +223,7 @@ def employee_login():
             return render_template('employee_login.html', form=form)
 
         # Check the password against the stored hash
-        from flask_bcrypt import check_password_hash
-        if check_password_hash(user_record['password'], password):
+        if verify_password(users_collection, user_record, password):
             # Build a User object for Flask-Login
             user_obj = User(str(user_record['_id']), user_record['user_type'])
             login_user(user_obj)
@@ -280,22 +286,6 @@ def payment_success():
         current_app.logger.error(f"Order not found: {order_id}")
         return "Order not found", 404
 
-    # Convert date fields to datetime objects (if they're stored as strings)
-    for date_field in ['creation_date', 'service_date']:
-        date_value = order.get(date_field)
-        if isinstance(date_value, str):
-            try:
-                # If the string ends with 'Z', replace it with '+00:00' for ISO compatibility
-                if date_value.endswith('Z'):
-                    order[date_field] = datetime.fromisoformat(date_value.replace("Z", "+00:00"))
-                else:
-                    order[date_field] = datetime.fromisoformat(date_value)
-            except ValueError:
-                current_app.logger.error(
-                    f"Invalid {date_field} format for order {order.get('_id')}: {date_value}"
-                )
-                order[date_field] = None
-
     return render_template("payment_success.html", order=order)
 
 
@@ -505,9 +495,9 @@ def guest_order() -> Response:
     # ── POST: insert & redirect --------------------------------------------
     if form.validate_on_submit():
         print("🟢 WTForms validation PASSED – inserting order…")
-        _id = current_app.config["ORDERS_COLLECTION"].insert_one({
+        _id = current_app.config["ORDERS_COLLECTION"].insert_one(normalize_order({
             **order,
-            "creation_date": datetime.utcnow().isoformat(),
+            "creation_date": datetime.utcnow(),
             "status"       : "ordered",
             "payment_status": "Pending",
             "payment_time" : form.payment_time.data,
@@ -523,7 +513,8 @@ def guest_order() -> Response:
                 "country": form.country.data,
             },
             "selectedServices": services,
-        }).inserted_id
+        })).inserted_id
+        record_order_created(is_guest=True)
         print(f"✅ order {_id} INSERTED – redirecting to /guest/stripe/{_id}")
         return redirect(url_for("core.guest_stripe_checkout", order_id=str(_id)))
 
@@ -616,7 +607,7 @@ def guest_start_payment():
         "total"        : total,
         "deposit"      : deposit_amt,
         "estimated_minutes": minutes,
-        "creation_date": datetime.utcnow().isoformat(),
+        "creation_date": datetime.utcnow(),
         "status"       : "ordered",
         "payment_status": "Pending",
         "payment_time" : payment_time,
@@ -631,6 +622,7 @@ def guest_start_payment():
         "selectedServices": services,
     }
     order_id = coll_orders.insert_one(order_doc).inserted_id
+    record_order_created(is_guest=True)
     print(f"✅ order {order_id} INSERTED")
 
     # ── 4. create Stripe checkout(s) --------------------------------------
@@ -11,11 +11,13 @@ import stripe
 import math
 import logging
 from flask import current_app
+from stats import record_order_created, record_user_created
+from customer_search import search_fields
+from passwords import hash_password, verify_password
 import pprint
 
 from pymongo.errors import DuplicateKeyError
 
-from extensions import bcrypt  # Import the initialized bcrypt instance
 from decorators import customer_required
 from forms import (
     CustomerLoginForm, RemoveFromCartForm, RegistrationForm,
@@ -116,7 +118,7 @@ def start_payment():
                              for item in session['cart']],
         'services_total': services_total,
         'final_price': final_price,
-        'order_date': datetime.now(),
+        'order_date': datetime.utcnow(),
         'service_date': None,
         'service_time': None,
         'status': "ordered",
@@ -136,6 +138,7 @@ def start_payment():
     
     current_app.logger.info("Creating order with data: %s", order)
     order_result = orders_collection.insert_one(order)
+    record_order_created(is_guest=False)
     order_id = str(order_result.inserted_id)
     current_app.logger.info("Order created with id: %s", order_id)
     
@@ -722,7 +725,7 @@ def customer_login():
         if user:
             from extensions import User  # Your custom Flask-Login user model
             try:
-                if bcrypt.check_password_hash(user['password'], password):
+                if verify_password(users_collection, user, password):
                     user_obj = User(str(user['_id']), user['user_type'])
                     login_user(user_obj)
                     flash('Logged in successfully as customer.', 'success')
@@ -774,24 +777,7 @@ def my_orders():
     }
     user_orders = list(orders_collection.find(query).sort('order_date', -1))
 
-    # Convert date strings to datetime objects (if necessary) so they can be formatted in the template.
-    date_fields = ['creation_date', 'order_date', 'service_date']
     for order in user_orders:
-        for field in date_fields:
-            date_value = order.get(field)
-            if date_value and isinstance(date_value, str):
-                try:
-                    # Replace trailing 'Z' with '+00:00' for ISO compatibility if necessary.
-                    if date_value.endswith('Z'):
-                        order[field] = datetime.fromisoformat(date_value.replace("Z", "+00:00"))
-                    else:
-                        order[field] = datetime.fromisoformat(date_value)
-                except Exception as e:
-                    current_app.logger.error(
-                        f"Error converting {field} for order {order.get('_id')}: {date_value} - {e}"
-                    )
-                    order[field] = None
-
         # Build service details for display.
         order['service_details'] = []
         for item in order.get('services', []):
@@ -833,8 +819,8 @@ def register():
         zip_code = form.zip_code.data.strip()
         sms_opt_in = form.sms_opt_in.data
 
-        # Use the globally initialized bcrypt to hash the password
-        hashed_pw = bcrypt.generate_password_hash(password).decode('utf-8')
+        # Hash on the bounded password pool (passwords.py)
+        hashed_pw = hash_password(password)
 
         user_doc = {
             'name': name,
@@ -855,10 +841,12 @@ def register():
 
         if phone_number:
             user_doc['phone_number'] = phone_number
+        user_doc.update(search_fields(user_doc))
 
         try:
             # Insert the new user
             users_collection.insert_one(user_doc)
+            record_user_created('customer')
             flash('Account created successfully! Please log in.', 'success')
             return redirect(url_for('customer.customer_login'))
 
@@ -930,8 +918,8 @@ def reset_password(token):
     if form.validate_on_submit():
         user = users_collection.find_one({'email': email, 'user_type': 'customer'})
         if user:
-            # Use the globally initialized bcrypt to hash the new password
-            hashed_pw = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+            # Hash on the bounded password pool (passwords.py)
+            hashed_pw = hash_password(form.password.data)
             users_collection.update_one(
                 {'_id': user['_id']},
                 {'$set': {'password': hashed_pw}}
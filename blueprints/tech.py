@@ -11,6 +11,8 @@ import logging
 import math
 
 from decorators import tech_required
+from reminders import schedule_order_reminders
+from projections import find_view
 from forms import EmployeeLoginForm
 
 tech_bp = Blueprint('tech', __name__, url_prefix='/tech')
@@ -32,7 +34,7 @@ def tech_main():
         filter_query = {'status': 'ordered'}
 
         # 2) Fetch all 'ordered' orders, sorted by order_date descending
-        orders = list(orders_collection.find(filter_query).sort('order_date', -1))
+        orders = list(find_view(orders_collection, filter_query, 'order_api', sort=[('order_date', -1)]))
 
         # 3) Enrich each order
         for order in orders:
@@ -43,12 +45,6 @@ def tech_main():
             else:
                 order['user_display'] = 'Guest'
 
-            # Convert date strings to datetime objects
-            if isinstance(order.get('order_date'), str):
-                order['order_date'] = datetime.strptime(order['order_date'], '%Y-%m-%d %H:%M:%S')
-            if isinstance(order.get('service_date'), str):
-                order['service_date'] = datetime.strptime(order['service_date'], '%Y-%m-%d')
-
             # Fetch product details
             try:
                 product_ids = []
@@ -114,12 +110,6 @@ def my_schedule():
                 )
                 order['product_details'] = []
 
-            # Convert date strings
-            if isinstance(order.get('order_date'), str):
-                order['order_date'] = datetime.strptime(order['order_date'], '%Y-%m-%d %H:%M:%S')
-            if isinstance(order.get('service_date'), str):
-                order['service_date'] = datetime.strptime(order['service_date'], '%Y-%m-%d')
-
             # Include address details
             if order.get('guest_address'):
                 order['address'] = order['guest_address']
@@ -184,6 +174,10 @@ def schedule_order(order_id):
                 }
             }
         )
+        try:
+            schedule_order_reminders(ObjectId(order_id), tech_id=current_user.id)
+        except Exception as e:
+            current_app.logger.error(f"Error scheduling reminders for order {order_id}: {str(e)}")
 
         updated_order = orders_collection.find_one({'_id': ObjectId(order_id)})
 
@@ -294,12 +288,6 @@ def tech_view_order(order_id):
         products = list(products_collection.find({'_id': {'$in': product_ids}}))
         products_dict = {str(p['_id']): p for p in products}
 
-        # Convert date strings
-        if isinstance(order.get('order_date'), str):
-            order['order_date'] = datetime.strptime(order['order_date'], '%Y-%m-%d %H:%M:%S')
-        if isinstance(order.get('service_date'), str):
-            order['service_date'] = datetime.strptime(order['service_date'], '%Y-%m-%d')
-
         # Build address
         if order.get('guest_address'):
             order['address'] = order['guest_address']
@@ -0,0 +1,131 @@
+# customer_search.py
+# Prefix search over customers for the admin create-order typeahead.
+#
+# Customers carry two derived fields, kept up to date by every writer:
+#   search_name  lowercased display name (sort key for paging)
+#   search_keys  lowercased name + name words, lowercased email, phone digits
+# An anchored, case-sensitive regex on a lowercased field is an index range
+# scan on (user_type, search_keys), so a lookup reads only the customers that
+# match the prefix. Those are then sorted by search_name in memory, which
+# stays cheap for the two-plus-character prefixes we accept but is not free
+# for a very common one.
+#
+#   python customer_search.py backfill            # fill the fields on existing users
+#   python customer_search.py backfill --restart  # redo every user
+#
+# The backfill runs in the Procfile release step. It checkpoints in the
+# `migrations` collection, so after the first full pass a release only looks
+# at users created since; bump BACKFILL_ID when search_fields changes.
+import re
+import sys
+from datetime import datetime
+
+from pymongo import ASCENDING, UpdateOne
+
+from pagination import keyset_page
+
+BACKFILL_ID = "customer_search_v1"
+MIN_QUERY_LENGTH = 2
+SEARCH_PAGE_SIZE = 20
+
+SEARCH_SOURCE_FIELDS = {"full_name": 1, "name": 1, "email": 1, "phone": 1, "phone_number": 1}
+
+
+def _display_name(user):
+    return user.get("full_name") or user.get("name") or user.get("email") or ""
+
+
+def search_fields(user):
+    """{"search_name", "search_keys"} for a user document (or $set dict)."""
+    keys = set()
+    name = " ".join(_display_name(user).split()).lower()
+    if name:
+        keys.add(name)
+        keys.update(name.split(" "))
+    email = (user.get("email") or "").strip().lower()
+    if email:
+        keys.add(email)
+    for field in ("phone", "phone_number"):
+        digits = re.sub(r"\D", "", user.get(field) or "")
+        if digits:
+            keys.add(digits)
+            # +1 numbers are also findable without the country code.
+            if len(digits) == 11 and digits.startswith("1"):
+                keys.add(digits[1:])
+    return {"search_name": name, "search_keys": sorted(keys)}
+
+
+def refresh_search_fields(users_collection, user_id):
+    """Recompute the derived fields after a name/email/phone change."""
+    user = users_collection.find_one({"_id": user_id}, SEARCH_SOURCE_FIELDS)
+    if user:
+        users_collection.update_one({"_id": user_id}, {"$set": search_fields(user)})
+
+
+def _normalize_query(q):
+    q = " ".join((q or "").split()).lower()
+    digits = re.sub(r"\D", "", q)
+    # "(555) 010-0" and "555-0100" are phone prefixes; search on the digits.
+    if digits and not re.search(r"[a-z@]", q):
+        return digits
+    return q
+
+
+def search_customers(users_collection, q, after=None, limit=SEARCH_PAGE_SIZE, projection=None):
+    """
+    One keyset page of customers whose name, a name word, email or phone
+    starts with `q`, ordered by name. Returns keyset_page's dict; a query
+    shorter than MIN_QUERY_LENGTH returns an empty page.
+    """
+    q = _normalize_query(q)
+    if len(q) < MIN_QUERY_LENGTH:
+        return {"items": [], "next": None, "prev": None}
+    query = {
+        "user_type": "customer",
+        "search_keys": {"$regex": "^" + re.escape(q)},
+    }
+    return keyset_page(
+        users_collection, query, "search_name",
+        direction=ASCENDING, limit=limit, after=after, projection=projection
+    )
+
+
+def backfill(batch_size=500, restart=False):
+    """Set search_name/search_keys on every user, in _id batches. Resumable."""
+    from db import get_collection
+
+    users = get_collection("users")
+    migrations = get_collection("migrations")
+    if restart:
+        migrations.delete_one({"_id": BACKFILL_ID})
+    state = migrations.find_one({"_id": BACKFILL_ID}) or {}
+    last_id = state.get("last_id")
+    updated = state.get("updated", 0)
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = list(users.find(query, SEARCH_SOURCE_FIELDS).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        ops = [UpdateOne({"_id": user["_id"]}, {"$set": search_fields(user)}) for user in batch]
+        updated += users.bulk_write(ops, ordered=False).modified_count
+        last_id = batch[-1]["_id"]
+        migrations.update_one(
+            {"_id": BACKFILL_ID},
+            {"$set": {"last_id": last_id, "updated": updated, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        print(f"[CUSTOMER_SEARCH] through {last_id}: updated={updated}")
+    print(f"[CUSTOMER_SEARCH] done: updated={updated}")
+    return updated
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "backfill":
+        backfill(restart="--restart" in sys.argv[2:])
+    else:
+        print("usage: python customer_search.py backfill [--restart]")
+        sys.exit(2)
@@ -1,13 +1,186 @@
 #db.py
-from pymongo import MongoClient
+# Single place that owns the MongoDB connection pool. Every blueprint and API
+# module should get its collections from here (or from app.config, which is
+# filled from here) instead of building its own MongoClient.
 import os
+import threading
+from collections import Counter
+
+from pymongo import MongoClient, monitoring
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+DEFAULT_DB_NAME = "cfacdb"
+
+# Pool tuning (override per environment with env vars)
+POOL_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "20")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000")),
+    "compressors": os.getenv("MONGO_COMPRESSORS", "zlib"),
+    "retryWrites": True,
+    # Don't open sockets / monitor threads until the first operation, so a
+    # client built in the gunicorn master is never shared across a fork.
+    "connect": False,
+}
+
+# app.config key -> collection name
+COLLECTIONS = {
+    "USERS_COLLECTION": "users",
+    "ORDERS_COLLECTION": "orders",
+    "SERVICES_COLLECTION": "services",
+    "DEVICE_TOKENS_COLLECTION": "device_tokens",
+    "ESTIMATE_REQUESTS_COLLECTION": "estimaterequests",
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# -------------------------------
+# Pool statistics
+# -------------------------------
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts pool events so we can see sockets per worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def _bump(self, key, amount=1):
+        with self._lock:
+            self.counters[key] += amount
+
+    def pool_created(self, event):
+        self._bump("pools_created")
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump("pools_cleared")
+
+    def pool_closed(self, event):
+        self._bump("pools_closed")
+
+    def connection_created(self, event):
+        self._bump("connections_created")
+        self._bump("connections_open")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump("connections_closed")
+        self._bump("connections_open", -1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump("checkout_failures")
+
+    def connection_checked_out(self, event):
+        self._bump("checkouts")
+        self._bump("checked_out", 1)
+
+    def connection_checked_in(self, event):
+        self._bump("checked_out", -1)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+pool_listener = PoolStatsListener()
+
+
+# -------------------------------
+# Client / database handles
+# -------------------------------
+def get_client(uri=None) -> MongoClient:
+    """Return the process-wide MongoClient, creating it on first use."""
+    global _client
+    if _client is not None:
+        return _client
+
+    with _client_lock:
+        if _client is None:
+            uri = uri or os.getenv("MONGODB_URI")
+            if not uri:
+                raise RuntimeError("MONGODB_URI not set")
+            allow_invalid = os.getenv("MONGO_TLS_ALLOW_INVALID_CERTS", "false").lower() == "true"
+            _client = MongoClient(
+                uri,
+                tls=True,
+                tlsAllowInvalidCertificates=allow_invalid,
+                event_listeners=[pool_listener],
+                **POOL_OPTIONS,
+            )
+    return _client
+
+
+def db_name():
+    # Read on use, not at import: the CLI scripts import db before load_dotenv().
+    return os.getenv("MONGODB_DB", DEFAULT_DB_NAME)
+
+
+def get_db() -> Database:
+    return get_client()[db_name()]
+
+
+def get_collection(name) -> Collection:
+    return get_db()[name]
+
+
+def users() -> Collection:
+    return get_collection("users")
+
+
+def orders() -> Collection:
+    return get_collection("orders")
+
+
+def services() -> Collection:
+    return get_collection("services")
+
+
+def device_tokens() -> Collection:
+    return get_collection("device_tokens")
+
+
+def territories() -> Collection:
+    return get_collection("territories")
+
+
+def houses() -> Collection:
+    return get_collection("houses")
+
+
+def close_client():
+    """Close the pool (e.g. before fork or at shutdown)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+        pool_listener.counters.clear()
+
+
+def pool_stats():
+    """Pool options plus live counters for this process."""
+    stats = pool_listener.snapshot()
+    stats["pid"] = os.getpid()
+    stats["client_open"] = _client is not None
+    stats["options"] = {k: v for k, v in POOL_OPTIONS.items()}
+    return stats
+
 
 def init_db(app):
-    mongodb_uri = app.config['MONGODB_URI']
-    client = MongoClient(mongodb_uri, tls=True, tlsAllowInvalidCertificates=True)
-    db = client["cfacdb"]
+    db = get_client(app.config.get('MONGODB_URI'))[db_name()]
     # Store collections on the app configuration for global access
-    app.config['USERS_COLLECTION'] = db["users"]
-    app.config['ORDERS_COLLECTION'] = db["orders"]
-    app.config['ESTIMATE_REQUESTS_COLLECTION'] = db["estimaterequests"]
-    app.config['SERVICES_COLLECTION'] = db["services"]
+    app.config["MONGO_CLIENT"] = db
+    for config_key, name in COLLECTIONS.items():
+        app.config[config_key] = db[name]
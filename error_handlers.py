@@ -1,6 +1,8 @@
 # error_handlers.py
 
-from flask import render_template
+from flask import render_template, request, jsonify
+
+from passwords import PasswordHashingBusy
 
 def register_error_handlers(app):
     @app.errorhandler(404)
@@ -11,3 +13,16 @@ def register_error_handlers(app):
     def internal_error(error):
         # Optional: log error details here
         return render_template('500.html'), 500
+
+    @app.errorhandler(PasswordHashingBusy)
+    def password_hashing_busy(error):
+        # Login burst: shed instead of queueing every request thread on bcrypt.
+        app.logger.warning(f"[PASSWORDS] Hashing pool full, shedding {request.path}")
+        message = "Too many sign-in attempts right now. Please try again in a moment."
+        if request.path.startswith('/api/'):
+            response = jsonify({"error": message})
+        else:
+            response = app.response_class(message, mimetype='text/plain')
+        response.status_code = 503
+        response.headers['Retry-After'] = '2'
+        return response
@@ -5,6 +5,7 @@ from flask_login import LoginManager, UserMixin
 from flask_wtf import CSRFProtect
 from flask import current_app
 from bson.objectid import ObjectId
+from identity_cache import get_identity
 import logging
 
 
@@ -25,25 +26,11 @@ def load_user(user_id):
     Flask-Login calls this to load a user from user_id in the session.
     """
     try:
-        # Access Mongo via current_app
-        users_collection = current_app.config['USERS_COLLECTION']
-        user_record = users_collection.find_one({"_id": ObjectId(user_id)})
+        # Usually served from the worker's identity cache (no Mongo round trip)
+        user_record = get_identity(user_id)
         if user_record and user_record.get('user_type') in ['customer', 'admin', 'tech', 'sales']:
             return User(str(user_record['_id']), user_record['user_type'])
     except Exception as e:
         current_app.logger.error(f"Error loading user {user_id}: {e}")
         return None
     return None
-
-def create_unique_indexes():
-    """
-    Creates unique and sparse indexes on 'email' and 'phone_number'
-    fields in the users_collection, using current_app context.
-    """
-    try:
-        users_collection = current_app.config['USERS_COLLECTION']
-        users_collection.create_index('email', unique=True, sparse=True)
-        users_collection.create_index('phone_number', unique=True, sparse=True)
-        current_app.logger.info("Unique indexes created on 'email' and 'phone_number'.")
-    except Exception as e:
-        current_app.logger.error(f"Error creating indexes: {e}")
@@ -0,0 +1,93 @@
+# geometry.py
+# Array geometry for territory house sets: bbox prefilter + ray-casting
+# point-in-polygon over NumPy arrays, and hashed dedup of house items by
+# address/zip and by coordinate. Items are the houses-in-area dicts
+# ({address, city, state, zip, lat, lon, ...}); rings are [[lon, lat], ...].
+import numpy as np
+
+# Coordinates are compared at 1e-6 degrees (~10 cm), like the old
+# round(lat, 6) keys.
+COORD_SCALE = 1_000_000
+
+
+def ring_bbox(ring):
+    """[minLon, minLat, maxLon, maxLat] of a ring."""
+    pts = np.asarray(ring, dtype=float)
+    return [float(pts[:, 0].min()), float(pts[:, 1].min()), float(pts[:, 0].max()), float(pts[:, 1].max())]
+
+
+def points_in_ring(lons, lats, ring):
+    """
+    Boolean mask: which (lon, lat) points fall inside the closed ring.
+    Points outside the ring's bbox are rejected before the edge loop, which
+    runs once per edge over all remaining points.
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    ring = np.asarray(ring, dtype=float)
+    min_lon, min_lat, max_lon, max_lat = ring_bbox(ring)
+
+    mask = (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+    idx = np.nonzero(mask)[0]
+    if idx.size == 0:
+        return mask
+
+    x, y = lons[idx], lats[idx]
+    inside = np.zeros(idx.size, dtype=bool)
+    x1, y1 = ring[:-1, 0], ring[:-1, 1]
+    x2, y2 = ring[1:, 0], ring[1:, 1]
+    for i in range(len(x1)):
+        if y1[i] == y2[i]:
+            continue  # horizontal edges never cross the ray
+        crosses = (y1[i] > y) != (y2[i] > y)
+        x_cross = x1[i] + (y - y1[i]) * (x2[i] - x1[i]) / (y2[i] - y1[i])
+        inside ^= crosses & (x < x_cross)
+
+    mask[idx] = inside
+    return mask
+
+
+def clip_items(items, ring):
+    """The items whose lat/lon fall inside the ring, in their original order."""
+    if not items:
+        return []
+    lons = np.fromiter((h["lon"] for h in items), dtype=float, count=len(items))
+    lats = np.fromiter((h["lat"] for h in items), dtype=float, count=len(items))
+    keep = points_in_ring(lons, lats, ring)
+    return [h for h, k in zip(items, keep) if k]
+
+
+def coord_keys(lons, lats):
+    """One int64 per point identifying its 1e-6 degree cell (for hashing/dedup)."""
+    lon_i = np.rint(np.asarray(lons, dtype=float) * COORD_SCALE).astype(np.int64)
+    lat_i = np.rint(np.asarray(lats, dtype=float) * COORD_SCALE).astype(np.int64)
+    # lon in [-180e6, 180e6] fits in 29 bits; shift lat above it.
+    return (lat_i << 30) + (lon_i + (1 << 29))
+
+
+def address_key(item):
+    """Dedup key for an item's street address: (normalized address, zip)."""
+    address = " ".join((item.get("address") or "").lower().split())
+    return (address, (item.get("zip") or "").strip()) if address else None
+
+
+def dedup_items(items):
+    """
+    Drop items that repeat an earlier item's address/zip or coordinate (an
+    OSM node and the building way around it, say). Keeps first occurrences.
+    """
+    if not items:
+        return []
+    keys = coord_keys([h["lon"] for h in items], [h["lat"] for h in items]).tolist()
+    seen_coords = set()
+    seen_addresses = set()
+    out = []
+    for item, ck in zip(items, keys):
+        ak = address_key(item)
+        if ck in seen_coords or (ak is not None and ak in seen_addresses):
+            continue
+        seen_coords.add(ck)
+        if ak is not None:
+            seen_addresses.add(ak)
+        out.append(item)
+    return out
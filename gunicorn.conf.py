@@ -0,0 +1,25 @@
+# gunicorn.conf.py
+# Load the app once in the master and fork workers from it (copy-on-write).
+# Everything that owns sockets or threads is opened per worker in post_fork.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "3"))
+# Threaded workers: a request waiting on the password pool (passwords.py) or
+# on Mongo doesn't block the other requests its worker is serving. The
+# password pool's slots are sized from GUNICORN_THREADS too.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+preload_app = True
+
+
+def post_fork(server, worker):
+    from app import app
+    from lifecycle import init_worker
+    init_worker(app)
+    server.log.info(f"Worker {worker.pid} bootstrapped")
+
+
+def worker_exit(server, worker):
+    from db import close_client
+    close_client()
@@ -0,0 +1,136 @@
+# identity_cache.py
+# Per-worker TTL + LRU cache of user identities (id -> user_type, display
+# fields, version) for Flask-Login's load_user and the JWT endpoints, so an
+# authenticated request normally costs no users round trip.
+#
+# Invalidation: writers call invalidate_user(user_id), which bumps the user's
+# `version` and records the id in `identity_invalidations`. Each worker reads
+# that collection at most every INVALIDATION_POLL seconds (one small query,
+# not one per request) and evicts the ids it finds. TTL bounds staleness if
+# anything is missed.
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from db import get_collection
+
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "5000"))
+IDENTITY_CACHE_TTL = int(os.getenv("IDENTITY_CACHE_TTL", "300"))
+INVALIDATION_POLL = int(os.getenv("IDENTITY_INVALIDATION_POLL", "5"))
+# Each poll re-reads this much history, so a row committed late (clock skew,
+# slow write) is still seen. Evicting twice is harmless.
+INVALIDATION_OVERLAP = timedelta(seconds=30)
+
+IDENTITY_FIELDS = {"user_type": 1, "email": 1, "username": 1, "full_name": 1, "version": 1}
+
+
+class IdentityCache:
+    def __init__(self, maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._entries = OrderedDict()  # user_id -> (expires_at, identity)
+        self._pid = os.getpid()
+        self._last_poll = 0.0
+        self._polled_at = datetime.utcnow()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def get(self, user_id):
+        with self._lock:
+            self._check_fork()
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, identity = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return identity
+
+    def put(self, user_id, identity):
+        with self._lock:
+            self._check_fork()
+            self._entries[user_id] = (time.monotonic() + self.ttl, identity)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def poll_invalidations(self):
+        """Evict users invalidated by any worker since the last poll."""
+        now = time.monotonic()
+        with self._lock:
+            self._check_fork()
+            if now - self._last_poll < INVALIDATION_POLL:
+                return
+            self._last_poll = now
+            since = self._polled_at - INVALIDATION_OVERLAP
+            polled_at = datetime.utcnow()
+        try:
+            rows = list(get_collection("identity_invalidations").find(
+                {"at": {"$gte": since}}, {"user_id": 1}
+            ))
+        except Exception:
+            # Can't tell what changed: drop everything rather than serve stale.
+            self.clear()
+            return
+        with self._lock:
+            for row in rows:
+                self._entries.pop(row["user_id"], None)
+            self._polled_at = polled_at
+
+
+identity_cache = IdentityCache()
+
+
+def get_identity(user_id):
+    """
+    {"_id", "user_type", "email", "username", "full_name", "version"} for a
+    user id (str or ObjectId), or None if there is no such user.
+    """
+    user_id = str(user_id)
+    identity_cache.poll_invalidations()
+    identity = identity_cache.get(user_id)
+    if identity is not None:
+        return identity
+
+    try:
+        oid = ObjectId(user_id)
+    except (InvalidId, TypeError):
+        return None
+    identity = get_collection("users").find_one({"_id": oid}, IDENTITY_FIELDS)
+    if identity is None:
+        return None
+    identity_cache.put(user_id, identity)
+    return identity
+
+
+def invalidate_user(user_id):
+    """Call after updating, approving or deleting a user."""
+    user_id = str(user_id)
+    identity_cache.evict(user_id)
+    try:
+        oid = ObjectId(user_id)
+    except (InvalidId, TypeError):
+        return
+    get_collection("users").update_one({"_id": oid}, {"$inc": {"version": 1}})
+    get_collection("identity_invalidations").insert_one({"user_id": user_id, "at": datetime.utcnow()})
@@ -0,0 +1,266 @@
+# indexes.py
+# Declarative index registry: every index the app relies on, per collection,
+# in one place. apply_indexes() is idempotent (it only creates what's
+# missing) and runs at release time; worker start and the scheduler call
+# ensure_indexes(), which checks once per process. Request handlers never
+# create indexes.
+#
+#   python indexes.py apply     # create missing indexes
+#   python indexes.py explain   # replay the app's query shapes, flag COLLSCANs
+import logging
+import os
+import sys
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+from db import get_collection
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+
+# collection -> [{"keys": [...], "name": ..., **create_index options}]
+INDEXES = {
+    "orders": [
+        # Keyset listings (pagination.py)
+        {"keys": [("creation_date", DESCENDING), ("_id", DESCENDING)], "name": "creation_date_id"},
+        {"keys": [("service_date", DESCENDING), ("_id", DESCENDING)], "name": "service_date_id"},
+        {"keys": [("salesperson", ASCENDING), ("creation_date", DESCENDING), ("_id", DESCENDING)],
+         "name": "salesperson_creation_date_id"},
+        # Tech app / tech pages
+        {"keys": [("technician", ASCENDING), ("service_date", DESCENDING)], "name": "technician_service_date"},
+        {"keys": [("status", ASCENDING), ("order_date", DESCENDING)], "name": "status_order_date"},
+        {"keys": [("added_to_scheduled_by", ASCENDING), ("status", ASCENDING), ("service_date", ASCENDING)],
+         "name": "scheduled_by_status_service_date"},
+        {"keys": [("has_downpayment_collected", ASCENDING), ("orderhasbeenscheduled", ASCENDING)],
+         "name": "downpayment_unscheduled"},
+        {"keys": [("payment_status", ASCENDING)], "name": "payment_status"},
+        # Customer "my orders" ($or over these three)
+        {"keys": [("user", ASCENDING), ("order_date", DESCENDING)], "name": "user_order_date"},
+        {"keys": [("is_guest", ASCENDING), ("guest_email", ASCENDING)], "name": "guest_email"},
+        {"keys": [("is_guest", ASCENDING), ("guest_phone_number", ASCENDING)], "name": "guest_phone"},
+        {"keys": [("customer_id", ASCENDING)], "name": "customer_id"},
+        # order_setup.resume_stuck_order_setups
+        {"keys": [("setup_status", ASCENDING), ("updated_date", ASCENDING)], "name": "setup_status_updated"},
+    ],
+    "users": [
+        {"keys": [("email", ASCENDING)], "name": "email_1", "unique": True, "sparse": True},
+        {"keys": [("phone_number", ASCENDING)], "name": "phone_number_1", "unique": True, "sparse": True},
+        {"keys": [("username", ASCENDING)], "name": "username_1"},
+        # /api/login (user_model.py); run migrate_usernames.py before the first apply.
+        {"keys": [("username_lower", ASCENDING)], "name": "username_lower_1", "unique": True, "sparse": True},
+        {"keys": [("user_type", ASCENDING), ("_id", ASCENDING)], "name": "user_type_id"},
+        {"keys": [("email", ASCENDING), ("_id", ASCENDING)], "name": "email_id"},
+        # Admin create-order customer typeahead (customer_search.py)
+        {"keys": [("user_type", ASCENDING), ("search_keys", ASCENDING)], "name": "user_type_search_keys"},
+    ],
+    "device_tokens": [
+        {"keys": [("user_id", ASCENDING)], "name": "user_id"},
+        {"keys": [("device_token", ASCENDING)], "name": "device_token"},
+    ],
+    "addresses": [
+        # houses-in-area / /api/houses (addresses.py); _id is the OSM id.
+        {"keys": [("loc", "2dsphere")], "name": "loc_2dsphere"},
+    ],
+    "overpass_tiles": [
+        # _id is "zoom/x/y". Tiles expire after overpass_tiles.TILE_TTL and are re-pulled.
+        {"keys": [("fetched_at", ASCENDING)], "name": "fetched_at_1", "expireAfterSeconds": 30 * DAY},
+    ],
+    "houses": [
+        # Territory houses (api_territories._persist_houses_to_territory)
+        {"keys": [("loc", "2dsphere")], "name": "loc_2dsphere"},
+        {"keys": [("territory_id", ASCENDING), ("address", ASCENDING), ("zip", ASCENDING)],
+         "name": "uniq_per_territory_addr_zip", "unique": True},
+    ],
+    "territories": [
+        {"keys": [("user_id", ASCENDING), ("created_at", DESCENDING)], "name": "user_id_created_at"},
+    ],
+    "reminders": [
+        {"keys": [("status", ASCENDING), ("fire_at", ASCENDING)], "name": "pending_by_fire_at"},
+        {"keys": [("order_id", ASCENDING), ("threshold", ASCENDING)], "name": "uniq_order_threshold",
+         "unique": True},
+    ],
+    "outbox": [
+        {"keys": [("status", ASCENDING), ("next_attempt_at", ASCENDING)], "name": "pending_by_next_attempt"},
+        {"keys": [("idempotency_key", ASCENDING)], "name": "idempotency_key_1", "unique": True, "sparse": True},
+        {"keys": [("claim_id", ASCENDING)], "name": "claim_id_1", "sparse": True},
+        # Delivered messages are kept for a month, then expire.
+        {"keys": [("sent_at", ASCENDING)], "name": "sent_at_1", "expireAfterSeconds": 30 * DAY},
+    ],
+    "webhook_events": [
+        # _id is the Stripe event id, which is what makes ingestion idempotent.
+        {"keys": [("status", ASCENDING), ("received_at", ASCENDING)], "name": "pending_by_received_at"},
+        {"keys": [("processed_at", ASCENDING)], "name": "processed_at_1", "expireAfterSeconds": 30 * DAY},
+    ],
+    "job_runs": [
+        {"keys": [("job", ASCENDING), ("started_at", DESCENDING)], "name": "job_1_started_at_-1"},
+        # Minute-level jobs add up; keep a month of history.
+        {"keys": [("finished_at", ASCENDING)], "name": "finished_at_1", "expireAfterSeconds": 30 * DAY},
+    ],
+    "identity_invalidations": [
+        # Workers only look back a few seconds; a day is plenty.
+        {"keys": [("at", ASCENDING)], "name": "at_1", "expireAfterSeconds": DAY},
+    ],
+    "job_locks": [
+        {"keys": [("expires_at", ASCENDING)], "name": "expires_at_1"},
+    ],
+}
+
+# Indexes we used to register; apply_indexes drops them where they exist.
+RETIRED_INDEXES = {
+    # Tech reminder scan, replaced by the reminders collection (reminders.py)
+    "orders": ["reminder_window"],
+}
+
+
+def _key_tuple(keys):
+    return tuple((field, direction) for field, direction in keys)
+
+
+def apply_indexes(collections=None):
+    """
+    Create every registered index that doesn't exist yet. An index with the
+    same keys under another name counts as present. Returns the names created.
+    """
+    created = []
+    for coll_name, specs in INDEXES.items():
+        if collections and coll_name not in collections:
+            continue
+        collection = get_collection(coll_name)
+        existing = {
+            _key_tuple(info["key"]): name
+            for name, info in collection.index_information().items()
+        }
+        for spec in specs:
+            options = {k: v for k, v in spec.items() if k != "keys"}
+            keys = _key_tuple(spec["keys"])
+            if keys in existing:
+                continue
+            try:
+                collection.create_index(spec["keys"], **options)
+                created.append(f"{coll_name}.{spec['name']}")
+            except Exception as e:
+                # e.g. a unique index over existing duplicates: report, keep going.
+                logger.error(f"[INDEXES] Could not create {coll_name}.{spec['name']}: {e}")
+    if created:
+        logger.info(f"[INDEXES] Created {created}")
+    _drop_retired(collections)
+    return created
+
+
+def _drop_retired(collections=None):
+    for coll_name, names in RETIRED_INDEXES.items():
+        if collections and coll_name not in collections:
+            continue
+        collection = get_collection(coll_name)
+        for name in set(names) & set(collection.index_information()):
+            collection.drop_index(name)
+            logger.info(f"[INDEXES] Dropped retired {coll_name}.{name}")
+
+
+_verified_pid = None
+
+
+def ensure_indexes():
+    """apply_indexes() once per process; later calls cost nothing."""
+    global _verified_pid
+    if _verified_pid == os.getpid():
+        return []
+    created = apply_indexes()
+    _verified_pid = os.getpid()
+    return created
+
+
+# -------------------------------
+# Advisor
+# -------------------------------
+_ID = ObjectId()
+_USER_ID = str(_ID)
+
+# The query shapes behind the hot endpoints. Values are placeholders; only
+# the shape matters to the planner.
+QUERY_SHAPES = [
+    ("admin_main", "orders", {}, [("creation_date", DESCENDING), ("_id", DESCENDING)]),
+    ("compensation_page", "orders", {}, [("service_date", DESCENDING), ("_id", DESCENDING)]),
+    ("api_sales.fetch_orders", "orders", {"salesperson": _USER_ID},
+     [("creation_date", DESCENDING), ("_id", DESCENDING)]),
+    ("api_sales.compensated_orders", "orders", {"salesperson": _USER_ID}, None),
+    ("api_tech.scheduled_orders", "orders", {"technician": _USER_ID}, None),
+    ("api_tech.orders_with_downpayment", "orders", {
+        "has_downpayment_collected": "yes",
+        "$or": [{"orderhasbeenscheduled": {"$exists": False}}, {"orderhasbeenscheduled": False}],
+    }, None),
+    ("tech.tech_main", "orders", {"status": "ordered"}, [("order_date", DESCENDING)]),
+    ("tech.my_schedule", "orders", {"status": "scheduled", "added_to_scheduled_by": _USER_ID},
+     [("service_date", ASCENDING)]),
+    ("customer.my_orders", "orders", {"$or": [
+        {"user": _USER_ID},
+        {"$and": [{"is_guest": True}, {"$or": [
+            {"guest_email": "someone@example.com"}, {"guest_phone_number": "+15555550100"},
+        ]}]},
+    ]}, [("order_date", DESCENDING)]),
+    ("resume_stuck_order_setups", "orders",
+     {"setup_status": "creating", "updated_date": {"$lte": datetime(2000, 1, 1)}}, None),
+    ("manage_users", "users", {}, [("_id", ASCENDING)]),
+    ("manage_users.by_type", "users", {"user_type": "tech"}, [("_id", ASCENDING)]),
+    ("users.by_username", "users", {"username": "someone"}, None),
+    ("api_auth.api_login", "users", {"username_lower": "someone"}, None),
+    ("admin.search_customers", "users", {"user_type": "customer", "search_keys": {"$regex": "^ann"}}, None),
+    ("device_tokens.by_user", "device_tokens", {"user_id": _USER_ID}, None),
+    ("territories.by_user", "territories", {"user_id": _USER_ID}, [("created_at", DESCENDING)]),
+    ("territories.persist_existing_houses", "houses",
+     {"territory_id": _ID, "address": {"$in": ["1 Main St"]}}, None),
+]
+
+
+def _stages(plan):
+    """Yield every stage name in an explain() plan tree."""
+    if not isinstance(plan, dict):
+        return
+    # SBE explain output nests the classic tree under queryPlan.
+    plan = plan.get("queryPlan", plan)
+    if "stage" in plan:
+        yield plan["stage"]
+    for child in [plan.get("inputStage")] + list(plan.get("inputStages", [])):
+        if child:
+            yield from _stages(child)
+
+
+def explain_query_shapes():
+    """Run explain() for each registered shape. Returns [(name, stages, problem)]."""
+    report = []
+    for name, coll_name, query, sort in QUERY_SHAPES:
+        cursor = get_collection(coll_name).find(query).limit(20)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = list(_stages(winning))
+        problem = None
+        if "COLLSCAN" in stages:
+            problem = "COLLSCAN"
+        elif "SORT" in stages:
+            problem = "in-memory SORT"
+        report.append((name, stages, problem))
+    return report
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "apply"
+    if command == "apply":
+        created = apply_indexes()
+        print(f"[INDEXES] {len(created)} created" + (f": {', '.join(created)}" if created else ""))
+    elif command == "explain":
+        bad = 0
+        for name, stages, problem in explain_query_shapes():
+            flag = f"  <-- {problem}" if problem else ""
+            print(f"{name:40} {' > '.join(stages)}{flag}")
+            bad += bool(problem)
+        sys.exit(1 if bad else 0)
+    else:
+        print("usage: python indexes.py [apply|explain]")
+        sys.exit(2)
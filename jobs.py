@@ -0,0 +1,117 @@
+# jobs.py
+# Background job registry + Mongo lease so each job runs on exactly one
+# process per interval, no matter how many web workers / scheduler dynos
+# are alive. Every execution is recorded in the `job_runs` collection.
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from db import get_collection
+
+# job name -> minutes between runs.
+# Tech reminders are not polled any more; see reminders.ReminderDispatcher.
+JOB_INTERVALS = {
+    "drain_outbox": 1,
+    "resume_stuck_order_setups": 5,
+    "process_pending_webhook_events": 1,
+    "reconcile_stats": 60,
+}
+
+
+def _owner_id():
+    # Computed per call so forked children don't reuse the parent's pid.
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# -------------------------------
+# Lease
+# -------------------------------
+def acquire_lease(job_name, lease_seconds):
+    """
+    Take the lease for job_name if it's free or expired. The lease is not
+    released after the run: it simply expires just before the next interval,
+    so a second instance whose timer fires a few seconds later skips.
+    """
+    locks = get_collection("job_locks")
+    now = datetime.utcnow()
+    owner = _owner_id()
+    try:
+        locks.find_one_and_update(
+            {"_id": job_name, "$or": [{"expires_at": {"$lte": now}}, {"owner": owner}]},
+            {"$set": {
+                "owner": owner,
+                "acquired_at": now,
+                "expires_at": now + timedelta(seconds=lease_seconds),
+            }},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # Someone else holds a live lease (upsert collided with their doc).
+        return False
+
+
+# -------------------------------
+# Runner
+# -------------------------------
+def run_locked_job(app, job_name, func, lease_seconds):
+    with app.app_context():
+        if not acquire_lease(job_name, lease_seconds):
+            app.logger.info(f"[JOBS] {job_name} skipped, lease held by another process")
+            return
+
+        started_at = datetime.utcnow()
+        t0 = time.monotonic()
+        status, error = "success", None
+        try:
+            func()
+        except Exception as e:
+            status, error = "error", str(e)
+            app.logger.error(f"[JOBS] {job_name} failed: {e}")
+        finally:
+            duration_ms = int((time.monotonic() - t0) * 1000)
+            try:
+                get_collection("job_runs").insert_one({
+                    "job": job_name,
+                    "owner": _owner_id(),
+                    "started_at": started_at,
+                    "finished_at": datetime.utcnow(),
+                    "duration_ms": duration_ms,
+                    "status": status,
+                    "error": error,
+                })
+            except Exception as e:
+                app.logger.error(f"[JOBS] Could not record run for {job_name}: {e}")
+            app.logger.info(f"[JOBS] {job_name} {status} in {duration_ms} ms")
+
+
+def register_jobs(scheduler, app):
+    """Attach every background job to an APScheduler instance."""
+    from outbox import drain_outbox
+    from order_setup import resume_stuck_order_setups
+    from webhooks import process_pending_events
+    from stats import reconcile_stats
+
+    job_funcs = {
+        "drain_outbox": lambda: drain_outbox(app.logger),
+        "resume_stuck_order_setups": resume_stuck_order_setups,
+        "process_pending_webhook_events": lambda: process_pending_events(app.logger),
+        "reconcile_stats": reconcile_stats,
+    }
+
+    for job_name, func in job_funcs.items():
+        minutes = JOB_INTERVALS[job_name]
+        # Leave a minute of slack so the lease is free again for the next tick.
+        lease_seconds = max(minutes * 60 - 60, 30)
+        scheduler.add_job(
+            func=run_locked_job,
+            args=[app, job_name, func, lease_seconds],
+            trigger="interval",
+            minutes=minutes,
+            id=job_name,
+            max_instances=1,
+            coalesce=True,
+        )
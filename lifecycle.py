@@ -0,0 +1,87 @@
+# lifecycle.py
+# Per-process startup work that must NOT happen before gunicorn forks:
+# opening Mongo sockets, creating indexes, the SQLite visitor table and the
+# background scheduler. create_app() only builds the Flask object, so the
+# master can preload it and share that memory copy-on-write with workers.
+import os
+import fcntl
+import threading
+
+from db import close_client, init_db
+
+SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE", "/tmp/cfac-scheduler.lock")
+
+_init_lock = threading.Lock()
+_initialized_pid = None
+_scheduler_lock_fh = None
+
+
+def _claim_scheduler_slot():
+    """
+    Only one process on the host gets to run the background jobs.
+    We hold an exclusive flock for the life of the process; if that worker
+    dies the lock is released and the next worker to boot picks it up.
+    """
+    global _scheduler_lock_fh
+    if _scheduler_lock_fh is not None:
+        return True
+    fh = open(SCHEDULER_LOCK_FILE, "a+")
+    try:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        return False
+    _scheduler_lock_fh = fh
+    return True
+
+
+def scheduler_enabled():
+    # Jobs normally run in the dedicated `scheduler` process (scheduler.py).
+    return os.getenv("RUN_SCHEDULER_IN_WEB", "false").lower() == "true"
+
+
+def init_worker(app):
+    """
+    Run once per process, after fork. Safe to call more than once;
+    only the first call in a given pid does anything.
+    """
+    global _initialized_pid
+    pid = os.getpid()
+    if _initialized_pid == pid:
+        return
+
+    with _init_lock:
+        if _initialized_pid == pid:
+            return
+
+        # A client inherited from the master (preload) must not be reused.
+        close_client()
+        init_db(app)
+
+        from indexes import ensure_indexes
+        from utils.visitor_log import ensure_visitor_table
+
+        try:
+            ensure_indexes()
+        except Exception as e:
+            app.logger.error(f"[LIFECYCLE] Index check failed: {e}")
+        ensure_visitor_table()
+
+        if scheduler_enabled() and _claim_scheduler_slot():
+            from api_tech import start_scheduler
+            start_scheduler(app)
+            app.logger.info(f"[LIFECYCLE] Scheduler running in pid {pid}")
+
+        _initialized_pid = pid
+        app.logger.info(f"[LIFECYCLE] Worker {pid} initialized")
+
+
+def register_lazy_init(app):
+    """
+    Fallback for servers without a post_fork hook (flask run, other WSGI
+    servers): initialize on the first request this process handles.
+    """
+    @app.before_request
+    def _ensure_worker_initialized():
+        if _initialized_pid != os.getpid():
+            init_worker(app)
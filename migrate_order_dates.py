@@ -0,0 +1,110 @@
+# migrate_order_dates.py
+# Resumable migration: rewrite every order's service_date / creation_date /
+# order_date to a canonical UTC datetime (see order_model.py). Runs in the
+# Procfile release step, before the new code (which no longer parses string
+# dates on read) serves traffic; once done, a re-run only looks past the
+# checkpoint.
+#
+#   python migrate_order_dates.py               # run / resume
+#   python migrate_order_dates.py --dry-run     # report only
+#   python migrate_order_dates.py --restart     # forget the checkpoint
+#
+# Progress is checkpointed in the `migrations` collection after every batch,
+# so the script can be killed and re-run at any time. Orders it can't parse
+# are left untouched and listed in the checkpoint document.
+import argparse
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from db import get_collection
+from order_model import DATE_FIELDS, string_dates_query, to_utc_datetime
+
+MIGRATION_ID = "order_dates_v1"
+MAX_RECORDED_FAILURES = 1000
+
+
+def _convert(order):
+    """Returns ($set dict, error string or None) for one order."""
+    updates = {}
+    for field in DATE_FIELDS:
+        value = order.get(field)
+        if isinstance(value, str):
+            try:
+                updates[field] = to_utc_datetime(value)
+            except ValueError as e:
+                return None, f"{field}: {e}"
+    return updates, None
+
+
+def migrate(batch_size=500, dry_run=False, restart=False):
+    orders = get_collection("orders")
+    migrations = get_collection("migrations")
+
+    if restart:
+        migrations.delete_one({"_id": MIGRATION_ID})
+    state = migrations.find_one({"_id": MIGRATION_ID}) or {}
+    last_id = state.get("last_id")
+    converted = state.get("converted", 0)
+    failed = state.get("failed", 0)
+
+    projection = {field: 1 for field in DATE_FIELDS}
+    while True:
+        query = string_dates_query()
+        if last_id is not None:
+            query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+        batch = list(orders.find(query, projection).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+
+        ops = []
+        failures = []
+        for order in batch:
+            updates, error = _convert(order)
+            if error:
+                failures.append({"order_id": order["_id"], "error": error})
+                continue
+            # Guard on the old values so a concurrent write isn't clobbered.
+            guard = {"_id": order["_id"], **{field: order[field] for field in updates}}
+            ops.append(UpdateOne(guard, {"$set": updates}))
+
+        if ops and not dry_run:
+            converted += orders.bulk_write(ops, ordered=False).modified_count
+        elif dry_run:
+            converted += len(ops)
+        failed += len(failures)
+        last_id = batch[-1]["_id"]
+
+        if not dry_run:
+            update = {"$set": {
+                "last_id": last_id,
+                "converted": converted,
+                "failed": failed,
+                "updated_at": datetime.utcnow(),
+            }}
+            if failures:
+                update["$push"] = {"failures": {"$each": failures, "$slice": -MAX_RECORDED_FAILURES}}
+            migrations.update_one({"_id": MIGRATION_ID}, update, upsert=True)
+
+        print(f"[MIGRATE] through {last_id}: converted={converted} failed={failed}")
+
+    if not dry_run:
+        migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"completed_at": datetime.utcnow()}},
+            upsert=True
+        )
+    print(f"[MIGRATE] done: converted={converted} failed={failed}" + (" (dry run)" if dry_run else ""))
+    return converted, failed
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Normalize order date fields to UTC datetimes.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+    migrate(batch_size=args.batch_size, dry_run=args.dry_run, restart=args.restart)
@@ -0,0 +1,115 @@
+# migrate_usernames.py
+# Resumable backfill of `username_lower` (see user_model.py) on users and
+# users_to_approve. Runs in the Procfile release step, before
+# `indexes.py apply`.
+#
+#   python migrate_usernames.py               # run / resume
+#   python migrate_usernames.py --dry-run     # report only
+#   python migrate_usernames.py --restart     # forget the checkpoint
+#
+# Usernames that differ only by case can't share the unique index. The first
+# user (by _id) keeps the key; the others are left without username_lower and
+# listed in the checkpoint document so they can be renamed by hand; until then
+# /api/login finds them by their exact username.
+import argparse
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from db import get_collection
+from user_model import normalize_username
+
+MIGRATION_ID = "username_lower_v1"
+COLLECTIONS = ("users", "users_to_approve")
+MAX_RECORDED_CONFLICTS = 1000
+
+
+def _migrate_collection(name, state, batch_size, dry_run):
+    users = get_collection(name)
+    migrations = get_collection("migrations")
+    last_id = state.get(f"{name}_last_id")
+    updated = state.get(f"{name}_updated", 0)
+    conflicts = 0
+
+    while True:
+        query = {"username": {"$type": "string"}, "username_lower": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(users.find(query, {"username": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+
+        ops = []
+        failures = []
+        keys = {normalize_username(user["username"]) for user in batch} - {""}
+        taken = {
+            row["username_lower"]
+            for row in users.find({"username_lower": {"$in": list(keys)}}, {"username_lower": 1})
+        }
+        for user in batch:
+            key = normalize_username(user["username"])
+            if not key:
+                continue
+            if key in taken:
+                failures.append({"collection": name, "user_id": user["_id"], "username": user["username"]})
+                continue
+            taken.add(key)
+            # Guard on the old username so a concurrent rename isn't clobbered.
+            ops.append(UpdateOne(
+                {"_id": user["_id"], "username": user["username"]},
+                {"$set": {"username_lower": key}}
+            ))
+
+        if ops and not dry_run:
+            updated += users.bulk_write(ops, ordered=False).modified_count
+        elif dry_run:
+            updated += len(ops)
+        conflicts += len(failures)
+        last_id = batch[-1]["_id"]
+
+        if not dry_run:
+            update = {"$set": {
+                f"{name}_last_id": last_id,
+                f"{name}_updated": updated,
+                "updated_at": datetime.utcnow(),
+            }}
+            if failures:
+                update["$push"] = {"conflicts": {"$each": failures, "$slice": -MAX_RECORDED_CONFLICTS}}
+            migrations.update_one({"_id": MIGRATION_ID}, update, upsert=True)
+
+        print(f"[MIGRATE] {name} through {last_id}: updated={updated} conflicts={conflicts}")
+    return updated, conflicts
+
+
+def migrate(batch_size=500, dry_run=False, restart=False):
+    migrations = get_collection("migrations")
+    if restart:
+        migrations.delete_one({"_id": MIGRATION_ID})
+    state = migrations.find_one({"_id": MIGRATION_ID}) or {}
+
+    total_updated = total_conflicts = 0
+    for name in COLLECTIONS:
+        updated, conflicts = _migrate_collection(name, state, batch_size, dry_run)
+        total_updated += updated
+        total_conflicts += conflicts
+
+    if not dry_run:
+        migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"completed_at": datetime.utcnow()}},
+            upsert=True
+        )
+    print(f"[MIGRATE] done: updated={total_updated} conflicts={total_conflicts}" + (" (dry run)" if dry_run else ""))
+    return total_updated, total_conflicts
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Backfill username_lower on users.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+    migrate(batch_size=args.batch_size, dry_run=args.dry_run, restart=args.restart)
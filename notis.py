@@ -8,6 +8,7 @@ from datetime import datetime
 from flask import Flask
 from bson.objectid import ObjectId
 from postmark_client import postmark_client, is_valid_email
+from outbox import enqueue_email
 
 
 logger = logging.getLogger(__name__)
@@ -419,7 +420,8 @@ def send_downpayment_thankyou_email(order):
     </html>
     """
     sender_email = current_app.config.get("POSTMARK_SENDER_EMAIL")
-    send_postmark_email(subject, guest_email, sender_email, text_body, html_body)
+    enqueue_email(subject, guest_email, sender_email, text_body, html_body,
+                  idempotency_key=f"downpayment_thankyou:{order_id}")
 
 
 def send_remaining_payment_thankyou_email(order):
@@ -598,110 +600,11 @@ def send_remaining_payment_thankyou_email(order):
     </html>
     """
     sender_email = current_app.config.get("POSTMARK_SENDER_EMAIL")
-    send_postmark_email(subject, guest_email, sender_email, text_body, html_body)
+    enqueue_email(subject, guest_email, sender_email, text_body, html_body,
+                  idempotency_key=f"remaining_thankyou:{order_id}")
 
 
 
-def notify_techs_new_order(order):
-    """
-    Notify all tech users that a new order is available.
-    - If a tech has a registered device token, send an iOS push notification.
-    - Otherwise, send a fallback email.
-    """
-    users_collection = current_app.config.get('USERS_COLLECTION')
-    device_tokens_collection = current_app.config.get('DEVICE_TOKENS_COLLECTION')
-    
-    if not users_collection or not device_tokens_collection:
-        current_app.logger.error("Users or Device Tokens collection not configured.")
-        return
-
-    # Query for all tech users.
-    tech_cursor = users_collection.find({"user_type": "tech"})
-    for tech in tech_cursor:
-        tech_id = str(tech.get("_id"))
-        tech_email = tech.get("email")
-        token_record = device_tokens_collection.find_one({"user_id": tech_id})
-        
-        message = "A new order is available in your job list."
-        
-        if token_record and token_record.get("device_token"):
-            # If the tech has a device token, send a push notification.
-            device_token = token_record["device_token"]
-            # Call your push notification function (adjust parameters as needed).
-            push_response = send_notification_to_tech(
-                tech_id=tech_id,
-                order_id=str(order.get("_id")),
-                threshold=None,
-                device_token=device_token,
-                custom_message=message
-            )
-            current_app.logger.info(f"Push notification sent to tech {tech_id}: {push_response}")
-        else:
-            # Otherwise, send a fallback email.
-            subject = "New Order Available"
-            text_body = (
-                f"Hello {tech.get('first_name', 'Tech')},\n\n"
-                "A new order is available in your job list. Please log in to review it."
-            )
-            html_body = f"""
-            <!DOCTYPE html>
-            <html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <title>New Order Available</title>
-                <style>
-                    body {{
-                        font-family: Arial, sans-serif;
-                        background-color: #f4f4f4;
-                        padding: 20px;
-                    }}
-                    .container {{
-                        background-color: #ffffff;
-                        padding: 20px;
-                        border-radius: 8px;
-                        box-shadow: 0 2px 3px rgba(0,0,0,0.1);
-                    }}
-                    .header {{
-                        background-color: #07173d;
-                        color: #ffffff;
-                        text-align: center;
-                        padding: 10px 0;
-                    }}
-                    .content {{
-                        margin-top: 20px;
-                    }}
-                    .footer {{
-                        margin-top: 20px;
-                        font-size: 12px;
-                        color: #666666;
-                        text-align: center;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="header">
-                        <h1>New Order Available</h1>
-                    </div>
-                    <div class="content">
-                        <p>Hello {tech.get('first_name', 'Tech')},</p>
-                        <p>A new order is available in your job list. Please log in to review the order details.</p>
-                    </div>
-                    <div class="footer">
-                        &copy; {datetime.now().year} Centralfloridaautocare LLC. All rights reserved.
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            sender_email = current_app.config.get("POSTMARK_SENDER_EMAIL")
-            try:
-                send_postmark_email(subject, tech_email, sender_email, text_body, html_body)
-                current_app.logger.info(f"Fallback email sent to tech {tech_id}")
-            except Exception as e:
-                current_app.logger.error(f"Failed to send fallback email to tech {tech_id}: {e}")
-
-
 def notify_techs_new_order(order):
     """
     Notify all tech users that a new order is available.
@@ -715,28 +618,31 @@ def notify_techs_new_order(order):
         return
 
 
-    # Query for all tech users.
-    tech_cursor = users_collection.find({"user_type": "tech"})
-    for tech in tech_cursor:
+    # Query for all tech users, and their device tokens in one round trip.
+    techs = list(users_collection.find({"user_type": "tech"}))
+    tech_ids = [str(tech.get("_id")) for tech in techs]
+    tokens_by_tech = {
+        record["user_id"]: record["device_token"]
+        for record in device_tokens_collection.find({"user_id": {"$in": tech_ids}})
+        if record.get("device_token")
+    }
+
+    # Custom message for new orders
+    custom_push_message = "A new order has been added to your job list. Please check your app for details."
+
+    # One batched push over a single APNs connection for every tech with a token.
+    if tokens_by_tech:
+        push_response = send_ios_push_notification_many(
+            order_id=str(order.get("_id")),
+            device_tokens=list(tokens_by_tech.values()),
+            message=custom_push_message
+        )
+        current_app.logger.info(f"Push notifications sent to {len(tokens_by_tech)} techs: {push_response}")
+
+    for tech in techs:
         tech_id = str(tech.get("_id"))
         tech_email = tech.get("email")
-        token_record = device_tokens_collection.find_one({"user_id": tech_id})
-        
-        # Custom message for new orders
-        custom_push_message = "A new order has been added to your job list. Please check your app for details."
-        
-        if token_record and token_record.get("device_token"):
-            # If the tech has a device token, send an iOS push notification.
-            device_token = token_record["device_token"]
-            # Call a new function to send iOS push notifications with a custom message.
-            push_response = send_ios_push_notification(
-                tech_id=tech_id,
-                order_id=str(order.get("_id")),
-                device_token=device_token,
-                message=custom_push_message
-            )
-            current_app.logger.info(f"Push notification sent to tech {tech_id}: {push_response}")
-        else:
+        if tech_id not in tokens_by_tech:
             # Otherwise, send a fallback email.
             subject = "New Order Available"
             text_body = (
@@ -796,46 +702,26 @@ def notify_techs_new_order(order):
             """
             sender_email = current_app.config.get("POSTMARK_SENDER_EMAIL")
             try:
-                send_postmark_email(subject, tech_email, sender_email, text_body, html_body)
-                current_app.logger.info(f"Fallback email sent to tech {tech_id}")
+                enqueue_email(
+                    subject, tech_email, sender_email, text_body, html_body,
+                    idempotency_key=f"new_order_tech:{order.get('_id')}:{tech_id}"
+                )
+                current_app.logger.info(f"Fallback email queued for tech {tech_id}")
             except Exception as e:
-                current_app.logger.error(f"Failed to send fallback email to tech {tech_id}: {e}")
+                current_app.logger.error(f"Failed to queue fallback email to tech {tech_id}: {e}")
 
 
-import os
-import base64
-import tempfile
-from apns2.client import APNsClient
-from apns2.payload import Payload
-from flask import current_app
+from push import push_service, build_payload, SALES_TOPIC, TECH_CERT_ENV
 
 def send_ios_push_notification(tech_id, order_id, device_token, message):
     """
     Sends an iOS push notification via APNs with a custom message.
     """
-    # Retrieve the base64-encoded APNs certificate from environment variables.
-    cert_b64 = os.environ.get("APNS_CERT_B64")
-    if not cert_b64:
-        current_app.logger.error("APNS certificate not configured in environment.")
-        return {"error": "APNS certificate not configured"}
-
     try:
-        # Decode and write the certificate to a temporary file.
-        cert_content = base64.b64decode(cert_b64)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pem") as temp_cert:
-            temp_cert.write(cert_content)
-            temp_cert_path = temp_cert.name
-
-        # Create the payload with a title and message.
-        payload = Payload(alert={"title": "New Order Available", "body": message}, sound="default", badge=1)
-        
-        # Create an APNs client. Adjust use_sandbox as necessary.
-        client = APNsClient(temp_cert_path, use_sandbox=True, use_alternative_port=False)
-        # The topic should be your app's bundle identifier.
-        response = client.send_notification(device_token, payload, topic="com.Centralfloridaautocare.cfacios")
-
-        # Clean up the temporary certificate file.
-        os.remove(temp_cert_path)
+        payload = build_payload("New Order Available", message)
+        response = push_service.send(
+            device_token, payload, topic=SALES_TOPIC, cert_env=TECH_CERT_ENV, use_sandbox=True
+        )
         current_app.logger.info(f"Push notification response for tech {tech_id}: {response}")
         return response
     except Exception as e:
@@ -843,6 +729,21 @@ def send_ios_push_notification(tech_id, order_id, device_token, message):
         return {"error": str(e)}
 
 
+def send_ios_push_notification_many(order_id, device_tokens, message):
+    """
+    Same notification as send_ios_push_notification, fanned out to many
+    devices over one connection. Returns {token: result}.
+    """
+    try:
+        payload = build_payload("New Order Available", message)
+        return push_service.send_many(
+            device_tokens, payload, topic=SALES_TOPIC, cert_env=TECH_CERT_ENV, use_sandbox=True
+        )
+    except Exception as e:
+        current_app.logger.error(f"Error sending iOS push notifications for order {order_id}: {str(e)}")
+        return {"error": str(e)}
+
+
 
 
 
@@ -1082,16 +983,20 @@ def notify_admins_new_order(order_id: str):
         <p style="color:#777;font-size:12px;">UTC: {datetime.utcnow().isoformat()}</p>
         """
 
+        # Queued; the outbox sender delivers these in one Postmark batch call.
         for admin_email in admin_emails:
-            print("[ADMIN NEW ORDER] sending to", admin_email)
-            send_postmark_email(
-                subject=subject,
-                to_email=admin_email,
-                from_email=sender_email,
-                text_body=text_body,
-                html_body=html_body
-            )
-            print("[ADMIN NEW ORDER] sent to", admin_email)
+            try:
+                enqueue_email(
+                    subject=subject,
+                    to_email=admin_email,
+                    from_email=sender_email,
+                    text_body=text_body,
+                    html_body=html_body,
+                    idempotency_key=f"new_order_admin:{order_id}:{admin_email.lower()}"
+                )
+                print("[ADMIN NEW ORDER] queued for", admin_email)
+            except ValueError as e:
+                print("[ADMIN NEW ORDER] skipping", admin_email, str(e))
 
     except Exception as e:
         print("[ADMIN NEW ORDER] ERROR:", str(e))
@@ -1172,32 +1077,15 @@ def send_ios_push_notification_sales(user_id, order_id, device_token, message):
     """
     Sends an iOS push notification to the Sales app bundle.
     """
-    cert_b64 = os.environ.get("APNS_CERT_B64")
-    if not cert_b64:
-        current_app.logger.error("[SALES PUSH] APNS_CERT_B64 missing")
-        return {"error": "APNS certificate not configured"}
-
     try:
-        cert_content = base64.b64decode(cert_b64)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pem") as temp_cert:
-            temp_cert.write(cert_content)
-            temp_cert_path = temp_cert.name
-
-        payload = Payload(
-            alert={"title": "New Order Created", "body": message},
-            sound="default",
-            badge=1,
+        payload = build_payload(
+            "New Order Created",
+            message,
             custom={"order_id": order_id, "type": "order_created"}  # <— helpful for deep linking
         )
-
-        client = APNsClient(temp_cert_path, use_sandbox=True, use_alternative_port=False)
-
-        # CHANGE THIS to your SALES app bundle id:
-        topic = "com.Centralfloridaautocare.cfacios"  # <--- update to your actual bundle id
-
-        response = client.send_notification(device_token, payload, topic=topic)
-        os.remove(temp_cert_path)
-        return response
+        return push_service.send(
+            device_token, payload, topic=SALES_TOPIC, cert_env=TECH_CERT_ENV, use_sandbox=True
+        )
 
     except Exception as e:
         current_app.logger.error(f"[SALES PUSH] Error: {str(e)}")
@@ -0,0 +1,61 @@
+# order_model.py
+# Canonical types for order documents. Every date field is stored as a naive
+# UTC datetime (what pymongo round-trips and what utility.format_datetime_with_suffix
+# expects), so read paths never parse strings and range queries on
+# service_date can use the index. Writers pass documents / $set dicts through
+# normalize_order before they hit Mongo; migrate_order_dates.py fixes old rows.
+from datetime import date, datetime, time, timezone
+
+from dateutil import parser as date_parser
+
+DATE_FIELDS = ("service_date", "creation_date", "order_date")
+
+
+def to_utc_datetime(value):
+    """
+    Coerce a stored/submitted date to a naive UTC datetime.
+
+    Accepts datetimes (aware ones are converted, naive ones are taken as
+    UTC), dates (midnight) and the string formats found in old orders:
+    ISO-8601 with or without 'Z'/offset, '%Y-%m-%d %H:%M:%S' and '%Y-%m-%d'.
+    None and '' become None. Raises ValueError for anything else.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        pass
+    elif isinstance(value, date):
+        value = datetime.combine(value, time.min)
+    elif isinstance(value, str):
+        raw = value.strip()
+        try:
+            value = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+        except ValueError:
+            try:
+                value = date_parser.parse(raw)
+            except (ValueError, OverflowError) as e:
+                raise ValueError(f"Unrecognised date: {raw!r}") from e
+    else:
+        raise ValueError(f"Unsupported date type: {type(value).__name__}")
+
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def normalize_order(doc):
+    """
+    Return a copy of an order document (or a $set dict) with every date
+    field present coerced to a naive UTC datetime. Raises ValueError if a
+    date can't be understood, so bad input fails at write time.
+    """
+    normalized = dict(doc)
+    for field in DATE_FIELDS:
+        if field in normalized:
+            normalized[field] = to_utc_datetime(normalized[field])
+    return normalized
+
+
+def string_dates_query():
+    """Orders that still have at least one date stored as a string."""
+    return {"$or": [{field: {"$type": "string"}} for field in DATE_FIELDS]}
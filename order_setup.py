@@ -0,0 +1,158 @@
+# order_setup.py
+# Order-setup pipeline for /api/guest_order. The route inserts the order with
+# setup_status "creating" and returns 202; the Stripe checkout objects,
+# payment-link email and new-order notifications are done here, off the
+# request thread. A scheduler job resumes setups whose worker died.
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import stripe
+from bson import ObjectId
+from flask import current_app
+
+from db import get_collection
+from stripe_setup import create_checkout_objects
+
+SETUP_WORKERS = int(os.getenv("ORDER_SETUP_WORKERS", "4"))
+# A "creating" order claimed longer ago than this is picked up again.
+STALE_SETUP_AFTER = timedelta(minutes=5)
+
+_executor = None
+_executor_pid = None
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    # Per process: threads don't survive a fork.
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=SETUP_WORKERS, thread_name_prefix="order-setup")
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def submit_order_setup(order_id):
+    """Queue the setup for an order already inserted with setup_status "creating"."""
+    app = current_app._get_current_object()
+
+    def _run():
+        with app.app_context():
+            try:
+                run_order_setup(order_id)
+            except Exception:
+                app.logger.error(f"[ORDER SETUP] {order_id} crashed", exc_info=True)
+
+    _get_executor().submit(_run)
+
+
+def _claim(order_id):
+    now = datetime.utcnow()
+    return get_collection("orders").find_one_and_update(
+        {"_id": ObjectId(order_id), "setup_status": "creating", "$or": [
+            {"setup_claimed_at": {"$exists": False}},
+            {"setup_claimed_at": {"$lte": now - STALE_SETUP_AFTER}},
+        ]},
+        {"$set": {"setup_claimed_at": now}}
+    )
+
+
+def _set_setup_state(order_id, status, error=None):
+    get_collection("orders").update_one(
+        {"_id": ObjectId(order_id)},
+        {"$set": {
+            "setup_status": status,
+            "setup_error": error,
+            "updated_date": datetime.utcnow()
+        }}
+    )
+
+
+def _create_guest_checkout_objects(order_id, final_price, customer_email):
+    stripe.api_key = current_app.config["STRIPE_SECRET_KEY"]
+
+    success_url = current_app.config.get(
+        "CHECKOUT_SUCCESS_URL",
+        "https://www.cfautocare.biz/payment_success?session_id={CHECKOUT_SESSION_ID}"
+    )
+    cancel_url = current_app.config.get(
+        "CHECKOUT_CANCEL_URL",
+        "https://www.cfautocare.biz/payment_cancel"
+    )
+
+    return create_checkout_objects(
+        order_id, final_price, customer_email, success_url, cancel_url,
+        downpayment_session_extra={
+            "payment_intent_data": {"metadata": {"order_id": order_id, "payment_type": "downpayment"}}
+        },
+        remaining_session_extra={
+            "payment_intent_data": {"metadata": {"order_id": order_id, "payment_type": "remaining_balance"}}
+        }
+    )
+
+
+def run_order_setup(order_id):
+    """Stripe -> payment-link email -> ready -> notifications."""
+    from notis import send_payment_links, notify_admins_new_order, notify_salesperson_new_order_push
+
+    order = _claim(order_id)
+    if order is None:
+        # Already done, failed, or being worked on by someone else.
+        return
+
+    orders_collection = get_collection("orders")
+    try:
+        if "final_price" not in order:
+            raise ValueError("Missing final_price")
+
+        # Stripe objects may already exist if a previous attempt died after
+        # creating them; don't make a second set.
+        if not order.get("remaining_balance_checkout_url"):
+            stripe_fields = _create_guest_checkout_objects(
+                order_id, float(order["final_price"]), order.get("guest_email")
+            )
+            stripe_fields.update({
+                "payment_status": order.get("payment_status", "Pending"),
+                "has_downpayment_collected": "no",
+                "updated_date": datetime.utcnow()
+            })
+            orders_collection.update_one({"_id": order["_id"]}, {"$set": stripe_fields})
+    except Exception as e:
+        # avoid storing huge/secret details
+        _set_setup_state(order_id, "failed", f"Setup failed: {str(e)[:500]}")
+        return
+
+    # Send customer payment links
+    result = send_payment_links(order_id)
+    try:
+        status_code = result[1]
+    except Exception:
+        status_code = 500
+
+    if status_code != 200:
+        _set_setup_state(order_id, "failed", f"Failed to send payment links: {str(result)[:500]}")
+        return
+
+    # Mark ready only after email succeeds
+    _set_setup_state(order_id, "ready")
+
+    # Fire-and-forget notifications (now that it's truly ready)
+    try:
+        notify_admins_new_order(order_id)
+    except Exception:
+        current_app.logger.error("notify_admins_new_order failed", exc_info=True)
+
+    try:
+        notify_salesperson_new_order_push(order_id)
+    except Exception:
+        current_app.logger.error("notify_salesperson_new_order_push failed", exc_info=True)
+
+
+def resume_stuck_order_setups():
+    """Scheduler job: finish setups whose worker process went away."""
+    cutoff = datetime.utcnow() - STALE_SETUP_AFTER
+    stuck = get_collection("orders").find(
+        {"setup_status": "creating", "updated_date": {"$lte": cutoff}},
+        {"_id": 1}
+    )
+    for order in stuck:
+        run_order_setup(str(order["_id"]))
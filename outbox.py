@@ -0,0 +1,149 @@
+# outbox.py
+# Durable email outbox. Request handlers enqueue messages and return right
+# away; the scheduler process drains the `outbox` collection with Postmark's
+# batch endpoint (up to 500 messages per call), retrying with backoff.
+# Nothing sends without the `scheduler` dyno (Procfile): keep it scaled to 1.
+#
+# A batch call that times out after the request went out may or may not have
+# been accepted by Postmark. Its rows are marked "unknown" instead of being
+# resent, since a blind retry would mail every recipient twice.
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+from requests.exceptions import ChunkedEncodingError, ReadTimeout
+
+from db import get_collection
+from postmark_client import postmark_client, is_valid_email
+
+POSTMARK_BATCH_LIMIT = 500
+MAX_ATTEMPTS = 6
+# A "sending" claim older than this is assumed to belong to a dead process.
+STALE_CLAIM_AFTER = timedelta(minutes=10)
+
+
+def enqueue_email(subject, to_email, from_email, text_body, html_body=None, idempotency_key=None):
+    """
+    Queue one email. Same validation as notis.send_postmark_email.
+    Messages with an idempotency_key that is already queued are skipped.
+    Returns True if a new message was queued.
+    """
+    if not to_email or not is_valid_email(to_email):
+        raise ValueError("Invalid recipient email address")
+    if not from_email or not is_valid_email(from_email):
+        raise ValueError("Invalid sender email address")
+
+    now = datetime.utcnow()
+    doc = {
+        "message": {
+            "From": from_email,
+            "To": to_email,
+            "Subject": subject,
+            "TextBody": text_body,
+            "HtmlBody": html_body if html_body else text_body,
+        },
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now,
+    }
+    if idempotency_key:
+        doc["idempotency_key"] = idempotency_key
+
+    try:
+        get_collection("outbox").insert_one(doc)
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def _claim_batch(limit):
+    outbox = get_collection("outbox")
+    now = datetime.utcnow()
+    claim_id = uuid.uuid4().hex
+
+    ready = outbox.find(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "claimed_at": {"$lte": now - STALE_CLAIM_AFTER}},
+        ]},
+        {"_id": 1}
+    ).sort("next_attempt_at", 1).limit(limit)
+    ids = [doc["_id"] for doc in ready]
+    if not ids:
+        return []
+
+    # Only rows still unclaimed end up in our batch.
+    outbox.update_many(
+        {"_id": {"$in": ids}, "$or": [
+            {"status": "pending"},
+            {"status": "sending", "claimed_at": {"$lte": now - STALE_CLAIM_AFTER}},
+        ]},
+        {"$set": {"status": "sending", "claim_id": claim_id, "claimed_at": now}}
+    )
+    return list(outbox.find({"claim_id": claim_id}))
+
+
+def _retry_at(attempts):
+    return datetime.utcnow() + timedelta(minutes=2 ** attempts)
+
+
+def drain_outbox(logger=None):
+    """Send everything that's due. Returns (sent, failed)."""
+    outbox = get_collection("outbox")
+    sent = failed = 0
+
+    while True:
+        batch = _claim_batch(POSTMARK_BATCH_LIMIT)
+        if not batch:
+            break
+
+        try:
+            responses = postmark_client.emails.send_batch(*[doc["message"] for doc in batch])
+        except (ReadTimeout, ChunkedEncodingError) as e:
+            # Sent, but no answer: Postmark may have accepted it. Don't resend.
+            if logger:
+                logger.error(f"[OUTBOX] Batch of {len(batch)} has an unknown outcome: {e}")
+            outbox.update_many(
+                {"_id": {"$in": [doc["_id"] for doc in batch]}},
+                {"$set": {"status": "unknown", "last_error": str(e)}, "$unset": {"claim_id": ""}}
+            )
+            failed += len(batch)
+            break
+        except Exception as e:
+            # Whole call failed (network, 5xx): put the batch back with backoff.
+            if logger:
+                logger.error(f"[OUTBOX] Batch of {len(batch)} failed: {e}")
+            for doc in batch:
+                _mark_failed(outbox, doc, str(e))
+            failed += len(batch)
+            break
+
+        # Postmark answers per message, in the same order as sent.
+        for doc, response in zip(batch, responses):
+            if response.get("ErrorCode", 0) == 0:
+                outbox.update_one(
+                    {"_id": doc["_id"]},
+                    {"$set": {"status": "sent", "sent_at": datetime.utcnow(),
+                              "message_id": response.get("MessageID")},
+                     "$unset": {"claim_id": ""}}
+                )
+                sent += 1
+            else:
+                _mark_failed(outbox, doc, response.get("Message"))
+                failed += 1
+
+    if logger and (sent or failed):
+        logger.info(f"[OUTBOX] sent={sent} failed={failed}")
+    return sent, failed
+
+
+def _mark_failed(outbox, doc, error):
+    attempts = doc.get("attempts", 0) + 1
+    status = "dead" if attempts >= MAX_ATTEMPTS else "pending"
+    outbox.update_one(
+        {"_id": doc["_id"]},
+        {"$set": {"status": status, "attempts": attempts, "last_error": error,
+                  "next_attempt_at": _retry_at(attempts)},
+         "$unset": {"claim_id": ""}}
+    )
@@ -0,0 +1,230 @@
+# overpass_tiles.py
+# Tile-cached Overpass refresh for the local address index (addresses.py).
+#
+# Areas are decomposed into fixed slippy-map tiles (zoom TILE_ZOOM, roughly
+# 1 km across). `overpass_tiles` records when each tile was last pulled; a
+# TTL index drops tiles after TILE_TTL so they are fetched again. A request
+# only fetches the tiles it covers that are missing or stale, in one
+# combined Overpass query per chunk, and upserts the results into
+# `addresses`. The exact polygon/circle clip is then the local $geoWithin
+# query, so overlapping territories share tiles instead of re-querying OSM.
+#
+# A web request refreshes at most LIVE_MAX_TILES tiles in one query without
+# retries, so it stays inside the router's 30 s limit; the rest of a large
+# area is picked up by the requests that follow.
+import logging
+import math
+import os
+from datetime import datetime, timedelta
+from time import sleep
+
+import numpy as np
+import requests
+from pymongo import UpdateOne
+
+from addresses import _from_overpass_element, upsert_addresses
+from db import get_collection
+from geometry import points_in_ring
+
+logger = logging.getLogger(__name__)
+
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+OVERPASS_REFRESH = os.getenv("OVERPASS_REFRESH", "false").lower() == "true"
+OVERPASS_TIMEOUT = 25
+
+TILE_ZOOM = 15
+TILE_TTL = timedelta(days=30)  # keep in step with the overpass_tiles TTL index
+TILES_PER_QUERY = 50
+# A territory needing more tiles than this is too big to pull live.
+MAX_TILES = 400
+# Per web request: one query, a shorter Overpass timeout, no retry.
+LIVE_MAX_TILES = TILES_PER_QUERY
+LIVE_TIMEOUT = 15
+
+
+# -------------------------------
+# Tile math (slippy map / Web Mercator)
+# -------------------------------
+def lonlat_to_tile(lon, lat, zoom=TILE_ZOOM):
+    n = 2 ** zoom
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(x, y, zoom=TILE_ZOOM):
+    """(west, south, east, north) of a tile in degrees."""
+    n = 2 ** zoom
+
+    def _lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return x / n * 360.0 - 180.0, _lat(y + 1), (x + 1) / n * 360.0 - 180.0, _lat(y)
+
+
+def tile_id(x, y, zoom=TILE_ZOOM):
+    return f"{zoom}/{x}/{y}"
+
+
+class AreaTooLarge(ValueError):
+    """The ring covers more tiles than a live refresh may pull."""
+
+
+def _tile_bounds_arrays(xs, ys, zoom=TILE_ZOOM):
+    """tile_bounds for arrays of tile x/y: (west, south, east, north) arrays."""
+    n = 2 ** zoom
+
+    def _lat(ty):
+        return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * ty / n))))
+
+    return xs / n * 360.0 - 180.0, _lat(ys + 1), (xs + 1) / n * 360.0 - 180.0, _lat(ys)
+
+
+def _orient(ax, ay, bx, by, cx, cy):
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+
+def _tiles_touching_ring(xs, ys, ring, zoom=TILE_ZOOM):
+    """
+    Boolean mask over candidate tiles: a tile touches the ring if one of its
+    corners is inside it, a ring vertex is inside the tile, or a ring edge
+    crosses a tile edge. Each test is one array pass over all tiles.
+    """
+    ring = np.asarray(ring, dtype=float)
+    west, south, east, north = _tile_bounds_arrays(xs, ys, zoom)
+    corners = [(west, south), (east, south), (east, north), (west, north)]
+
+    corner_lons = np.concatenate([c[0] for c in corners])
+    corner_lats = np.concatenate([c[1] for c in corners])
+    touch = points_in_ring(corner_lons, corner_lats, ring).reshape(4, -1).any(axis=0)
+
+    vx, vy = ring[:, :1], ring[:, 1:]  # (vertices, 1) against (tiles,)
+    touch |= ((vx >= west) & (vx <= east) & (vy >= south) & (vy <= north)).any(axis=0)
+
+    rest = np.nonzero(~touch)[0]
+    if rest.size:
+        # Ring edges down the rows, remaining tiles across the columns.
+        px1, py1 = ring[:-1, :1], ring[:-1, 1:]
+        px2, py2 = ring[1:, :1], ring[1:, 1:]
+        rest_corners = [(cx[rest], cy[rest]) for cx, cy in corners]
+        crossed = np.zeros(rest.size, dtype=bool)
+        for (qx1, qy1), (qx2, qy2) in zip(rest_corners, rest_corners[1:] + rest_corners[:1]):
+            d1 = _orient(qx1, qy1, qx2, qy2, px1, py1)
+            d2 = _orient(qx1, qy1, qx2, qy2, px2, py2)
+            d3 = _orient(px1, py1, px2, py2, qx1, qy1)
+            d4 = _orient(px1, py1, px2, py2, qx2, qy2)
+            crossed |= (((d1 > 0) != (d2 > 0)) & ((d3 > 0) != (d4 > 0))).any(axis=0)
+        touch[rest] = crossed
+    return touch
+
+
+def tiles_for_ring(ring_lonlat, zoom=TILE_ZOOM):
+    """
+    Tiles (x, y) that overlap a closed [[lon, lat], ...] ring. Raises
+    AreaTooLarge when the ring's bbox alone spans more than MAX_TILES * 4
+    tiles (checked before any geometry) or more than MAX_TILES overlap it.
+    """
+    lons = [p[0] for p in ring_lonlat]
+    lats = [p[1] for p in ring_lonlat]
+    x0, y0 = lonlat_to_tile(min(lons), max(lats), zoom)
+    x1, y1 = lonlat_to_tile(max(lons), min(lats), zoom)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_TILES * 4:
+        raise AreaTooLarge("area too large for a live Overpass refresh")
+    xs, ys = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1), indexing="ij")
+    xs, ys = xs.ravel(), ys.ravel()
+    keep = _tiles_touching_ring(xs.astype(float), ys.astype(float), ring_lonlat, zoom)
+    if keep.sum() > MAX_TILES:
+        raise AreaTooLarge("area too large for a live Overpass refresh")
+    return [(int(x), int(y)) for x, y in zip(xs[keep], ys[keep])]
+
+
+def circle_bbox_ring(center_lonlat, radius_miles):
+    """A closed square ring around a circle (enough to pick its tiles)."""
+    lon, lat = center_lonlat
+    dlat = radius_miles / 69.0
+    dlon = radius_miles / (69.0 * max(math.cos(math.radians(lat)), 0.01))
+    return [
+        [lon - dlon, lat - dlat], [lon + dlon, lat - dlat],
+        [lon + dlon, lat + dlat], [lon - dlon, lat + dlat], [lon - dlon, lat - dlat],
+    ]
+
+
+# -------------------------------
+# Overpass
+# -------------------------------
+def _fetch_tiles(tiles, timeout=OVERPASS_TIMEOUT, attempts=3):
+    """One Overpass query for the address objects in all `tiles`."""
+    clauses = []
+    for x, y in tiles:
+        west, south, east, north = tile_bounds(x, y)
+        clauses.append(f'  nwr["addr:housenumber"]({south:.7f},{west:.7f},{north:.7f},{east:.7f});')
+    # 'out center' gives us coordinates for ways/relations (nodes already have lat/lon)
+    ql = f"[out:json][timeout:{timeout}];\n(\n" + "\n".join(clauses) + "\n);\nout center tags;"
+    headers = {
+        # Be polite (Overpass requires a descriptive UA).
+        "User-Agent": "CFAC/1.0 (houses-in-area) contact: support@cfautocare.biz"
+    }
+
+    # Simple retry for 429/5xx
+    for attempt in range(attempts):
+        r = requests.post(OVERPASS_URL, data={"data": ql}, headers=headers, timeout=timeout + 5)
+        if (r.status_code == 429 or r.status_code >= 500) and attempt + 1 < attempts:
+            sleep(1 + attempt * 2)
+            continue
+        break
+    r.raise_for_status()
+
+    docs = []
+    for el in r.json().get("elements", []):
+        doc = _from_overpass_element(el)
+        if doc:
+            docs.append(doc)
+    return docs
+
+
+def refresh_tiles(ring_lonlat, force=False, max_tiles=None, timeout=OVERPASS_TIMEOUT, attempts=3):
+    """
+    Pull the tiles under the ring that haven't been fetched from Overpass
+    within TILE_TTL (all of them when force=True), at most max_tiles of them.
+    Returns (tiles_total, tiles_fetched, tiles_left_stale).
+    """
+    tiles = tiles_for_ring(ring_lonlat)
+    ids = {tile_id(x, y): (x, y) for x, y in tiles}
+    cache = get_collection("overpass_tiles")
+
+    if force:
+        missing = list(ids.values())
+    else:
+        fresh = {
+            doc["_id"]
+            for doc in cache.find(
+                {"_id": {"$in": list(ids)}, "fetched_at": {"$gte": datetime.utcnow() - TILE_TTL}},
+                {"_id": 1}
+            )
+        }
+        missing = [xy for tid, xy in ids.items() if tid not in fresh]
+    stale = len(missing)
+    if max_tiles is not None:
+        missing = missing[:max_tiles]
+
+    for start in range(0, len(missing), TILES_PER_QUERY):
+        chunk = missing[start:start + TILES_PER_QUERY]
+        docs = _fetch_tiles(chunk, timeout=timeout, attempts=attempts)
+        written = upsert_addresses(docs)
+        now = datetime.utcnow()
+        cache.bulk_write([
+            UpdateOne({"_id": tile_id(x, y)}, {"$set": {"fetched_at": now}}, upsert=True)
+            for x, y in chunk
+        ], ordered=False)
+        logger.info(
+            f"[OVERPASS] {len(chunk)} tile(s) fetched: {len(docs)} addresses, {written} written"
+        )
+
+    return len(tiles), len(missing), stale - len(missing)
+
+
+def refresh_tiles_live(ring_lonlat, force=False):
+    """refresh_tiles within a web request's time budget (see LIVE_MAX_TILES)."""
+    return refresh_tiles(ring_lonlat, force=force, max_tiles=LIVE_MAX_TILES,
+                         timeout=LIVE_TIMEOUT, attempts=1)
@@ -0,0 +1,102 @@
+# pagination.py
+# Keyset (cursor) pagination shared by the admin listings and the sales API.
+# Pages are fetched with a range query on (sort_field, _id) instead of
+# skip(), so page 500 costs the same as page 1. Cursors are opaque tokens
+# holding the boundary row's sort key.
+import base64
+
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sort_field, value, _id):
+    raw = json_util.dumps({"f": sort_field, "v": value, "id": _id})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, sort_field):
+    """Returns (value, _id). Raises InvalidCursor for junk or a token from another sort."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        if data["f"] != sort_field:
+            raise InvalidCursor("cursor belongs to a different sort")
+        return data["v"], data["id"]
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidCursor(str(e))
+
+
+def _after(sort_field, value, _id, direction):
+    """Filter for rows strictly after (value, _id) in the given sort direction."""
+    op = "$gt" if direction == ASCENDING else "$lt"
+    if sort_field == "_id":
+        return {"_id": {op: _id}}
+    tie = {sort_field: value, "_id": {op: _id}}
+    if value is None:
+        # Missing/null sorts lowest: ascending, everything non-null comes after;
+        # descending, only other nulls with a smaller _id do.
+        if direction == ASCENDING:
+            return {"$or": [{sort_field: {"$ne": None}}, tie]}
+        return tie
+    if direction == ASCENDING:
+        return {"$or": [{sort_field: {op: value}}, tie]}
+    # Descending, the missing/null rows come after every value.
+    return {"$or": [{sort_field: {op: value}}, tie, {sort_field: None}]}
+
+
+def keyset_page(collection, query, sort_field, direction=DESCENDING, limit=20,
+                after=None, before=None, projection=None):
+    """
+    One page of `collection.find(query)` ordered by (sort_field, _id).
+    Range comparisons only match values of the cursor's own BSON type, so
+    sort_field must hold one type (or be null/missing) across the collection;
+    sort_field="_id" pages on _id alone.
+
+    Pass the `next` token as `after` or the `prev` token as `before`; with
+    neither you get the first page. Returns a dict with `items`, `next` and
+    `prev` (None at either end). An unusable token raises InvalidCursor.
+    """
+    backwards = before is not None
+    token = before if backwards else after
+    # Walking backwards = walking forwards in the opposite order, then flipping.
+    scan_direction = -direction if backwards else direction
+
+    filters = [query] if query else []
+    if token:
+        value, _id = decode_cursor(token, sort_field)
+        filters.append(_after(sort_field, value, _id, scan_direction))
+    find_query = {"$and": filters} if len(filters) > 1 else (filters[0] if filters else {})
+
+    sort = [("_id", scan_direction)]
+    if sort_field != "_id":
+        sort.insert(0, (sort_field, scan_direction))
+    rows = list(collection.find(find_query, projection).sort(sort).limit(limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    def _token(row):
+        return encode_cursor(sort_field, row.get(sort_field), row["_id"])
+
+    has_next = more if not backwards else True
+    has_prev = more if backwards else bool(token)
+    return {
+        "items": rows,
+        "next": _token(rows[-1]) if rows and has_next else None,
+        "prev": _token(rows[0]) if rows and has_prev else None,
+    }
+
+
+def estimated_total(collection, query):
+    """
+    Cheap total for page headers: the collection metadata count when there is
+    no filter, otherwise None (callers that need an exact number count_documents).
+    """
+    if query:
+        return None
+    return collection.estimated_document_count()
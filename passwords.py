@@ -0,0 +1,152 @@
+# passwords.py
+# bcrypt hashing and verification for the web/API login and registration
+# paths. Every call runs on a small per-worker pool with a fixed number of
+# admission slots (running + queued), fewer than the worker's request
+# threads. When the slots are gone the caller gets PasswordHashingBusy, which
+# error_handlers.py turns into a 503, so a burst of logins queues behind the
+# pool instead of pinning every request thread and starving the order APIs.
+#
+# Successful logins also upgrade hashes made with a lower cost factor than
+# BCRYPT_LOG_ROUNDS, in the background, on the same pool.
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from flask import current_app
+
+from extensions import bcrypt
+
+logger = logging.getLogger(__name__)
+
+# Every admitted hash (running or queued) holds a request thread while it
+# waits, so the slots are sized from the gunicorn thread count
+# (gunicorn.conf.py) with at least FREE_REQUEST_THREADS left for everything
+# else. With the defaults (4 threads) that is 2 hashing + 1 queued per
+# worker: ~8 bcrypt hashes/s per worker at cost 12, and a 503 beyond 3 in
+# flight. That is the intended trade: logins shed before orders stall.
+REQUEST_THREADS = int(os.getenv("GUNICORN_THREADS", "4"))
+FREE_REQUEST_THREADS = 1
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Requests allowed to wait for a worker before we start shedding.
+HASH_MAX_PENDING = int(os.getenv(
+    "PASSWORD_HASH_MAX_PENDING",
+    str(max(REQUEST_THREADS - FREE_REQUEST_THREADS - HASH_WORKERS, 0))
+))
+if HASH_WORKERS + HASH_MAX_PENDING > REQUEST_THREADS - FREE_REQUEST_THREADS:
+    # Clamp rather than fail: this module is imported by web, scheduler and
+    # the release scripts alike.
+    _requested = (HASH_WORKERS, HASH_MAX_PENDING)
+    HASH_WORKERS = max(min(HASH_WORKERS, REQUEST_THREADS - FREE_REQUEST_THREADS), 1)
+    HASH_MAX_PENDING = max(REQUEST_THREADS - FREE_REQUEST_THREADS - HASH_WORKERS, 0)
+    logger.warning(
+        f"[PASSWORDS] PASSWORD_HASH_WORKERS/PASSWORD_HASH_MAX_PENDING {_requested} leave no free "
+        f"request thread with GUNICORN_THREADS={REQUEST_THREADS}; using "
+        f"({HASH_WORKERS}, {HASH_MAX_PENDING})"
+    )
+# A request never waits longer than this for its hash.
+HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+DEFAULT_LOG_ROUNDS = 12
+
+_BCRYPT_COST = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+
+class PasswordHashingBusy(Exception):
+    """No hashing slot is free; the caller should answer 503."""
+
+
+_executor = None
+_slots = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_pool():
+    global _executor, _slots, _executor_pid
+    # Per process: threads don't survive a fork.
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="passwords")
+            _slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_MAX_PENDING)
+            _executor_pid = os.getpid()
+        return _executor, _slots
+
+
+def _submit(fn, *args):
+    """Queue fn(*args) if a slot is free, else raise PasswordHashingBusy."""
+    executor, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise PasswordHashingBusy()
+    try:
+        future = executor.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+def _run(fn, *args):
+    future = _submit(fn, *args)
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeout:
+        raise PasswordHashingBusy()
+
+
+def _hash(password, rounds=None):
+    return bcrypt.generate_password_hash(password, rounds).decode("utf-8")
+
+
+def hash_password(password):
+    """bcrypt hash (str) for a new or changed password."""
+    return _run(_hash, password)
+
+
+def check_password(pw_hash, password):
+    """True if password matches pw_hash. ValueError for a malformed hash."""
+    return _run(bcrypt.check_password_hash, pw_hash, password)
+
+
+def _target_rounds():
+    return current_app.config.get("BCRYPT_LOG_ROUNDS", DEFAULT_LOG_ROUNDS)
+
+
+def needs_rehash(pw_hash, rounds=None):
+    """True for a bcrypt hash made with a lower cost than the configured one."""
+    match = _BCRYPT_COST.match(pw_hash or "")
+    return bool(match) and int(match.group(1)) < (rounds or _target_rounds())
+
+
+def _upgrade_hash(users_collection, user_id, old_hash, password, rounds):
+    # Guarded on the old hash so a password change in the meantime wins.
+    users_collection.update_one(
+        {"_id": user_id, "password": old_hash},
+        {"$set": {"password": _hash(password, rounds)}}
+    )
+
+
+def verify_password(users_collection, user, password):
+    """
+    Check a login attempt against user["password"]. On success, a hash with
+    an outdated cost factor is re-hashed in the background (skipped when the
+    pool is busy; the next login will try again).
+    """
+    pw_hash = user.get("password", "")
+    if not check_password(pw_hash, password):
+        return False
+    rounds = _target_rounds()
+    if needs_rehash(pw_hash, rounds):
+        app = current_app._get_current_object()
+        try:
+            future = _submit(_upgrade_hash, users_collection, user["_id"], pw_hash, password, rounds)
+        except PasswordHashingBusy:
+            return True
+
+        def _log_failure(f):
+            if f.exception() is not None:
+                app.logger.error(f"[PASSWORDS] Rehash failed for {user['_id']}: {f.exception()}")
+
+        future.add_done_callback(_log_failure)
+    return True
@@ -0,0 +1,58 @@
+# projections.py
+# Per-endpoint field projections. Listings ask Mongo for only the fields the
+# endpoint renders, so we don't ship/decode/serialize whole order documents
+# (Stripe secrets, checkout URLs, vehicle arrays...) on every request.
+# API views are exclusion-based so mobile clients keep every field they
+# might read, minus the private ones.
+
+# Never returned by the JSON APIs.
+ORDER_PRIVATE_FIELDS = (
+    "client_secret",
+    "client_secret_downpayment",
+    "client_secret_remaining_balance",
+    "payment_intent_id",
+    "payment_intent_downpayment",
+    "payment_intent_remaining_balance",
+    "stripe_payment_intent_id",
+    "setup_claimed_at",
+    "setup_error",
+    "notified_thresholds",
+)
+
+PROJECTIONS = {
+    # Orders returned by the sales/tech apps and the tech pages.
+    "order_api": {field: 0 for field in ORDER_PRIVATE_FIELDS},
+    # Rows of the admin dashboard (admin_main + _enrich_orders).
+    "admin_order_row": {
+        "creation_date": 1, "service_date": 1, "status": 1, "payment_status": 1,
+        "final_price": 1, "services_total": 1, "is_guest": 1, "salesperson": 1,
+        "guest_email": 1, "user": 1, "technician": 1, "selectedServices": 1,
+    },
+    # Customer typeahead on the admin create-order page (search_name is the
+    # keyset sort key, so it must be returned).
+    "create_order_customer": {
+        "full_name": 1, "name": 1, "email": 1, "phone": 1, "phone_number": 1,
+        "vehicles": 1, "address": 1, "search_name": 1,
+        "street_address": 1, "city": 1, "zip_code": 1, "unit_apt": 1,
+    },
+    "create_order_service": {"key": 1, "label": 1, "category": 1, "price_by_vehicle_size": 1, "active": 1},
+}
+
+
+def projection(view):
+    """The projection dict for a named view (KeyError for unknown views)."""
+    return PROJECTIONS[view]
+
+
+def find_view(collection, query, view, sort=None, limit=None):
+    """collection.find() restricted to the fields of `view`."""
+    cursor = collection.find(query, projection(view))
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+def find_one_view(collection, query, view):
+    return collection.find_one(query, projection(view))
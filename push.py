@@ -0,0 +1,137 @@
+# push.py
+# Process-wide APNs service. The certificate is decoded and written once,
+# and one long-lived HTTP/2 client is kept per (certificate, environment),
+# so pushes reuse the same TLS connection instead of a handshake per message.
+import atexit
+import base64
+import os
+import tempfile
+import threading
+
+from apns2.client import APNsClient, Notification
+from apns2.payload import Payload
+
+# App bundle ids
+TECH_TOPIC = "biz.cfautocare.cfactech"
+SALES_TOPIC = "com.Centralfloridaautocare.cfacios"
+
+# Env vars holding the base64 .pem for each app
+TECH_CERT_ENV = "APNS_CERT_B64"
+SALES_CERT_ENV = "APNS_CERT_B64_SALESMAN"
+
+
+class PushError(Exception):
+    pass
+
+
+class PushService:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cert_paths = {}
+        # Cert files this process wrote (and so removes in cleanup()).
+        self._owned_paths = set()
+        self._clients = {}
+        self._client_locks = {}
+        self._pid = os.getpid()
+
+    def _reset_after_fork(self):
+        # Never reuse a connection opened in the parent process. The parent's
+        # cert files stay valid and are shared; the parent removes them.
+        if self._pid != os.getpid():
+            self._owned_paths = set()
+            self._clients = {}
+            self._client_locks = {}
+            self._pid = os.getpid()
+            atexit.register(self.cleanup)
+
+    def _cert_path(self, cert_env):
+        # Called with self._lock held.
+        path = self._cert_paths.get(cert_env)
+        if path and os.path.exists(path):
+            return path
+
+        cert_b64 = os.environ.get(cert_env)
+        if not cert_b64:
+            raise PushError(f"{cert_env} not configured")
+
+        fd, path = tempfile.mkstemp(suffix=".pem")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(base64.b64decode(cert_b64))
+        self._cert_paths[cert_env] = path
+        self._owned_paths.add(path)
+        return path
+
+    def _client(self, cert_env, use_sandbox):
+        key = (cert_env, use_sandbox)
+        with self._lock:
+            self._reset_after_fork()
+            if key not in self._clients:
+                self._clients[key] = APNsClient(
+                    self._cert_path(cert_env),
+                    use_sandbox=use_sandbox,
+                    use_alternative_port=False,
+                )
+                self._client_locks[key] = threading.Lock()
+            return self._clients[key], self._client_locks[key]
+
+    def _drop_client(self, cert_env, use_sandbox):
+        with self._lock:
+            client = self._clients.pop((cert_env, use_sandbox), None)
+        # Close the dropped HTTP/2 connection instead of leaving it to the GC.
+        connection = getattr(client, "_connection", None)
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def send(self, device_token, payload, topic, cert_env, use_sandbox=False):
+        """Send one notification. Raises on failure like APNsClient does."""
+        result = self.send_many([device_token], payload, topic, cert_env, use_sandbox)
+        outcome = result.get(device_token)
+        if outcome != "Success":
+            raise PushError(str(outcome))
+        return outcome
+
+    def send_many(self, tokens, payload, topic, cert_env, use_sandbox=False):
+        """
+        Send the same payload to many devices over one connection (requests
+        are multiplexed as concurrent HTTP/2 streams).
+        Returns {token: "Success" | <APNs reason>}.
+        """
+        tokens = [t for t in dict.fromkeys(tokens) if t]
+        if not tokens:
+            return {}
+
+        notifications = [Notification(token=t, payload=payload) for t in tokens]
+        for attempt in range(2):
+            client, client_lock = self._client(cert_env, use_sandbox)
+            try:
+                with client_lock:
+                    return client.send_notification_batch(notifications, topic=topic)
+            except Exception:
+                # Connection dropped (idle timeout, GOAWAY...): reconnect once.
+                self._drop_client(cert_env, use_sandbox)
+                if attempt:
+                    raise
+
+    def cleanup(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked but never sent: everything cached is the parent's.
+                return
+            for path in self._owned_paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._owned_paths = set()
+            self._cert_paths = {}
+
+
+push_service = PushService()
+atexit.register(push_service.cleanup)
+
+
+def build_payload(title, body, custom=None):
+    return Payload(alert={"title": title, "body": body}, sound="default", badge=1, custom=custom)
@@ -0,0 +1,278 @@
+# reminders.py
+# Precomputed tech reminders. When an order is scheduled we write one
+# `reminders` doc per threshold with its absolute fire time; the dispatcher
+# keeps the upcoming ones in a min-heap and sleeps until the next is due.
+import heapq
+import threading
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from db import get_collection
+from order_model import to_utc_datetime
+
+# Hours before service_date at which the tech gets a reminder.
+REMINDER_THRESHOLDS = [12, 6, 2, 1]
+
+# Order statuses that still want reminders.
+ACTIVE_ORDER_STATUSES = ("ordered",)
+
+# How far ahead the dispatcher loads reminders into memory, and how often it
+# re-reads that horizon when change streams aren't available.
+HEAP_HORIZON = timedelta(hours=24)
+REFRESH_INTERVAL = timedelta(minutes=15)
+# A reminder left in "sending" longer than this belonged to a dispatcher that
+# died mid-send; it is put back to pending (at-least-once delivery).
+STALE_CLAIM_AFTER = timedelta(minutes=5)
+
+
+def schedule_order_reminders(order_id, tech_id=None):
+    """
+    (Re)build the reminder timeline for an order. Call whenever an order is
+    assigned or rescheduled. Returns the number of reminders written.
+    """
+    orders = get_collection("orders")
+    reminders = get_collection("reminders")
+
+    order = orders.find_one(
+        {"_id": order_id},
+        {"service_date": 1, "technician": 1, "notified_thresholds": 1}
+    )
+    if not order or not order.get("service_date"):
+        return 0
+
+    tech_id = order.get("technician") or tech_id
+    if not tech_id:
+        return 0
+
+    service_date = to_utc_datetime(order["service_date"])
+    already_notified = set(order.get("notified_thresholds", []))
+    now = datetime.utcnow()
+
+    # Drop anything not yet sent; the service date or tech may have changed.
+    reminders.delete_many({"order_id": order["_id"], "status": {"$ne": "sent"}})
+    if service_date <= now:
+        return 0
+
+    pending = [t for t in REMINDER_THRESHOLDS if t not in already_notified]
+    # Thresholds we're already past collapse into one immediate reminder
+    # for the most urgent of them.
+    passed = [t for t in pending if service_date - timedelta(hours=t) <= now]
+    if passed:
+        pending = [t for t in pending if t not in passed or t == min(passed)]
+
+    docs = []
+    for threshold in pending:
+        fire_at = service_date - timedelta(hours=threshold)
+        docs.append({
+            "order_id": order["_id"],
+            "tech_id": str(tech_id),
+            "threshold": threshold,
+            "fire_at": max(fire_at, now),
+            "service_date": service_date,
+            "status": "pending",
+            "created_at": now,
+        })
+
+    written = 0
+    for doc in docs:
+        try:
+            reminders.insert_one(doc)
+            written += 1
+        except DuplicateKeyError:
+            # Already sent for this threshold.
+            pass
+    return written
+
+
+def backfill_reminders():
+    """Timelines for upcoming orders created before reminders existed."""
+    orders = get_collection("orders")
+    reminders = get_collection("reminders")
+    upcoming = orders.find(
+        {"status": {"$in": list(ACTIVE_ORDER_STATUSES)},
+         "service_date": {"$gt": datetime.utcnow()},
+         "technician": {"$exists": True}},
+        {"_id": 1}
+    )
+    created = 0
+    for order in upcoming:
+        if reminders.find_one({"order_id": order["_id"]}, {"_id": 1}) is None:
+            created += schedule_order_reminders(order["_id"])
+    return created
+
+
+def release_stale_claims():
+    """Return reminders stuck in "sending" to pending so they fire again."""
+    now = datetime.utcnow()
+    result = get_collection("reminders").update_many(
+        {"status": "sending", "claimed_at": {"$lte": now - STALE_CLAIM_AFTER}},
+        {"$set": {"status": "pending", "fire_at": now}, "$unset": {"claimed_at": ""}}
+    )
+    return result.modified_count
+
+
+# -------------------------------
+# Dispatcher
+# -------------------------------
+class ReminderDispatcher:
+    """
+    Single-process dispatcher (runs in the scheduler process). The heap holds
+    (fire_at, reminder_id) for everything due within HEAP_HORIZON.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._heap = []
+        self._known = set()
+        self._wakeup = threading.Condition()
+        self._stopped = False
+        self._use_change_stream = True
+
+    # heap maintenance ---------------------------------------------------
+    def _push(self, reminder):
+        if reminder["_id"] in self._known:
+            return
+        self._known.add(reminder["_id"])
+        heapq.heappush(self._heap, (reminder["fire_at"], reminder["_id"]))
+
+    def load_horizon(self):
+        released = release_stale_claims()
+        if released:
+            self.app.logger.warning(f"[REMINDERS] Re-queued {released} reminder(s) with a stale claim")
+        horizon = datetime.utcnow() + HEAP_HORIZON
+        cursor = get_collection("reminders").find(
+            {"status": "pending", "fire_at": {"$lte": horizon}},
+            {"fire_at": 1}
+        ).sort("fire_at", 1)
+        with self._wakeup:
+            for reminder in cursor:
+                self._push(reminder)
+            self._wakeup.notify()
+        # With a change stream feeding inserts we only need to slide the
+        # horizon forward; without one, re-read it regularly.
+        interval = HEAP_HORIZON / 2 if self._use_change_stream else REFRESH_INTERVAL
+        self._next_refresh = datetime.utcnow() + interval
+
+    def _watch_new_reminders(self):
+        """Push reminders inserted by web workers into the heap as they arrive."""
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        try:
+            with get_collection("reminders").watch(pipeline) as stream:
+                for change in stream:
+                    if self._stopped:
+                        return
+                    doc = change["fullDocument"]
+                    if doc["fire_at"] <= datetime.utcnow() + HEAP_HORIZON:
+                        with self._wakeup:
+                            self._push(doc)
+                            self._wakeup.notify()
+        except OperationFailure as e:
+            # Standalone servers don't support change streams; poll instead.
+            self.app.logger.info(f"[REMINDERS] Change streams unavailable ({e}), polling every {REFRESH_INTERVAL}")
+            self._use_change_stream = False
+        except Exception as e:
+            self.app.logger.error(f"[REMINDERS] Change stream stopped: {e}")
+            self._use_change_stream = False
+        self._next_refresh = datetime.utcnow()
+        with self._wakeup:
+            self._wakeup.notify()
+
+    # sending -------------------------------------------------------------
+    def _fire(self, reminder_id):
+        from api_tech import get_device_token_for_tech, send_notification_to_tech
+
+        reminders = get_collection("reminders")
+        orders = get_collection("orders")
+
+        # Claim it; a reschedule may have deleted it in the meantime.
+        reminder = reminders.find_one_and_update(
+            {"_id": reminder_id, "status": "pending"},
+            {"$set": {"status": "sending", "claimed_at": datetime.utcnow()}}
+        )
+        if reminder is None:
+            return
+
+        order = orders.find_one({"_id": reminder["order_id"]}, {"status": 1})
+        if not order or order.get("status") not in ACTIVE_ORDER_STATUSES:
+            reminders.update_one({"_id": reminder_id}, {"$set": {"status": "cancelled"}})
+            return
+
+        threshold = reminder["threshold"]
+        order_id = str(reminder["order_id"])
+        custom_message = None
+        if threshold == 1:
+            custom_message = "Update your order status and let the client know you're on the way!"
+
+        device_token = get_device_token_for_tech(reminder["tech_id"])
+        if not device_token:
+            reminders.update_one({"_id": reminder_id}, {"$set": {"status": "failed", "error": "no device token"}})
+            return
+
+        push_response = send_notification_to_tech(
+            reminder["tech_id"], order_id, threshold, device_token, custom_message=custom_message
+        )
+        if push_response.get("status") == "sent":
+            reminders.update_one({"_id": reminder_id}, {"$set": {"status": "sent", "sent_at": datetime.utcnow()}})
+            orders.update_one({"_id": reminder["order_id"]}, {"$addToSet": {"notified_thresholds": threshold}})
+        else:
+            reminders.update_one(
+                {"_id": reminder_id},
+                {"$set": {"status": "failed", "error": push_response.get("detail")}}
+            )
+
+    # main loop -------------------------------------------------------------
+    def run(self):
+        with self.app.app_context():
+            created = backfill_reminders()
+            self.app.logger.info(f"[REMINDERS] Backfilled {created} reminders")
+            self.load_horizon()
+
+        threading.Thread(target=self._watch_with_context, daemon=True).start()
+
+        while not self._stopped:
+            due = []
+            with self._wakeup:
+                now = datetime.utcnow()
+                while self._heap and self._heap[0][0] <= now:
+                    _, reminder_id = heapq.heappop(self._heap)
+                    self._known.discard(reminder_id)
+                    due.append(reminder_id)
+
+                if not due:
+                    # Sleep until the next reminder, or until the horizon needs
+                    # re-reading. New inserts wake us through the change stream.
+                    wake_at = self._next_refresh
+                    if self._heap:
+                        wake_at = min(wake_at, self._heap[0][0])
+                    self._wakeup.wait(max((wake_at - now).total_seconds(), 0))
+
+            for reminder_id in due:
+                with self.app.app_context():
+                    try:
+                        self._fire(reminder_id)
+                    except Exception as e:
+                        self.app.logger.error(f"[REMINDERS] Error sending reminder {reminder_id}: {e}")
+
+            if datetime.utcnow() >= self._next_refresh:
+                with self.app.app_context():
+                    try:
+                        self.load_horizon()
+                    except Exception as e:
+                        self.app.logger.error(f"[REMINDERS] Error reloading reminders: {e}")
+                        self._next_refresh = datetime.utcnow() + REFRESH_INTERVAL
+
+    def _watch_with_context(self):
+        with self.app.app_context():
+            self._watch_new_reminders()
+
+    def stop(self):
+        self._stopped = True
+        with self._wakeup:
+            self._wakeup.notify()
+
+
+def start_dispatcher(app):
+    dispatcher = ReminderDispatcher(app)
+    threading.Thread(target=dispatcher.run, name="reminder-dispatcher", daemon=True).start()
+    return dispatcher
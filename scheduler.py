@@ -0,0 +1,36 @@
+# scheduler.py
+# Standalone background-job process (Procfile: `scheduler`).
+# Web workers don't run jobs unless RUN_SCHEDULER_IN_WEB=true; even then the
+# Mongo lease in jobs.py makes sure each job runs once per interval.
+import monkey_patch
+from dotenv import load_dotenv
+load_dotenv()
+
+import logging
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+from app import app
+from db import init_db
+from indexes import ensure_indexes
+from jobs import register_jobs
+from reminders import start_dispatcher
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    init_db(app)
+    ensure_indexes()
+
+    start_dispatcher(app)
+
+    scheduler = BlockingScheduler()
+    register_jobs(scheduler, app)
+    app.logger.info("[SCHEDULER] Starting dedicated scheduler process")
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        app.logger.info("[SCHEDULER] Shutting down")
+
+
+if __name__ == '__main__':
+    main()
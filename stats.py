@@ -0,0 +1,86 @@
+# stats.py
+# Materialized dashboard counters. Writers bump a single `stats` document with
+# $inc when orders/users are created or deleted, so the admin dashboard reads
+# its counters with one find_one. A scheduler job recomputes the exact values
+# to correct any drift (failed $inc, writes from scripts like add_employee.py).
+import logging
+from datetime import datetime
+
+from db import get_collection
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_STATS_ID = "dashboard"
+USER_TYPES = ("tech", "customer", "admin", "sales")
+
+
+def _bump(inc):
+    try:
+        get_collection("stats").update_one(
+            {"_id": DASHBOARD_STATS_ID},
+            {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+    except Exception as e:
+        # The reconciliation job will fix the counters; never fail the write.
+        logger.warning(f"[STATS] Failed to apply {inc}: {e}")
+
+
+def record_order_created(is_guest):
+    inc = {"orders_total": 1}
+    if is_guest:
+        inc["orders_guest"] = 1
+    _bump(inc)
+
+
+def record_order_deleted(order):
+    inc = {"orders_total": -1}
+    if order.get("is_guest"):
+        inc["orders_guest"] = -1
+    _bump(inc)
+
+
+def record_user_created(user_type):
+    if user_type in USER_TYPES:
+        _bump({f"users.{user_type}": 1})
+
+
+def record_user_deleted(user):
+    user_type = user.get("user_type")
+    if user_type in USER_TYPES:
+        _bump({f"users.{user_type}": -1})
+
+
+def reconcile_stats():
+    """Recompute the exact counters (scheduler job). Returns the new document."""
+    facet = next(get_collection("orders").aggregate([
+        {"$facet": {
+            "total": [{"$count": "n"}],
+            "guest": [{"$match": {"is_guest": True}}, {"$count": "n"}],
+        }}
+    ]), {})
+
+    users = {user_type: 0 for user_type in USER_TYPES}
+    for doc in get_collection("users").aggregate([
+        {"$match": {"user_type": {"$in": list(USER_TYPES)}}},
+        {"$group": {"_id": "$user_type", "count": {"$sum": 1}}},
+    ]):
+        users[doc["_id"]] = doc["count"]
+
+    stats = {
+        "orders_total": facet["total"][0]["n"] if facet.get("total") else 0,
+        "orders_guest": facet["guest"][0]["n"] if facet.get("guest") else 0,
+        "users": users,
+        "updated_at": datetime.utcnow(),
+        "reconciled_at": datetime.utcnow(),
+    }
+    get_collection("stats").update_one({"_id": DASHBOARD_STATS_ID}, {"$set": stats}, upsert=True)
+    return stats
+
+
+def get_dashboard_stats():
+    """O(1) read of the counters; computed once if the document doesn't exist yet."""
+    stats = get_collection("stats").find_one({"_id": DASHBOARD_STATS_ID})
+    if stats is None or "reconciled_at" not in stats:
+        stats = reconcile_stats()
+    return stats
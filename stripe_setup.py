@@ -0,0 +1,113 @@
+# stripe_setup.py
+# Creates the down-payment / remaining-balance Stripe objects for an order.
+# The four calls don't depend on each other, so they run concurrently on a
+# small per-process pool. Each call carries an idempotency key derived from
+# the order id, so a retried setup gets the same objects back from Stripe.
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+
+try:
+    from stripe import RequestsClient
+except ImportError:  # older stripe-python
+    from stripe.http_client import RequestsClient
+
+STRIPE_POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", "8"))
+
+# One keep-alive HTTP client for all Stripe calls (requests.Session per thread).
+stripe.default_http_client = RequestsClient(timeout=30)
+stripe.max_network_retries = 2
+
+_executor = None
+_executor_pid = None
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=STRIPE_POOL_SIZE, thread_name_prefix="stripe")
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def idempotency_key(order_id, step):
+    return f"order-{order_id}-{step}"
+
+
+def _line_items(name, amount):
+    return [{
+        "price_data": {
+            "currency": "usd",
+            "product_data": {"name": name},
+            "unit_amount": amount,
+        },
+        "quantity": 1,
+    }]
+
+
+def create_checkout_objects(order_id, final_price, customer_email, success_url, cancel_url,
+                            downpayment_session_extra=None, remaining_session_extra=None):
+    """
+    Down payment (40%) + remaining balance (60%) PaymentIntents and Checkout
+    Sessions, created concurrently. Returns the fields to $set on the order.
+    stripe.api_key must already be set.
+    """
+    downpayment_amount = int(final_price * 100 * 0.40)
+    remaining_amount = int(final_price * 100 * 0.60)
+    executor = _get_executor()
+
+    downpayment_intent = executor.submit(
+        stripe.PaymentIntent.create,
+        amount=downpayment_amount,
+        currency="usd",
+        payment_method_types=["card"],
+        metadata={"order_id": order_id, "payment_type": "downpayment"},
+        idempotency_key=idempotency_key(order_id, "pi-downpayment")
+    )
+    remaining_intent = executor.submit(
+        stripe.PaymentIntent.create,
+        amount=remaining_amount,
+        currency="usd",
+        payment_method_types=["card"],
+        metadata={"order_id": order_id, "payment_type": "remaining_balance"},
+        capture_method="manual",
+        idempotency_key=idempotency_key(order_id, "pi-remaining")
+    )
+    downpayment_checkout_session = executor.submit(
+        stripe.checkout.Session.create,
+        payment_method_types=["card"],
+        line_items=_line_items(f"Down Payment for Order #{order_id}", downpayment_amount),
+        customer_email=customer_email,
+        success_url=success_url,
+        cancel_url=cancel_url,
+        mode="payment",
+        idempotency_key=idempotency_key(order_id, "cs-downpayment"),
+        **(downpayment_session_extra or {})
+    )
+    remaining_checkout_session = executor.submit(
+        stripe.checkout.Session.create,
+        payment_method_types=["card"],
+        line_items=_line_items(f"Remaining Balance for Order #{order_id}", remaining_amount),
+        customer_email=customer_email,
+        success_url=success_url,
+        cancel_url=cancel_url,
+        mode="payment",
+        idempotency_key=idempotency_key(order_id, "cs-remaining"),
+        **(remaining_session_extra or {})
+    )
+
+    # .result() re-raises the first Stripe error in the caller.
+    downpayment_intent = downpayment_intent.result()
+    remaining_intent = remaining_intent.result()
+    downpayment_checkout_session = downpayment_checkout_session.result()
+    remaining_checkout_session = remaining_checkout_session.result()
+
+    return {
+        "payment_intent_downpayment": downpayment_intent.id,
+        "client_secret_downpayment": downpayment_intent.client_secret,
+        "payment_intent_remaining_balance": remaining_intent.id,
+        "client_secret_remaining_balance": remaining_intent.client_secret,
+        "downpayment_checkout_url": downpayment_checkout_session.url,
+        "remaining_balance_checkout_url": remaining_checkout_session.url,
+    }
@@ -0,0 +1,135 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+from pagination import _after, keyset_page
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def _walk(collection, sort_field, direction, limit=2, query=None):
+    """Every row, following `next` tokens from the first page."""
+    seen = []
+    page = keyset_page(collection, query, sort_field, direction=direction, limit=limit)
+    seen.extend(page["items"])
+    while page["next"]:
+        page = keyset_page(collection, query, sort_field, direction=direction, limit=limit,
+                           after=page["next"])
+        seen.extend(page["items"])
+    return [row["_id"] for row in seen]
+
+
+def _walk_back(collection, sort_field, direction, limit=2):
+    """Every row, from the last page back to the first along `prev` tokens."""
+    page = keyset_page(collection, None, sort_field, direction=direction, limit=limit)
+    while page["next"]:
+        page = keyset_page(collection, None, sort_field, direction=direction, limit=limit,
+                           after=page["next"])
+    seen = list(page["items"])
+    while page["prev"]:
+        page = keyset_page(collection, None, sort_field, direction=direction, limit=limit,
+                           before=page["prev"])
+        seen[:0] = page["items"]
+    return [row["_id"] for row in seen]
+
+
+@pytest.fixture
+def orders():
+    collection = mongomock.MongoClient().db.orders
+    ids = [ObjectId() for _ in range(7)]
+    collection.insert_many([
+        {"_id": ids[0], "service_date": datetime(2024, 5, 1)},
+        {"_id": ids[1], "service_date": None},  # customer.start_payment
+        {"_id": ids[2], "service_date": datetime(2024, 5, 3)},
+        {"_id": ids[3]},
+        {"_id": ids[4], "service_date": datetime(2024, 5, 1)},
+        {"_id": ids[5], "service_date": None},
+        {"_id": ids[6], "service_date": datetime(2024, 5, 2)},
+    ])
+    return collection, ids
+
+
+# -------------------------------
+# _after
+# -------------------------------
+def test_after_descending_value_includes_nulls():
+    _id = ObjectId()
+    when = datetime(2024, 5, 1)
+    assert _after("service_date", when, _id, DESCENDING) == {"$or": [
+        {"service_date": {"$lt": when}},
+        {"service_date": when, "_id": {"$lt": _id}},
+        {"service_date": None},
+    ]}
+
+
+def test_after_ascending_value_skips_nulls():
+    _id = ObjectId()
+    when = datetime(2024, 5, 1)
+    assert _after("service_date", when, _id, ASCENDING) == {"$or": [
+        {"service_date": {"$gt": when}},
+        {"service_date": when, "_id": {"$gt": _id}},
+    ]}
+
+
+def test_after_null_value():
+    _id = ObjectId()
+    assert _after("service_date", None, _id, ASCENDING) == {"$or": [
+        {"service_date": {"$ne": None}},
+        {"service_date": None, "_id": {"$gt": _id}},
+    ]}
+    assert _after("service_date", None, _id, DESCENDING) == {"service_date": None, "_id": {"$lt": _id}}
+
+
+def test_after_on_id():
+    _id = ObjectId()
+    assert _after("_id", _id, _id, ASCENDING) == {"_id": {"$gt": _id}}
+    assert _after("_id", _id, _id, DESCENDING) == {"_id": {"$lt": _id}}
+
+
+# -------------------------------
+# keyset_page
+# -------------------------------
+@pytest.mark.parametrize("direction", [ASCENDING, DESCENDING])
+def test_pages_cover_nulls_once_in_sort_order(orders, direction):
+    collection, ids = orders
+    expected = [
+        row["_id"] for row in
+        collection.find().sort([("service_date", direction), ("_id", direction)])
+    ]
+    assert sorted(expected) == sorted(ids)
+    assert _walk(collection, "service_date", direction) == expected
+
+
+@pytest.mark.parametrize("direction", [ASCENDING, DESCENDING])
+def test_prev_tokens_walk_back_over_nulls(orders, direction):
+    collection, _ = orders
+    assert _walk_back(collection, "service_date", direction) == _walk(collection, "service_date", direction)
+
+
+@pytest.mark.parametrize("direction", [ASCENDING, DESCENDING])
+def test_id_paging_covers_users_with_mixed_dates(direction):
+    users = mongomock.MongoClient().db.users
+    ids = sorted(ObjectId() for _ in range(5))
+    users.insert_many([
+        {"_id": ids[0], "user_type": "tech", "creation_date": datetime(2024, 1, 1)},
+        {"_id": ids[1], "user_type": "customer", "created_at": datetime(2024, 2, 1)},
+        {"_id": ids[2], "user_type": "tech", "creation_date": "2024-03-01 10:00:00"},
+        {"_id": ids[3], "user_type": "sales"},
+        {"_id": ids[4], "user_type": "tech", "creation_date": "2024-05-01 10:00:00"},
+    ])
+    expected = ids if direction == ASCENDING else ids[::-1]
+    assert _walk(users, "_id", direction) == expected
+    assert _walk_back(users, "_id", direction) == expected
+    assert _walk(users, "_id", direction, query={"user_type": "tech"}) == [
+        _id for _id in expected if _id in (ids[0], ids[2], ids[4])
+    ]
+
+
+def test_first_and_last_pages_have_no_outer_token(orders):
+    collection, _ = orders
+    first = keyset_page(collection, None, "service_date", limit=3)
+    assert first["prev"] is None and first["next"]
+    everything = keyset_page(collection, None, "service_date", limit=10)
+    assert everything["next"] is None and everything["prev"] is None
@@ -0,0 +1,156 @@
+import logging
+import sys
+import types
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+import reminders
+
+mongomock = pytest.importorskip("mongomock")
+
+TECH_ID = str(ObjectId())
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = mongomock.MongoClient().cfacdb
+    db.reminders.create_index([("order_id", 1), ("threshold", 1)], unique=True)
+    monkeypatch.setattr(reminders, "get_collection", lambda name: db[name])
+    return db
+
+
+@pytest.fixture
+def sent_pushes(monkeypatch):
+    """Stand-in for api_tech's push helpers; records what _fire sends."""
+    sent = []
+    fake = types.ModuleType("api_tech")
+    fake.get_device_token_for_tech = lambda tech_id: "token-" + tech_id
+    fake.send_notification_to_tech = (
+        lambda tech_id, order_id, threshold, device_token, custom_message=None:
+        sent.append((order_id, threshold)) or {"status": "sent"}
+    )
+    monkeypatch.setitem(sys.modules, "api_tech", fake)
+    return sent
+
+
+def _order(db, hours_ahead, **extra):
+    doc = {
+        "status": "ordered",
+        "technician": TECH_ID,
+        "service_date": datetime.utcnow() + timedelta(hours=hours_ahead),
+        **extra,
+    }
+    return db.orders.insert_one(doc).inserted_id
+
+
+def _thresholds(db, order_id, status="pending"):
+    return sorted(r["threshold"] for r in db.reminders.find({"order_id": order_id, "status": status}))
+
+
+# -------------------------------
+# schedule_order_reminders
+# -------------------------------
+def test_schedules_one_reminder_per_threshold(db):
+    order_id = _order(db, 24)
+    assert reminders.schedule_order_reminders(order_id) == 4
+    assert _thresholds(db, order_id) == [1, 2, 6, 12]
+    reminder = db.reminders.find_one({"order_id": order_id, "threshold": 6})
+    service_date = db.orders.find_one({"_id": order_id})["service_date"]
+    assert reminder["fire_at"] == service_date - timedelta(hours=6)
+    assert reminder["tech_id"] == TECH_ID
+
+
+def test_passed_thresholds_collapse_into_one_immediate_reminder(db):
+    order_id = _order(db, 3)
+    assert reminders.schedule_order_reminders(order_id) == 3
+    assert _thresholds(db, order_id) == [1, 2, 6]
+    now_ish = db.reminders.find_one({"order_id": order_id, "threshold": 6})["fire_at"]
+    assert now_ish <= datetime.utcnow()
+
+
+def test_reschedule_replaces_unsent_reminders(db):
+    order_id = _order(db, 24)
+    reminders.schedule_order_reminders(order_id)
+    db.reminders.update_one({"order_id": order_id, "threshold": 12}, {"$set": {"status": "sent"}})
+    db.orders.update_one(
+        {"_id": order_id},
+        {"$set": {"service_date": datetime.utcnow() + timedelta(hours=48)}, "$addToSet": {"notified_thresholds": 12}}
+    )
+    old_ids = {r["_id"] for r in db.reminders.find({"order_id": order_id, "status": "pending"})}
+
+    assert reminders.schedule_order_reminders(order_id) == 3
+    new = list(db.reminders.find({"order_id": order_id, "status": "pending"}))
+    assert sorted(r["threshold"] for r in new) == [1, 2, 6]
+    assert not old_ids & {r["_id"] for r in new}
+    new_service_date = db.orders.find_one({"_id": order_id})["service_date"]
+    assert all(r["service_date"] == new_service_date for r in new)
+    # The sent reminder is kept.
+    assert _thresholds(db, order_id, status="sent") == [12]
+
+
+def test_past_or_unassigned_orders_get_no_reminders(db):
+    past = _order(db, -1)
+    unassigned = _order(db, 24, technician=None)
+    assert reminders.schedule_order_reminders(past) == 0
+    assert reminders.schedule_order_reminders(unassigned) == 0
+    assert db.reminders.count_documents({}) == 0
+
+
+# -------------------------------
+# Claims
+# -------------------------------
+def test_release_stale_claims_only_requeues_old_claims(db):
+    now = datetime.utcnow()
+    stale = db.reminders.insert_one({
+        "order_id": ObjectId(), "threshold": 1, "status": "sending",
+        "claimed_at": now - reminders.STALE_CLAIM_AFTER - timedelta(seconds=1),
+        "fire_at": now - timedelta(hours=1),
+    }).inserted_id
+    fresh = db.reminders.insert_one({
+        "order_id": ObjectId(), "threshold": 1, "status": "sending",
+        "claimed_at": now, "fire_at": now,
+    }).inserted_id
+
+    assert reminders.release_stale_claims() == 1
+    released = db.reminders.find_one({"_id": stale})
+    assert released["status"] == "pending" and "claimed_at" not in released
+    assert released["fire_at"] > now - timedelta(seconds=1)  # Mongo keeps milliseconds
+    assert db.reminders.find_one({"_id": fresh})["status"] == "sending"
+
+
+def test_load_horizon_requeues_stale_claims(db):
+    db.reminders.insert_one({
+        "order_id": ObjectId(), "threshold": 2, "status": "sending",
+        "claimed_at": datetime.utcnow() - timedelta(hours=1), "fire_at": datetime.utcnow(),
+    })
+    dispatcher = reminders.ReminderDispatcher(types.SimpleNamespace(logger=logging.getLogger("test")))
+    dispatcher.load_horizon()
+    assert len(dispatcher._heap) == 1
+
+
+def test_fire_claims_sends_and_marks_sent(db, sent_pushes):
+    order_id = _order(db, 1)
+    reminders.schedule_order_reminders(order_id)
+    reminder = db.reminders.find_one({"order_id": order_id, "threshold": 1})
+    dispatcher = reminders.ReminderDispatcher(None)
+
+    dispatcher._fire(reminder["_id"])
+    dispatcher._fire(reminder["_id"])  # a second dispatcher loses the claim
+
+    assert sent_pushes == [(str(order_id), 1)]
+    assert db.reminders.find_one({"_id": reminder["_id"]})["status"] == "sent"
+    assert db.orders.find_one({"_id": order_id})["notified_thresholds"] == [1]
+
+
+def test_fire_cancels_reminders_for_inactive_orders(db, sent_pushes):
+    order_id = _order(db, 1)
+    reminders.schedule_order_reminders(order_id)
+    db.orders.update_one({"_id": order_id}, {"$set": {"status": "completed"}})
+    reminder = db.reminders.find_one({"order_id": order_id, "threshold": 1})
+
+    reminders.ReminderDispatcher(None)._fire(reminder["_id"])
+
+    assert sent_pushes == []
+    assert db.reminders.find_one({"_id": reminder["_id"]})["status"] == "cancelled"
@@ -0,0 +1,84 @@
+import pytest
+from bson import ObjectId
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("flask")
+
+from api_territories import HOUSES_SAMPLE_SIZE, _persist_houses_to_territory  # noqa: E402
+
+USER_ID = "user-1"
+
+
+def _items(count, start=0):
+    return [
+        {
+            "address": f"{n} Main St", "city": "Orlando", "state": "FL", "zip": "32801",
+            "lon": -81.38 + n * 0.0001, "lat": 28.54,
+        }
+        for n in range(start, start + count)
+    ]
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().cfacdb
+    db.houses.create_index([("territory_id", 1), ("address", 1), ("zip", 1)], unique=True)
+    return db
+
+
+@pytest.fixture
+def territory_id(db):
+    return str(db.territories.insert_one({"user_id": USER_ID, "name": "T"}).inserted_id)
+
+
+def test_first_save_counts_and_samples(db, territory_id):
+    items = _items(25)
+    summary = _persist_houses_to_territory(db, USER_ID, territory_id, items)
+
+    terr = db.territories.find_one({"_id": ObjectId(territory_id)})
+    assert summary["upserted"] == 25
+    assert terr["houses_count"] == 25 == db.houses.count_documents({})
+    assert len(terr["houses_sample"]) == HOUSES_SAMPLE_SIZE
+    assert all(h.get("house_id") for h in items)
+
+
+def test_resave_attaches_ids_and_keeps_count(db, territory_id):
+    first = _items(25)
+    _persist_houses_to_territory(db, USER_ID, territory_id, first)
+    before = db.territories.find_one({"_id": ObjectId(territory_id)})
+
+    again = _items(25)
+    summary = _persist_houses_to_territory(db, USER_ID, territory_id, again)
+    after = db.territories.find_one({"_id": ObjectId(territory_id)})
+
+    assert summary["upserted"] == 0
+    assert after["houses_count"] == before["houses_count"] == 25
+    assert after["houses_sample"] == before["houses_sample"]
+    assert [h["house_id"] for h in again] == [h["house_id"] for h in first]
+
+
+def test_resave_with_new_houses_only_adds_those(db, territory_id):
+    _persist_houses_to_territory(db, USER_ID, territory_id, _items(10))
+    items = _items(15)  # 0-9 saved already, 10-14 new
+    summary = _persist_houses_to_territory(db, USER_ID, territory_id, items)
+
+    terr = db.territories.find_one({"_id": ObjectId(territory_id)})
+    assert summary["upserted"] == 5
+    assert terr["houses_count"] == 15 == db.houses.count_documents({})
+    assert len(terr["houses_sample"]) == 15
+    assert all(h.get("house_id") for h in items)
+
+
+def test_coordinate_duplicates_share_a_house_id(db, territory_id):
+    items = _items(3)
+    twin = dict(items[1], address="", zip="")  # same point, no address (OSM node in a way)
+    items.append(twin)
+    _persist_houses_to_territory(db, USER_ID, territory_id, items)
+
+    assert db.houses.count_documents({}) == 3
+    assert twin["house_id"] == items[1]["house_id"]
+
+
+def test_other_users_territory_is_forbidden(db, territory_id):
+    with pytest.raises(ValueError, match="territory_not_found_or_forbidden"):
+        _persist_houses_to_territory(db, "someone-else", territory_id, _items(1))
@@ -0,0 +1,28 @@
+# user_model.py
+# Derived fields for user documents. Usernames are matched case-insensitively,
+# so every user with a username also stores `username_lower`; /api/login does
+# an exact match on it (one seek on the unique username_lower index) instead of
+# a case-insensitive regex over the collection. Writers pass new user
+# documents through with_username_lower; migrate_usernames.py fills old rows.
+
+
+def normalize_username(username):
+    """The lookup key for a username: stripped and lowercased ('' for None)."""
+    return (username or "").strip().lower()
+
+
+def with_username_lower(doc):
+    """Return a copy of a user document with username_lower set from username."""
+    doc = dict(doc)
+    key = normalize_username(doc.get("username"))
+    if key:
+        doc["username_lower"] = key
+    return doc
+
+
+def username_in_use(username, *collections):
+    """True if any of the collections has a user with this username, in any case."""
+    key = normalize_username(username)
+    return bool(key) and any(
+        collection.find_one({"username_lower": key}, {"_id": 1}) for collection in collections
+    )
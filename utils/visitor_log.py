@@ -7,24 +7,8 @@ DB_PATH        = "visitors.sqlite"
 VISITOR_COOKIE = "vuid"           # rename if you wish
 
 
-def init_visitor_logging(app):
-    """Call from create_app(); sets up SQLite + request hooks."""
-
-    # ── helper: 1 connection per request ──────────────────────────────────
-    def get_db():
-        if "vlog_db" not in g:
-            g.vlog_db = sqlite3.connect(DB_PATH,
-                                        detect_types=sqlite3.PARSE_DECLTYPES)
-            g.vlog_db.row_factory = sqlite3.Row
-        return g.vlog_db
-
-    @app.teardown_appcontext
-    def close_db(exc):
-        db = g.pop("vlog_db", None)
-        if db:
-            db.close()
-
-    # ── create / migrate the table once ───────────────────────────────────
+def ensure_visitor_table():
+    """Create / migrate the page_hits table (run once per worker, after fork)."""
     with sqlite3.connect(DB_PATH) as db:
         db.execute("""
             CREATE TABLE IF NOT EXISTS page_hits (
@@ -45,6 +29,25 @@ def init_visitor_logging(app):
         if "visitor" not in cols:
             db.execute("ALTER TABLE page_hits ADD COLUMN visitor TEXT;")
 
+
+def init_visitor_logging(app):
+    """Call from create_app(); registers the request hooks.
+    The table itself is created by ensure_visitor_table() after fork."""
+
+    # ── helper: 1 connection per request ──────────────────────────────────
+    def get_db():
+        if "vlog_db" not in g:
+            g.vlog_db = sqlite3.connect(DB_PATH,
+                                        detect_types=sqlite3.PARSE_DECLTYPES)
+            g.vlog_db.row_factory = sqlite3.Row
+        return g.vlog_db
+
+    @app.teardown_appcontext
+    def close_db(exc):
+        db = g.pop("vlog_db", None)
+        if db:
+            db.close()
+
     # ── cookie helper ─────────────────────────────────────────────────────
     def _get_or_set_vuid(resp=None):
         vuid = request.cookies.get(VISITOR_COOKIE)
@@ -0,0 +1,119 @@
+# webhooks.py
+# Stripe webhook ingestion. Endpoints only verify the signature, store the
+# event keyed by its Stripe id (so redeliveries are dropped by the _id
+# index) and return 200. Events are applied off the request thread, once.
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from db import get_collection
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+MAX_ATTEMPTS = 5
+# A "processing" claim older than this is assumed dead and retried.
+STALE_CLAIM_AFTER = timedelta(minutes=10)
+
+
+def _handlers():
+    # source -> function(event_dict). Imported lazily to avoid import cycles.
+    from api_sales import handle_stripe_event as sales_handler
+    from blueprints.collecting import handle_stripe_event as payments_handler
+    return {
+        "api_sales": sales_handler,
+        "payments": payments_handler,
+    }
+
+_executor = None
+_executor_pid = None
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix="webhooks")
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def store_event(raw_payload, source):
+    """
+    Persist a verified event. Returns the event id, or None if Stripe
+    already delivered it (redelivery / retry storm).
+    """
+    event = json.loads(raw_payload)
+    try:
+        get_collection("webhook_events").insert_one({
+            "_id": event["id"],
+            "type": event.get("type"),
+            "source": source,
+            "event": event,
+            "status": "pending",
+            "attempts": 0,
+            "received_at": datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        return None
+    return event["id"]
+
+
+def submit_event(app, event_id):
+    """Process a stored event in the background of this worker."""
+    def _run():
+        with app.app_context():
+            try:
+                process_event(event_id, app.logger)
+            except Exception:
+                app.logger.error(f"[WEBHOOK] {event_id} crashed", exc_info=True)
+
+    _get_executor().submit(_run)
+
+
+def process_event(event_id, logger=None):
+    events = get_collection("webhook_events")
+    now = datetime.utcnow()
+    doc = events.find_one_and_update(
+        {"_id": event_id, "$or": [
+            {"status": "pending"},
+            {"status": "processing", "claimed_at": {"$lte": now - STALE_CLAIM_AFTER}},
+        ]},
+        {"$set": {"status": "processing", "claimed_at": now}, "$inc": {"attempts": 1}}
+    )
+    if doc is None:
+        # Already processed or someone else has it.
+        return
+
+    handler = _handlers().get(doc["source"])
+    if handler is None:
+        events.update_one({"_id": event_id}, {"$set": {"status": "failed", "error": "no handler"}})
+        return
+
+    try:
+        handler(doc["event"])
+    except Exception as e:
+        if logger:
+            logger.error(f"[WEBHOOK] Error applying {event_id} ({doc.get('type')}): {e}")
+        status = "failed" if doc.get("attempts", 0) + 1 >= MAX_ATTEMPTS else "pending"
+        events.update_one({"_id": event_id}, {"$set": {"status": status, "error": str(e)[:500]}})
+        return
+
+    events.update_one(
+        {"_id": event_id},
+        {"$set": {"status": "processed", "processed_at": datetime.utcnow()}, "$unset": {"error": ""}}
+    )
+
+
+def process_pending_events(logger=None):
+    """Scheduler job: anything a worker didn't get to (crash, restart, error)."""
+    cutoff = datetime.utcnow() - STALE_CLAIM_AFTER
+    pending = get_collection("webhook_events").find(
+        {"$or": [
+            {"status": "pending"},
+            {"status": "processing", "claimed_at": {"$lte": cutoff}},
+        ]},
+        {"_id": 1}
+    ).sort("received_at", 1)
+    for doc in pending:
+        process_event(doc["_id"], logger)